@@ -1,24 +1,72 @@
 #!/usr/bin/env python3
 """
 Simple FastAPI server for F5-TTS Vietnamese inference
+
+The model and vocoder are loaded once at startup and kept resident,
+requests are served in-process by a bounded worker pool.
 """
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import subprocess
-from pathlib import Path
+from __future__ import annotations
+
+import asyncio
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from importlib.resources import files
+from pathlib import Path
 
-app = FastAPI(title="F5-TTS Vietnamese API")
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
 
 # Set HuggingFace cache
 os.environ["HF_HOME"] = "/home/psilab/.cache/huggingface"
 os.environ["HF_HUB_CACHE"] = "/home/psilab/.cache/huggingface/hub"
 
+import soundfile as sf
+import torch
+from omegaconf import OmegaConf
+
+from f5_tts.infer.batch_scheduler import BatchScheduler
+from f5_tts.infer.utils_infer import (
+    infer_process,
+    load_model,
+    max_chunk_frames,
+    max_duration,
+    load_vocoder,
+)
+from f5_tts.infer.voice_registry import VoiceRegistry
+from f5_tts.model import DiT, UNetT  # noqa: F401. used for config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 # Base paths
 BASE_DIR = Path(__file__).parent.parent
 REF_AUDIO_DIR = BASE_DIR / "original_voice_ref"
 OUTPUT_DIR = BASE_DIR / "output"
+VOICE_CACHE_DIR = Path(os.environ.get("F5TTS_VOICE_CACHE_DIR", BASE_DIR / "cache/voices"))
+
+# Model settings, override with environment variables
+MODEL_NAME = os.environ.get("F5TTS_MODEL", "F5TTS_Base")
+CKPT_FILE = os.environ.get("F5TTS_CKPT_FILE", str(BASE_DIR / "model/model_last.pt"))
+VOCAB_FILE = os.environ.get("F5TTS_VOCAB_FILE", str(BASE_DIR / "model/vocab.txt"))
+VOCODER_NAME = os.environ.get("F5TTS_VOCODER", "vocos")
+DEVICE = os.environ.get("F5TTS_DEVICE") or None
+VOCODER_DTYPE = os.environ.get("F5TTS_VOCODER_DTYPE") or None  # e.g. float16, bfloat16. vocos only
+COMPILE_VOCODER = os.environ.get("F5TTS_COMPILE_VOCODER", "0") == "1"
+
+# Worker pool settings
+MAX_WORKERS = int(os.environ.get("F5TTS_MAX_WORKERS", 4))  # threads doing inference / file writing
+MAX_PENDING = int(os.environ.get("F5TTS_MAX_PENDING", 16))  # requests admitted (running + queued) before 503
+
+# Dynamic batching settings, chunks of concurrent requests are sampled together
+MAX_BATCH_SIZE = int(os.environ.get("F5TTS_MAX_BATCH_SIZE", 8))
+BATCH_DEADLINE_MS = float(os.environ.get("F5TTS_BATCH_DEADLINE_MS", 50))  # max wait for a batch to fill up
+
+# Text chunking, mel frames per chunk (reference included), shorter chunks batch with less padding
+MAX_CHUNK_FRAMES = int(os.environ.get("F5TTS_MAX_CHUNK_FRAMES", max_chunk_frames))
 
 # Available voices
 VOICES = {
@@ -37,10 +85,128 @@ VOICES = {
 }
 
 
+class TTSEngine:
+    """Resident model + vocoder, shared by all requests of the server process."""
+
+    def __init__(
+        self,
+        model_name,
+        ckpt_file,
+        vocab_file,
+        vocoder_name="vocos",
+        device=None,
+        max_workers=4,
+        max_batch_size=8,
+        batch_deadline=0.05,
+        vocoder_dtype=None,
+        compile_vocoder=False,
+    ):
+        model_cfg = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{model_name}.yaml"))).model
+        model_cls = globals()[model_cfg.backbone]
+        kwargs = {} if device is None else {"device": device}
+
+        self.mel_spec_type = vocoder_name
+        self.sample_rate = model_cfg.mel_spec.target_sample_rate
+        self.vocoder = load_vocoder(vocoder_name=vocoder_name, dtype=vocoder_dtype, compile=compile_vocoder, **kwargs)
+        self.model = load_model(model_cls, model_cfg.arch, ckpt_file, mel_spec_type=vocoder_name, vocab_file=vocab_file, **kwargs)
+        self.device = kwargs.get("device", str(self.model.device))
+
+        # all sampling goes through the scheduler thread, which also keeps the backbone text cache single-user
+        self.scheduler = BatchScheduler(
+            self.model,
+            self.vocoder,
+            mel_spec_type=vocoder_name,
+            max_batch_size=max_batch_size,
+            max_wait=batch_deadline,
+            device=self.device,
+        )
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-worker")
+
+        # voice prompts are preprocessed once, at startup, and cached on disk across restarts
+        self.voices = VoiceRegistry(self.model, cache_dir=str(VOICE_CACHE_DIR), device=self.device)
+
+    def register_voices(self, voices, ref_audio_dir):
+        for voice_id, voice_config in voices.items():
+            ref_audio = ref_audio_dir / voice_config["audio"]
+            if not ref_audio.exists():
+                logger.warning(f"Reference audio not found for voice {voice_id}: {ref_audio}")
+                continue
+            self.voices.register(voice_id, str(ref_audio), voice_config["ref_text"], show_info=logger.info)
+
+    def synthesize(self, voice_id, gen_text, speed, output_path, max_chunk_frames=MAX_CHUNK_FRAMES):
+        timings = {}
+
+        voice = self.voices.get(voice_id)
+
+        start = time.perf_counter()
+        wave, sr, _ = infer_process(
+            voice,
+            voice.ref_text,
+            gen_text,
+            self.model,
+            self.vocoder,
+            mel_spec_type=self.mel_spec_type,
+            show_info=logger.info,
+            progress=None,
+            speed=speed,
+            max_chunk_frames=max_chunk_frames,
+            device=self.device,
+            scheduler=self.scheduler,
+        )
+        timings["inference"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sf.write(str(output_path), wave, sr)
+        timings["write"] = time.perf_counter() - start
+
+        timings["audio_duration"] = len(wave) / sr
+        return timings
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.scheduler.stop()
+
+
+engine: TTSEngine | None = None
+admission: asyncio.Semaphore | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global engine, admission
+    admission = asyncio.Semaphore(MAX_PENDING)
+    logger.info(f"Loading {MODEL_NAME} from {CKPT_FILE} ...")
+    start = time.perf_counter()
+    engine = TTSEngine(
+        MODEL_NAME,
+        CKPT_FILE,
+        VOCAB_FILE,
+        VOCODER_NAME,
+        device=DEVICE,
+        max_workers=MAX_WORKERS,
+        max_batch_size=MAX_BATCH_SIZE,
+        batch_deadline=BATCH_DEADLINE_MS / 1000,
+        vocoder_dtype=getattr(torch, VOCODER_DTYPE) if VOCODER_DTYPE else None,
+        compile_vocoder=COMPILE_VOCODER,
+    )
+    engine.register_voices(VOICES, REF_AUDIO_DIR)
+    logger.info(
+        f"Model ready in {time.perf_counter() - start:.2f}s, {MAX_WORKERS} workers, {MAX_PENDING} pending max, "
+        f"batch size {MAX_BATCH_SIZE}, batch deadline {BATCH_DEADLINE_MS}ms"
+    )
+    yield
+    engine.shutdown()
+    engine = None
+
+
+app = FastAPI(title="F5-TTS Vietnamese API", lifespan=lifespan)
+
+
 class TTSRequest(BaseModel):
     voice: str = "tran_ha_linh"
     text: str
     speed: float = 1.0
+    max_chunk_frames: int | None = Field(None, gt=0)  # default F5TTS_MAX_CHUNK_FRAMES
     output_file: str = "output.wav"
 
 
@@ -58,11 +224,17 @@ def list_voices():
     return {"voices": list(VOICES.keys())}
 
 
+@app.get("/stats")
+def stats():
+    """Get dynamic batching statistics"""
+    return engine.scheduler.stats()
+
+
 @app.post("/synthesize")
-def synthesize(request: TTSRequest):
+async def synthesize(request: TTSRequest):
     """
     Synthesize speech from text
-    
+
     Example:
     {
         "voice": "tran_ha_linh",
@@ -71,70 +243,77 @@ def synthesize(request: TTSRequest):
         "output_file": "output.wav"
     }
     """
+    received = time.perf_counter()
+
     # Validate voice
     if request.voice not in VOICES:
         raise HTTPException(
             status_code=400,
             detail=f"Voice '{request.voice}' not found. Available: {list(VOICES.keys())}"
         )
-    
-    # Get voice config
-    voice_config = VOICES[request.voice]
-    ref_audio = REF_AUDIO_DIR / voice_config["audio"]
-    
-    # Check if reference audio exists
-    if not ref_audio.exists():
+
+    # Check if reference audio was found and preprocessed at startup
+    if request.voice not in engine.voices:
         raise HTTPException(
             status_code=500,
-            detail=f"Reference audio not found: {ref_audio}"
+            detail=f"Reference audio not found: {REF_AUDIO_DIR / VOICES[request.voice]['audio']}"
         )
-    
+
+    # Chunks must leave room to generate after the reference audio, see chunk_text_by_frames
+    chunk_frames = request.max_chunk_frames or MAX_CHUNK_FRAMES
+    ref_frames = engine.voices.get(request.voice).ref_mel_len
+    if min(chunk_frames, max_duration) <= ref_frames + 1:
+        raise HTTPException(
+            status_code=400,
+            detail=f"max_chunk_frames must exceed {ref_frames + 1}, the frames of the reference audio of {request.voice}"
+        )
+
     # Prepare output
     OUTPUT_DIR.mkdir(exist_ok=True)
     output_path = OUTPUT_DIR / request.output_file
-    
-    # Build command
-    command = [
-        "f5-tts_infer-cli",
-        "--model", "F5TTS_Base",
-        "--ref_audio", str(ref_audio),
-        "--ref_text", voice_config["ref_text"],
-        "--gen_text", request.text,
-        "--speed", str(request.speed),
-        "--vocoder_name", "vocos",
-        "--vocab_file", str(BASE_DIR / "model/vocab.txt"),
-        "--ckpt_file", str(BASE_DIR / "model/model_last.pt"),
-        "--output_dir", str(OUTPUT_DIR),
-        "--output_file", request.output_file
-    ]
-    
-    try:
-        # Run inference
-        result = subprocess.run(
-            command,
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        
-        return {
-            "status": "success",
-            "voice": request.voice,
-            "text": request.text,
-            "output_file": str(output_path),
-            "message": "Speech synthesized successfully"
-        }
-        
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Inference failed: {e.stderr}"
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error: {str(e)}"
-        )
+
+    # Bound the number of admitted requests, reject instead of queueing forever
+    if admission.locked():
+        raise HTTPException(status_code=503, detail="Server busy, too many pending requests")
+
+    async with admission:
+        try:
+            loop = asyncio.get_running_loop()
+            timings = await loop.run_in_executor(
+                engine.executor,
+                engine.synthesize,
+                request.voice,
+                request.text,
+                request.speed,
+                output_path,
+                chunk_frames,
+            )
+        except Exception as e:
+            logger.exception("Inference failed")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Inference failed: {str(e)}"
+            )
+
+    total = time.perf_counter() - received
+    busy = sum(timings[k] for k in ("inference", "write"))
+    latency = {
+        "queue_ms": round((total - busy) * 1000, 1),
+        "inference_ms": round(timings["inference"] * 1000, 1),
+        "write_ms": round(timings["write"] * 1000, 1),
+        "total_ms": round(total * 1000, 1),
+        "rtf": round(timings["inference"] / max(timings["audio_duration"], 1e-6), 3),
+    }
+    logger.info(f"[{request.voice}] {len(request.text)} chars -> {timings['audio_duration']:.2f}s audio, {latency}")
+
+    return {
+        "status": "success",
+        "voice": request.voice,
+        "text": request.text,
+        "output_file": str(output_path),
+        "latency": latency,
+        "message": "Speech synthesized successfully"
+    }
 
 
 if __name__ == "__main__":
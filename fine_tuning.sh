@@ -27,22 +27,14 @@ PRETRAIN_CKPT="/mnt/d/ckpts/your_training_dataset/pretrained_model_1200000.pt"
 stage=5
 stop_stage=5
 
-# Chuẩn hoá sample_rate, bỏ qua stage này nếu audio của bạn đã ở định dạng 24Khz
+# Chuẩn bị dữ liệu trong một lượt cho mỗi file: chuyển về 24kHz mono, lọc theo thời lượng và số từ, chuẩn hoá text,
+# tạo metadata.csv, raw.arrow, duration.json và vocab.txt (vocab pretrained + token còn thiếu, xem vocab_missing.txt)
+# Thay cho convert_sr.py, prepare_metadata.py, check_vocab_pretrained.py và prepare_csv_wavs.py
 if [ $stage -le 0 ] && [ $stop_stage -ge 0 ]; then
-    log "Convert sample rate: data/your_dataset ..."
-    python convert_sr.py
-fi
-
-# Chuẩn bị dữ liệu audio_name và text tương ứng
-if [ $stage -le 1 ] && [ $stop_stage -ge 1 ]; then
-    log "Preparing metadata at: data/your_dataset ..."
-    python prepare_metadata.py
-fi
-
-# Bổ sung từ vựng trong bộ dữ liệu của bạn chưa có trong từ vựng của mô hình pretrained
-if [ $stage -le 2 ] && [ $stop_stage -ge 2 ]; then
-    log "Checking missing token in pretrained vocab ... "
-    python check_vocab_pretrained.py
+    log "Ingesting data/your_dataset into $DATASET_DIR ..."
+    python src/f5_tts/train/datasets/ingest_dataset.py data/your_dataset "$DATASET_DIR" --workers "$NUM_WOKERS"
+    # Báo cáo độ bao phủ token của vocab trên tập dữ liệu (vocab_coverage.json)
+    python src/f5_tts/train/datasets/vocab_tools.py coverage "$DATASET_DIR"
 fi
 
 # Mở rộng embedding của mô hình pretrained để hỗ trợ bộ từ vựng mới
@@ -51,12 +43,6 @@ if [ $stage -le 3 ] && [ $stop_stage -ge 3 ]; then
     python extend_embedding_pretrained.py
 fi
 
-# Trích xuất đặc trưng
-if [ $stage -le 4 ] && [ $stop_stage -ge 4 ]; then
-    log "Feature extraction ... "
-    python src/f5_tts/train/datasets/prepare_csv_wavs.py "$DATASET_DIR" "$DATASET_DIR" --workers "$NUM_WOKERS"
-fi
-
 # Chạy quá trình fine-tuning
 if [ $stage -le 5 ] && [ $stop_stage -ge 5 ]; then
     log "Start fine-tuning F5-TTS with your dataset ... "
@@ -70,6 +56,7 @@ if [ $stage -le 5 ] && [ $stop_stage -ge 5 ]; then
         --finetune \
         --log_samples \
         --pretrain "$PRETRAIN_CKPT"
+    ### Thêm --duration_predictor để huấn luyện kèm DurationPredictor (dùng khi infer với --duration_predictor)
     ### Nếu bạn muốn training với nhiều gpu, sử dụng câu lệnh bên dưới:
     # accelerate launch src/f5_tts/train/finetune_cli.py \
     #     --exp_name "$EXP_NAME" \
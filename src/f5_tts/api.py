@@ -16,6 +16,7 @@ from f5_tts.infer.utils_infer import (
     remove_silence_for_generated_wav,
     save_spectrogram,
 )
+from f5_tts.infer.voice_registry import VoiceRegistry
 from f5_tts.model import DiT, UNetT  # noqa: F401. used for config
 from f5_tts.model.utils import seed_everything
 
@@ -31,6 +32,9 @@ class F5TTS:
         vocoder_local_path=None,
         device=None,
         hf_cache_dir=None,
+        voice_cache_dir=None,
+        vocoder_dtype=None,  # autocast dtype of the vocoder, e.g. torch.float16. vocos only
+        compile_vocoder=False,
     ):
         model_cfg = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{model}.yaml")))
         model_cls = globals()[model_cfg.model.backbone]
@@ -59,7 +63,13 @@ class F5TTS:
 
         # Load models
         self.vocoder = load_vocoder(
-            self.mel_spec_type, vocoder_local_path is not None, vocoder_local_path, self.device, hf_cache_dir
+            self.mel_spec_type,
+            vocoder_local_path is not None,
+            vocoder_local_path,
+            self.device,
+            hf_cache_dir,
+            dtype=vocoder_dtype,
+            compile=compile_vocoder,
         )
 
         repo_name, ckpt_step, ckpt_type = "F5-TTS", 1250000, "safetensors"
@@ -84,10 +94,14 @@ class F5TTS:
         self.ema_model = load_model(
             model_cls, model_arc, ckpt_file, self.mel_spec_type, vocab_file, self.ode_method, self.use_ema, self.device
         )
+        self.voices = VoiceRegistry(self.ema_model, cache_dir=voice_cache_dir, device=self.device)
 
     def transcribe(self, ref_audio, language=None):
         return transcribe(ref_audio, language)
 
+    def register_voice(self, voice, ref_file, ref_text=""):
+        return self.voices.register(voice, ref_file, ref_text)
+
     def export_wav(self, wav, file_wave, remove_silence=False):
         sf.write(file_wave, wav, self.target_sample_rate)
 
@@ -107,20 +121,31 @@ class F5TTS:
         target_rms=0.1,
         cross_fade_duration=0.15,
         sway_sampling_coef=-1,
+        sampler=None,
+        cfg_interval=None,
+        cfg_reuse_steps=0,
+        cfg_schedule="constant",
         cfg_strength=2,
         nfe_step=32,
         speed=1.0,
         fix_duration=None,
+        max_chunk_frames=2062,
+        batch_size=1,
         remove_silence=False,
         file_wave=None,
         file_spec=None,
         seed=None,
+        voice=None,
     ):
         if seed is None:
             self.seed = random.randint(0, sys.maxsize)
         seed_everything(self.seed)
 
-        ref_file, ref_text = preprocess_ref_audio_text(ref_file, ref_text, device=self.device)
+        if voice is not None:  # registered with register_voice(), already preprocessed
+            ref_file = self.voices.get(voice)
+            ref_text = ref_file.ref_text
+        else:
+            ref_file, ref_text = preprocess_ref_audio_text(ref_file, ref_text, device=self.device)
 
         wav, sr, spec = infer_process(
             ref_file,
@@ -136,8 +161,14 @@ class F5TTS:
             nfe_step=nfe_step,
             cfg_strength=cfg_strength,
             sway_sampling_coef=sway_sampling_coef,
+            sampler=sampler,
+            cfg_interval=cfg_interval,
+            cfg_reuse_steps=cfg_reuse_steps,
+            cfg_schedule=cfg_schedule,
             speed=speed,
             fix_duration=fix_duration,
+            max_chunk_frames=max_chunk_frames,
+            batch_size=batch_size,
             device=self.device,
         )
 
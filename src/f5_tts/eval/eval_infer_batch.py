@@ -4,6 +4,7 @@ import sys
 sys.path.append(os.getcwd())
 
 import argparse
+import json
 import time
 from importlib.resources import files
 
@@ -20,6 +21,8 @@ from f5_tts.eval.utils_eval import (
 )
 from f5_tts.infer.utils_infer import load_checkpoint, load_vocoder
 from f5_tts.model import CFM, DiT, UNetT  # noqa: F401. used for config
+from f5_tts.model.cfm import CFG_SCHEDULES
+from f5_tts.model.samplers import SAMPLERS
 from f5_tts.model.utils import get_tokenizer
 
 accelerator = Accelerator()
@@ -42,9 +45,14 @@ def main():
 
     parser.add_argument("-nfe", "--nfestep", default=32, type=int)
     parser.add_argument("-o", "--odemethod", default="euler")
+    parser.add_argument("-sp", "--sampler", default=None, choices=list(SAMPLERS), help="instead of odemethod")
     parser.add_argument("-ss", "--swaysampling", default=-1, type=float)
+    parser.add_argument("--cfg_interval", default=None, type=float, nargs=2, help="guidance only for t within")
+    parser.add_argument("--cfg_reuse_steps", default=0, type=int, help="steps reusing the last guidance delta")
+    parser.add_argument("--cfg_schedule", default="constant", choices=list(CFG_SCHEDULES))
 
     parser.add_argument("-t", "--testset", required=True)
+    parser.add_argument("--output_dir", default=None, help="default under results/, named after the settings")
 
     args = parser.parse_args()
 
@@ -54,7 +62,11 @@ def main():
 
     nfe_step = args.nfestep
     ode_method = args.odemethod
+    sampler = args.sampler
     sway_sampling_coef = args.swaysampling
+    cfg_interval = args.cfg_interval
+    cfg_reuse_steps = args.cfg_reuse_steps
+    cfg_schedule = args.cfg_schedule
 
     testset = args.testset
 
@@ -92,12 +104,16 @@ def main():
         metainfo = get_seedtts_testset_metainfo(metalst)
 
     # path to save genereted wavs
-    output_dir = (
+    output_dir = args.output_dir or (
         f"{rel_path}/"
         f"results/{exp_name}_{ckpt_step}/{testset}/"
-        f"seed{seed}_{ode_method}_nfe{nfe_step}_{mel_spec_type}"
+        f"seed{seed}_{sampler or ode_method}_nfe{nfe_step}_{mel_spec_type}"
         f"{f'_ss{sway_sampling_coef}' if sway_sampling_coef else ''}"
-        f"_cfg{cfg_strength}_speed{speed}"
+        f"_cfg{cfg_strength}"
+        f"{f'_cfgint{cfg_interval[0]}-{cfg_interval[1]}' if cfg_interval else ''}"
+        f"{f'_cfgreuse{cfg_reuse_steps}' if cfg_reuse_steps else ''}"
+        f"{f'_cfg{cfg_schedule}' if cfg_schedule != 'constant' else ''}"
+        f"_speed{speed}"
         f"{'_gt-dur' if use_truth_duration else ''}"
         f"{'_no-ref-audio' if no_ref_audio else ''}"
     )
@@ -178,6 +194,10 @@ def main():
                     sway_sampling_coef=sway_sampling_coef,
                     no_ref_audio=no_ref_audio,
                     seed=seed,
+                    sampler=sampler,
+                    cfg_interval=cfg_interval,
+                    cfg_reuse_steps=cfg_reuse_steps,
+                    cfg_schedule=cfg_schedule,
                 )
                 # Final result
                 for i, gen in enumerate(generated):
@@ -196,6 +216,19 @@ def main():
     if accelerator.is_main_process:
         timediff = time.time() - start
         print(f"Done batch inference in {timediff / 60 :.2f} minutes.")
+        with open(f"{output_dir}/_infer_time.json", "w") as f:
+            json.dump(
+                {
+                    "seconds": timediff,
+                    "sampler": sampler or ode_method,
+                    "nfe": nfe_step,
+                    "cfg_interval": cfg_interval,
+                    "cfg_reuse_steps": cfg_reuse_steps,
+                    "cfg_schedule": cfg_schedule,
+                    "processes": accelerator.num_processes,
+                },
+                f,
+            )
 
 
 if __name__ == "__main__":
@@ -10,6 +10,15 @@ accelerate launch src/f5_tts/eval/eval_infer_batch.py -s 0 -n "E2TTS_Base" -c 12
 accelerate launch src/f5_tts/eval/eval_infer_batch.py -s 0 -n "E2TTS_Base" -c 1200000 -t "seedtts_test_en" -o "midpoint" -ss 0
 accelerate launch src/f5_tts/eval/eval_infer_batch.py -s 0 -n "E2TTS_Base" -c 1200000 -t "ls_pc_test_clean" -o "midpoint" -ss 0
 
+# e.g. F5-TTS with a second order multistep solver, see src/f5_tts/model/samplers.py
+accelerate launch src/f5_tts/eval/eval_infer_batch.py -s 0 -n "F5TTS_v1_Base" -t "seedtts_test_en" -nfe 16 -sp "dpm_solver_2m"
+
+# e.g. quality versus NFE of the samplers: WER / SIM / UTMOS against inference time
+python src/f5_tts/eval/eval_sampler_nfe.py -n "F5TTS_v1_Base" -t "seedtts_test_en" --samplers euler heun dpm_solver_2m --nfes 8 16 32
+
+# e.g. guidance schedules, skipping or reusing the unconditional pass on some steps
+python src/f5_tts/eval/eval_sampler_nfe.py -n "F5TTS_v1_Base" -t "seedtts_test_en" --samplers euler --nfes 32 --cfg_variants default reuse=1 interval=0:0.7,reuse=1
+
 # e.g. evaluate F5-TTS 16 NFE result on Seed-TTS test-zh
 python src/f5_tts/eval/eval_seedtts_testset.py -e wer -l zh --gen_wav_dir results/F5TTS_v1_Base_1250000/seedtts_test_zh/seed0_euler_nfe32_vocos_ss-1_cfg2.0_speed1.0 --gpu_nums 8
 python src/f5_tts/eval/eval_seedtts_testset.py -e sim -l zh --gen_wav_dir results/F5TTS_v1_Base_1250000/seedtts_test_zh/seed0_euler_nfe32_vocos_ss-1_cfg2.0_speed1.0 --gpu_nums 8
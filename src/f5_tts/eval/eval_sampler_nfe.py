@@ -0,0 +1,145 @@
+# Quality versus NFE of the ode samplers (see f5_tts.model.samplers) and guidance schedules (see CFM.sample):
+# batch inference with eval_infer_batch.py for each sampler, NFE and cfg variant, then WER, SIM and UTMOS on the
+# generated samples, against inference wall-clock time.
+# cfg variants are "default" or comma separated settings, e.g. "reuse=1", "interval=0:0.7,schedule=linear"
+
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+import argparse
+import json
+import subprocess
+from importlib.resources import files
+
+from f5_tts.model.samplers import SAMPLERS
+
+
+rel_path = str(files("f5_tts").joinpath("../../"))
+eval_dir = str(files("f5_tts").joinpath("eval"))
+
+
+def run(command):
+    print(" ".join(command))
+    subprocess.run(command, check=True)
+
+
+def cfg_variant_args(variant):
+    # eval_infer_batch.py arguments of a cfg variant
+    if variant == "default":
+        return []
+    args = []
+    for setting in variant.split(","):
+        key, value = setting.split("=")
+        if key == "interval":
+            args += ["--cfg_interval"] + value.split(":")
+        elif key == "reuse":
+            args += ["--cfg_reuse_steps", value]
+        elif key == "schedule":
+            args += ["--cfg_schedule", value]
+        else:
+            raise ValueError(f"Unknown cfg setting: {key}, choose from interval, reuse, schedule")
+    return args
+
+
+def read_metric(result_path, name):
+    # last line of the results written by eval_seedtts_testset.py, eval_librispeech_test_clean.py, eval_utmos.py
+    if not os.path.exists(result_path):
+        return None
+    with open(result_path) as f:
+        for line in reversed(f.read().strip().splitlines()):
+            if line.startswith(f"{name}: "):
+                return float(line.split(": ")[1])
+    return None
+
+
+def evaluate(args, sampler, nfe, variant, cfg_args, gen_wav_dir):
+    timing_path = f"{gen_wav_dir}/_infer_time.json"
+    if not (args.skip_existing and os.path.exists(timing_path)):
+        run(
+            ["accelerate", "launch", f"{eval_dir}/eval_infer_batch.py"]
+            + ["-s", str(args.seed), "-n", args.expname, "-c", str(args.ckptstep), "-t", args.testset]
+            + ["-nfe", str(nfe), "-sp", sampler, "-ss", str(args.swaysampling), "--output_dir", gen_wav_dir]
+            + cfg_args
+        )
+
+    row = {"sampler": sampler, "nfe": nfe, "cfg": variant}
+    with open(timing_path) as f:
+        row["infer_seconds"] = json.load(f)["seconds"]
+
+    for metric in args.metrics:
+        result_path = f"{gen_wav_dir}/_{metric}_results.jsonl"
+        if not (args.skip_existing and os.path.exists(result_path)):
+            if metric == "utmos":
+                command = [sys.executable, f"{eval_dir}/eval_utmos.py", "--audio_dir", gen_wav_dir]
+            elif args.testset == "ls_pc_test_clean":
+                command = [sys.executable, f"{eval_dir}/eval_librispeech_test_clean.py", "-e", metric]
+                command += ["-p", args.librispeech_test_clean_path]
+            else:
+                command = [sys.executable, f"{eval_dir}/eval_seedtts_testset.py", "-e", metric]
+                command += ["-l", args.testset.split("_")[-1]]
+            if metric != "utmos":
+                command += ["-g", gen_wav_dir, "-n", str(args.gpu_nums)] + (["--local"] if args.local else [])
+            run(command)
+        row[metric] = read_metric(result_path, metric.upper())
+
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="quality versus NFE of the ode samplers and guidance schedules")
+
+    parser.add_argument("-s", "--seed", default=0, type=int)
+    parser.add_argument("-n", "--expname", required=True)
+    parser.add_argument("-c", "--ckptstep", default=1250000, type=int)
+    parser.add_argument(
+        "-t", "--testset", required=True, choices=["ls_pc_test_clean", "seedtts_test_zh", "seedtts_test_en"]
+    )
+    parser.add_argument("-ss", "--swaysampling", default=-1, type=float)
+
+    parser.add_argument("--samplers", nargs="+", default=list(SAMPLERS), choices=list(SAMPLERS))
+    parser.add_argument("--nfes", nargs="+", type=int, default=[8, 16, 32])
+    parser.add_argument("--cfg_variants", nargs="+", default=["default"], help="e.g. default reuse=1 interval=0:0.7")
+    parser.add_argument("--metrics", nargs="+", default=["wer", "sim", "utmos"], choices=["wer", "sim", "utmos"])
+    parser.add_argument("-g", "--gpu_nums", type=int, default=8, help="Number of GPUs to use for WER / SIM")
+    parser.add_argument("-p", "--librispeech_test_clean_path", type=str, default=None, help="for ls_pc_test_clean")
+    parser.add_argument("--local", action="store_true", help="Use local custom checkpoint directory for WER / SIM")
+    parser.add_argument("--skip_existing", action="store_true", help="Reuse samples and results already there")
+
+    args = parser.parse_args()
+
+    if args.testset == "ls_pc_test_clean" and args.librispeech_test_clean_path is None:
+        parser.error("--librispeech_test_clean_path is required for ls_pc_test_clean")
+
+    results_dir = f"{rel_path}/results/{args.expname}_{args.ckptstep}/{args.testset}/sampler_nfe_seed{args.seed}"
+    summary = []
+
+    for variant in args.cfg_variants:
+        cfg_args = cfg_variant_args(variant)
+        for sampler in args.samplers:
+            for nfe in args.nfes:
+                gen_wav_dir = f"{results_dir}/{sampler}_nfe{nfe}_ss{args.swaysampling}"
+                if variant != "default":
+                    gen_wav_dir += f"_cfg-{variant.replace(',', '_').replace('=', '').replace(':', '-')}"
+                summary.append(evaluate(args, sampler, nfe, variant, cfg_args, gen_wav_dir))
+
+    summary_path = f"{results_dir}/_summary.jsonl"
+    with open(summary_path, "w") as f:
+        for row in summary:
+            f.write(json.dumps(row) + "\n")
+
+    print(f"\n{args.expname} {args.ckptstep} on {args.testset}, sway sampling {args.swaysampling}\n")
+    cfg_width = max(len("cfg"), *(len(variant) for variant in args.cfg_variants))
+    header = f"{'sampler':<14} {'nfe':>4} {'cfg':<{cfg_width}} {'infer (s)':>10}"
+    header += "".join(f" {m.upper():>8}" for m in args.metrics)
+    print(header)
+    print("-" * len(header))
+    for row in summary:
+        metrics = "".join(f" {row[m]:>8.4f}" if row[m] is not None else f" {'-':>8}" for m in args.metrics)
+        print(f"{row['sampler']:<14} {row['nfe']:>4} {row['cfg']:<{cfg_width}} {row['infer_seconds']:>10.1f}{metrics}")
+    print(f"\nSummary saved to {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
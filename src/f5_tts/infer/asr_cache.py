@@ -0,0 +1,127 @@
+# Size-bounded LRU cache for reference audio transcriptions, optionally persisted with SQLite
+# Shared by processes pointing at the same db file, survives restarts
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+import torchaudio
+
+
+def audio_content_hash(audio, sr, sample_rate=16000):
+    """Hash of the decoded audio content (c nw tensor), normalized to mono int16 at a fixed rate."""
+    audio = audio.mean(dim=0)
+    if sr != sample_rate:
+        audio = torchaudio.functional.resample(audio, sr, sample_rate)
+    audio = (audio.clamp(-1.0, 1.0) * 32767).to(torch.int16)
+    return hashlib.md5(audio.numpy().tobytes()).hexdigest()
+
+
+class TranscriptionCache:
+    def __init__(self, max_size=1024, db_path=None, max_disk_size=100_000):
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self.db_path = db_path
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if db_path is not None:
+            if os.path.dirname(db_path):
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self.db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS transcription (key TEXT PRIMARY KEY, text TEXT NOT NULL, last_used REAL)"
+            )
+            self.db.commit()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.memory or self._db_get(key) is not None
+
+    def __len__(self):
+        return len(self.memory)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+
+            text = self._db_get(key)
+            if text is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._memory_put(key, text)
+            self._db_touch(key)
+            return text
+
+    def put(self, key, text):
+        with self.lock:
+            self._memory_put(key, text)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO transcription (key, text, last_used) VALUES (?, ?, ?)",
+                    (key, text, time.time()),
+                )
+                # keep the db bounded as well, evict least recently used rows
+                self.db.execute(
+                    "DELETE FROM transcription WHERE key NOT IN "
+                    "(SELECT key FROM transcription ORDER BY last_used DESC LIMIT ?)",
+                    (self.max_disk_size,),
+                )
+                self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.hits, self.misses = 0, 0
+            if self.db is not None:
+                self.db.execute("DELETE FROM transcription")
+                self.db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.memory),
+            "max_size": self.max_size,
+        }
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    # internal, call with lock held
+
+    def _memory_put(self, key, text):
+        self.memory[key] = text
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def _db_get(self, key):
+        if self.db is None:
+            return None
+        row = self.db.execute("SELECT text FROM transcription WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _db_touch(self, key):
+        self.db.execute("UPDATE transcription SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.db.commit()
@@ -0,0 +1,228 @@
+# Cross-request dynamic batching for CFM.sample
+# Chunks submitted from concurrent requests are grouped by target mel length and sampled together
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from f5_tts.infer.utils_infer import vocode
+
+
+class BatchItem:
+    def __init__(self, cond, text, ref_mel_len, duration, ref_rms, target_rms, sample_kwargs, deadline):
+        self.cond = cond  # ref mel, n d
+        self.text = text  # token list (pinyin / char)
+        self.ref_mel_len = ref_mel_len
+        self.duration = duration  # total mel frames, ref + gen
+        self.ref_rms = ref_rms
+        self.target_rms = target_rms
+        self.sample_kwargs = sample_kwargs  # items are only batched together if these match
+        self.deadline = deadline
+        self.future = Future()
+
+
+class BatchScheduler:
+    """
+    Queue chunks from concurrent callers and run them through one batched ``CFM.sample`` call.
+
+    Items are bucketed by total mel length (like ``get_inference_prompt`` in eval/utils_eval.py) to limit padding,
+    a bucket is flushed once it holds ``max_batch_size`` items (or ``max_batch_frames`` frames),
+    or once its oldest item has waited ``max_wait`` seconds.
+    """
+
+    def __init__(
+        self,
+        model_obj,
+        vocoder,
+        mel_spec_type="vocos",
+        max_batch_size=8,
+        max_wait=0.05,
+        max_batch_frames=None,
+        num_buckets=32,
+        max_duration=4096,
+        device=None,
+    ):
+        self.model_obj = model_obj
+        self.vocoder = vocoder
+        self.mel_spec_type = mel_spec_type
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_batch_frames = max_batch_frames
+        self.num_buckets = num_buckets
+        self.max_duration = max_duration
+        self.device = device if device is not None else model_obj.device
+
+        self.queue = queue.Queue()
+        self.pending = {}  # (bucket, sample_kwargs) -> list[BatchItem]
+        self.stop_event = threading.Event()
+        self.submit_lock = threading.Lock()  # items are queued before stop, so the loop still sees them
+
+        self.num_batches = 0
+        self.num_items = 0
+        self.sample_time = 0.0
+
+        self.thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self.thread.start()
+
+    def submit(
+        self,
+        cond,
+        text,
+        ref_mel_len,
+        duration,
+        ref_rms=1.0,
+        target_rms=0.1,
+        nfe_step=32,
+        cfg_strength=2.0,
+        sway_sampling_coef=-1,
+        sampler=None,
+        cfg_interval=None,
+        cfg_reuse_steps=0,
+        cfg_schedule="constant",
+        seed=None,
+    ):
+        """
+        Enqueue one chunk, returns a Future resolving to ``(generated_wave, generated_mel)``,
+        same as a non-streaming chunk of ``infer_batch_process``.
+
+        cond: ref mel spectrogram, n d
+        text: tokenized ref_text + gen_text, e.g. output of convert_char_to_pinyin for one item
+        """
+        # mirror the duration floor and clamp done in CFM.sample, so we know where to slice the output
+        duration = min(max(duration, max(len(text), cond.shape[0]) + 1), self.max_duration)
+        sample_kwargs = (
+            ("steps", nfe_step),
+            ("cfg_strength", cfg_strength),
+            ("sway_sampling_coef", sway_sampling_coef),
+            ("sampler", sampler),
+            ("cfg_interval", tuple(cfg_interval) if cfg_interval is not None else None),  # hashable, groups batches
+            ("cfg_reuse_steps", cfg_reuse_steps),
+            ("cfg_schedule", cfg_schedule),
+            ("seed", seed),
+        )
+        item = BatchItem(
+            cond, text, ref_mel_len, duration, ref_rms, target_rms, sample_kwargs, time.perf_counter() + self.max_wait
+        )
+        with self.submit_lock:
+            if self.stop_event.is_set():
+                raise RuntimeError("BatchScheduler is stopped.")
+            self.queue.put(item)
+        return item.future
+
+    def stats(self):
+        return {
+            "batches": self.num_batches,
+            "items": self.num_items,
+            "avg_batch_size": self.num_items / max(self.num_batches, 1),
+            "sample_time": self.sample_time,
+        }
+
+    def stop(self):
+        with self.submit_lock:
+            self.stop_event.set()
+        self.thread.join()
+
+    # internal
+
+    def _bucket(self, duration):
+        return min(duration * self.num_buckets // (self.max_duration + 1), self.num_buckets - 1)
+
+    def _add(self, item):
+        key = (self._bucket(item.duration), item.sample_kwargs)
+        self.pending.setdefault(key, []).append(item)
+
+    def _take_ready(self, flush_all=False):
+        now = time.perf_counter()
+        for key, items in list(self.pending.items()):
+            frames = sum(item.duration for item in items)
+            full = len(items) >= self.max_batch_size or (
+                self.max_batch_frames is not None and frames >= self.max_batch_frames
+            )
+            if full or flush_all or now >= items[0].deadline:
+                batch, rest = self._split(items)
+                if rest:
+                    self.pending[key] = rest
+                else:
+                    del self.pending[key]
+                return batch
+        return None
+
+    def _split(self, items):
+        batch, frames = [], 0
+        for item in items:
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or (self.max_batch_frames is not None and frames + item.duration > self.max_batch_frames)
+            ):
+                break
+            batch.append(item)
+            frames += item.duration
+        return batch, items[len(batch) :]
+
+    def _next_timeout(self):
+        if not self.pending:
+            return 0.1
+        earliest = min(items[0].deadline for items in self.pending.values())
+        return max(earliest - time.perf_counter(), 0.0)
+
+    def _run(self):
+        while not self.stop_event.is_set() or self.pending or not self.queue.empty():
+            try:
+                self._add(self.queue.get(timeout=self._next_timeout()))
+                while True:  # drain whatever else arrived meanwhile
+                    self._add(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            batch = self._take_ready(flush_all=self.stop_event.is_set())
+            while batch:
+                self._process(batch)
+                batch = self._take_ready(flush_all=self.stop_event.is_set())
+
+    def _process(self, batch):
+        try:
+            start = time.perf_counter()
+            results = self._sample(batch)
+            self.sample_time += time.perf_counter() - start
+            self.num_batches += 1
+            self.num_items += len(batch)
+        except Exception as e:
+            for item in batch:
+                item.future.set_exception(e)
+            return
+        for item, result in zip(batch, results):
+            item.future.set_result(result)
+
+    def _sample(self, batch):
+        cond = pad_sequence([item.cond for item in batch], batch_first=True).to(self.device)
+        # all frames of the cond mel stay fixed, as without lens; ref_mel_len only slices the output
+        lens = torch.tensor([item.cond.shape[0] for item in batch], dtype=torch.long, device=self.device)
+        duration = torch.tensor([item.duration for item in batch], dtype=torch.long, device=self.device)
+
+        results = []
+        with torch.inference_mode():
+            generated, _ = self.model_obj.sample(
+                cond=cond,
+                text=[item.text for item in batch],
+                duration=duration,
+                lens=lens,
+                max_duration=self.max_duration,
+                **dict(batch[0].sample_kwargs),
+            )
+            del _
+
+            generated = generated.to(torch.float32)  # generated mel spectrogram
+            mels = [generated[i, item.ref_mel_len : item.duration, :].permute(1, 0) for i, item in enumerate(batch)]
+            waves = vocode(self.vocoder, mels, self.mel_spec_type)  # one vocoder call for the batch
+            for item, generated_wave, mel in zip(batch, waves, mels):
+                if item.ref_rms < item.target_rms:
+                    generated_wave = generated_wave * item.ref_rms / item.target_rms
+                results.append((generated_wave, mel))  # on device, callers copy to host once assembled
+
+        return results
@@ -9,6 +9,7 @@ from pathlib import Path
 import numpy as np
 import soundfile as sf
 import tomli
+import torch
 from cached_path import cached_path
 from omegaconf import OmegaConf
 
@@ -16,18 +17,27 @@ from f5_tts.infer.utils_infer import (
     mel_spec_type,
     target_rms,
     cross_fade_duration,
+    max_chunk_frames,
     nfe_step,
     cfg_strength,
     sway_sampling_coef,
+    sampler,
+    cfg_interval,
+    cfg_reuse_steps,
+    cfg_schedule,
     speed,
     fix_duration,
+    batch_size,
     infer_process,
+    load_duration_predictor,
     load_model,
     load_vocoder,
     preprocess_ref_audio_text,
     remove_silence_for_generated_wav,
 )
 from f5_tts.model import DiT, UNetT  # noqa: F401. used for config
+from f5_tts.model.cfm import CFG_SCHEDULES
+from f5_tts.model.samplers import SAMPLERS
 
 
 parser = argparse.ArgumentParser(
@@ -127,6 +137,17 @@ parser.add_argument(
     choices=["vocos", "bigvgan"],
     help=f"Used vocoder name: vocos | bigvgan, default {mel_spec_type}",
 )
+parser.add_argument(
+    "--vocoder_dtype",
+    type=str,
+    choices=["float16", "bfloat16"],
+    help="Run the vocos backbone under autocast with this dtype, default float32",
+)
+parser.add_argument(
+    "--compile_vocoder",
+    action="store_true",
+    help="To torch.compile the vocoder",
+)
 parser.add_argument(
     "--target_rms",
     type=float,
@@ -137,6 +158,11 @@ parser.add_argument(
     type=float,
     help=f"Duration of cross-fade between audio segments in seconds, default {cross_fade_duration}",
 )
+parser.add_argument(
+    "--max_chunk_frames",
+    type=int,
+    help=f"Mel frame budget of one generation chunk (reference audio included), default {max_chunk_frames}",
+)
 parser.add_argument(
     "--nfe_step",
     type=int,
@@ -152,6 +178,31 @@ parser.add_argument(
     type=float,
     help=f"Sway Sampling coefficient, default {sway_sampling_coef}",
 )
+parser.add_argument(
+    "--sampler",
+    type=str,
+    choices=list(SAMPLERS),
+    help="ODE solver, with --nfe_step as its budget of function evaluations, default the model's ode_method (euler)",
+)
+parser.add_argument(
+    "--cfg_interval",
+    type=float,
+    nargs=2,
+    metavar=("START", "END"),
+    help="Apply classifier-free guidance only for flow times within [START, END], default all steps",
+)
+parser.add_argument(
+    "--cfg_reuse_steps",
+    type=int,
+    help="Steps reusing the guidance of the last guided one instead of running the unconditional pass, "
+    f"default {cfg_reuse_steps}",
+)
+parser.add_argument(
+    "--cfg_schedule",
+    type=str,
+    choices=list(CFG_SCHEDULES),
+    help=f"Classifier-free guidance strength over time, default {cfg_schedule}",
+)
 parser.add_argument(
     "--speed",
     type=float,
@@ -162,6 +213,16 @@ parser.add_argument(
     type=float,
     help=f"Fix the total duration (ref and gen audios) in seconds, default {fix_duration}",
 )
+parser.add_argument(
+    "--batch_size",
+    type=int,
+    help=f"Number of text chunks sampled together in one padded batch, default {batch_size}",
+)
+parser.add_argument(
+    "--duration_predictor",
+    action="store_true",
+    help="Size the generated audio with the duration predictor trained alongside the model (stored in ckpt_file)",
+)
 args = parser.parse_args()
 
 
@@ -195,13 +256,22 @@ remove_silence = args.remove_silence or config.get("remove_silence", False)
 load_vocoder_from_local = args.load_vocoder_from_local or config.get("load_vocoder_from_local", False)
 
 vocoder_name = args.vocoder_name or config.get("vocoder_name", mel_spec_type)
+vocoder_dtype = args.vocoder_dtype or config.get("vocoder_dtype", None)
+compile_vocoder = args.compile_vocoder or config.get("compile_vocoder", False)
 target_rms = args.target_rms or config.get("target_rms", target_rms)
 cross_fade_duration = args.cross_fade_duration or config.get("cross_fade_duration", cross_fade_duration)
+max_chunk_frames = args.max_chunk_frames or config.get("max_chunk_frames", max_chunk_frames)
 nfe_step = args.nfe_step or config.get("nfe_step", nfe_step)
 cfg_strength = args.cfg_strength or config.get("cfg_strength", cfg_strength)
 sway_sampling_coef = args.sway_sampling_coef or config.get("sway_sampling_coef", sway_sampling_coef)
+sampler = args.sampler or config.get("sampler", sampler)
+cfg_interval = args.cfg_interval or config.get("cfg_interval", cfg_interval)
+cfg_reuse_steps = args.cfg_reuse_steps or config.get("cfg_reuse_steps", cfg_reuse_steps)
+cfg_schedule = args.cfg_schedule or config.get("cfg_schedule", cfg_schedule)
 speed = args.speed or config.get("speed", speed)
 fix_duration = args.fix_duration or config.get("fix_duration", fix_duration)
+batch_size = args.batch_size or config.get("batch_size", batch_size)
+use_duration_predictor = args.duration_predictor or config.get("duration_predictor", False)
 
 
 # patches for pip pkg user
@@ -239,7 +309,13 @@ if vocoder_name == "vocos":
 elif vocoder_name == "bigvgan":
     vocoder_local_path = "../checkpoints/bigvgan_v2_24khz_100band_256x"
 
-vocoder = load_vocoder(vocoder_name=vocoder_name, is_local=load_vocoder_from_local, local_path=vocoder_local_path)
+vocoder = load_vocoder(
+    vocoder_name=vocoder_name,
+    is_local=load_vocoder_from_local,
+    local_path=vocoder_local_path,
+    dtype=getattr(torch, vocoder_dtype) if vocoder_dtype else None,
+    compile=compile_vocoder,
+)
 
 
 # load TTS model
@@ -270,6 +346,9 @@ if not ckpt_file:
 
 print(f"Using {model}...")
 ema_model = load_model(model_cls, model_cfg.arch, ckpt_file, mel_spec_type=vocoder_name, vocab_file=vocab_file)
+duration_predictor = None
+if use_duration_predictor:
+    duration_predictor = load_duration_predictor(ckpt_file, ema_model.vocab_char_map, device=ema_model.device)
 
 
 # inference process
@@ -320,11 +399,18 @@ def main():
             mel_spec_type=vocoder_name,
             target_rms=target_rms,
             cross_fade_duration=cross_fade_duration,
+            max_chunk_frames=max_chunk_frames,
             nfe_step=nfe_step,
             cfg_strength=cfg_strength,
             sway_sampling_coef=sway_sampling_coef,
+            sampler=sampler,
+            cfg_interval=cfg_interval,
+            cfg_reuse_steps=cfg_reuse_steps,
+            cfg_schedule=cfg_schedule,
             speed=speed,
             fix_duration=fix_duration,
+            batch_size=batch_size,
+            duration_predictor=duration_predictor,
         )
         generated_audio_segments.append(audio_segment)
 
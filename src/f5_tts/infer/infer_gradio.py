@@ -120,6 +120,7 @@ def infer(
     cross_fade_duration=0.15,
     nfe_step=32,
     speed=1,
+    max_chunk_frames=2062,
     show_info=gr.Info,
 ):
     if not ref_audio_orig:
@@ -158,6 +159,7 @@ def infer(
         cross_fade_duration=cross_fade_duration,
         nfe_step=nfe_step,
         speed=speed,
+        max_chunk_frames=max_chunk_frames,
         show_info=show_info,
         progress=gr.Progress(),
     )
@@ -226,6 +228,14 @@ with gr.Blocks() as app_tts:
             step=0.01,
             info="Set the duration of the cross-fade between audio clips.",
         )
+        max_chunk_frames_slider = gr.Slider(
+            label="Chunk Frame Budget",
+            minimum=512,
+            maximum=4096,
+            value=2062,
+            step=64,
+            info="Set the mel frames of one generated clip, reference audio included (~86 frames per second).",
+        )
 
     audio_output = gr.Audio(label="Synthesized Audio")
     spectrogram_output = gr.Image(label="Spectrogram")
@@ -239,6 +249,7 @@ with gr.Blocks() as app_tts:
         cross_fade_duration_slider,
         nfe_slider,
         speed_slider,
+        max_chunk_frames_slider,
     ):
         audio_out, spectrogram_path, ref_text_out = infer(
             ref_audio_input,
@@ -249,6 +260,7 @@ with gr.Blocks() as app_tts:
             cross_fade_duration=cross_fade_duration_slider,
             nfe_step=nfe_slider,
             speed=speed_slider,
+            max_chunk_frames=max_chunk_frames_slider,
         )
         return audio_out, spectrogram_path, ref_text_out
 
@@ -262,6 +274,7 @@ with gr.Blocks() as app_tts:
             cross_fade_duration_slider,
             nfe_slider,
             speed_slider,
+            max_chunk_frames_slider,
         ],
         outputs=[audio_output, spectrogram_output, ref_text_input],
     )
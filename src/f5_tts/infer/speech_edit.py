@@ -11,6 +11,7 @@ from omegaconf import OmegaConf
 
 from f5_tts.infer.utils_infer import load_checkpoint, load_vocoder, save_spectrogram
 from f5_tts.model import CFM, DiT, UNetT  # noqa: F401. used for config
+from f5_tts.model.modules import resample
 from f5_tts.model.utils import convert_char_to_pinyin, get_tokenizer
 
 device = (
@@ -130,9 +131,7 @@ if audio.shape[0] > 1:
 rms = torch.sqrt(torch.mean(torch.square(audio)))
 if rms < target_rms:
     audio = audio * target_rms / rms
-if sr != target_sample_rate:
-    resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-    audio = resampler(audio)
+audio = resample(audio, sr, target_sample_rate)
 offset = 0
 audio_ = torch.zeros(1, 0)
 edit_mask = torch.zeros(1, 0, dtype=torch.bool)
@@ -0,0 +1,102 @@
+# Text chunking for long-form generation
+# Cuts at sentence, then clause, then syllable boundaries (vietnamese syllables are space separated),
+# and balances chunk lengths under a byte budget, so chunks sampled together in one batch need little padding
+
+from __future__ import annotations
+
+import math
+import re
+
+
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|(?<=[。！？])")
+CLAUSE_END = re.compile(r"(?<=[,;:])\s+|(?<=[，；：、])")
+CJK_PUNCTUATION = "。！？，；：、"
+
+# cost of cutting a chunk at each kind of boundary, relative to the balance term (squared relative deviation)
+BREAK_PENALTY = {"sentence": 0.0, "clause": 0.1, "syllable": 0.5, "char": 4.0}
+
+
+def text_cost(text):
+    return len(text.encode("utf-8"))
+
+
+def split_units(text, max_cost):
+    """
+    Split text into units no longer than ``max_cost`` utf-8 bytes, as coarse as possible:
+    whole clauses if they fit, else syllables, else (single overlong syllable) characters.
+    Returns a list of ``(unit, boundary)``, boundary being the kind of break following the unit.
+    """
+    units = []
+    for sentence in SENTENCE_END.split(text):
+        clauses = [clause.strip() for clause in CLAUSE_END.split(sentence) if clause.strip()]
+        for i, clause in enumerate(clauses):
+            boundary = "sentence" if i == len(clauses) - 1 else "clause"
+            if text_cost(clause) <= max_cost:
+                units.append((clause, boundary))
+                continue
+
+            syllables = clause.split()
+            for j, syllable in enumerate(syllables):
+                while text_cost(syllable) > max_cost:
+                    head = ""
+                    for char in syllable:
+                        if text_cost(head + char) > max_cost:
+                            break
+                        head += char
+                    head = head or syllable[0]  # budget below a single character, can't do better
+                    units.append((head, "char"))
+                    syllable = syllable[len(head) :]
+                units.append((syllable, boundary if j == len(syllables) - 1 else "syllable"))
+
+    return units
+
+
+def join_units(units):
+    text = ""
+    for unit, boundary in units:
+        text += unit
+        if boundary != "char" and unit[-1] not in CJK_PUNCTUATION:
+            text += " "
+    return text.strip()
+
+
+def chunk_text_balanced(text, max_cost):
+    """
+    Split text into chunks of at most ``max_cost`` utf-8 bytes.
+
+    Chunk boundaries are chosen by dynamic programming over the units of ``split_units``, minimizing the deviation
+    of every chunk from the mean chunk length, plus a penalty for cutting inside a sentence (or clause, syllable).
+    """
+    if max_cost < 1:
+        raise ValueError(f"max_cost must be at least 1 byte, got {max_cost}")
+
+    units = split_units(text, max_cost)
+    if not units:
+        return []
+
+    # cost of units[i:j] joined, counting one separator per unit
+    prefix = [0]
+    for unit, _ in units:
+        prefix.append(prefix[-1] + text_cost(unit) + 1)
+
+    num_units = len(units)
+    total = prefix[-1] - 1
+    target = total / math.ceil(total / max_cost)
+
+    best = [0.0] + [math.inf] * num_units
+    back = [0] * (num_units + 1)
+    for j in range(1, num_units + 1):
+        penalty = 0.0 if j == num_units else BREAK_PENALTY[units[j - 1][1]]
+        for i in range(j - 1, -1, -1):
+            cost = prefix[j] - prefix[i] - 1
+            if cost > max_cost and i < j - 1:
+                break
+            score = best[i] + ((cost - target) / target) ** 2 + penalty
+            if score < best[j]:
+                best[j], back[j] = score, i
+
+    chunks, j = [], num_units
+    while j > 0:
+        chunks.append(join_units(units[back[j] : j]))
+        j = back[j]
+    return chunks[::-1]
@@ -1,13 +1,15 @@
 # A unified script for inference process
 # Make adjustments inside functions, and consider both gradio and cli scripts if need to change func output format
+import functools
+import math
 import os
+import queue
 import sys
-from concurrent.futures import ThreadPoolExecutor
+import threading
 
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"  # for MPS device compatibility
 sys.path.append(f"{os.path.dirname(os.path.abspath(__file__))}/../../third_party/BigVGAN/")
 
-import hashlib
 import re
 import tempfile
 from importlib.resources import files
@@ -19,20 +21,26 @@ matplotlib.use("Agg")
 import matplotlib.pylab as plt
 import numpy as np
 import torch
+import torch.nn.functional as F
 import torchaudio
 import tqdm
 from huggingface_hub import snapshot_download, hf_hub_download
-from pydub import AudioSegment, silence
 from transformers import pipeline
 from vocos import Vocos
 
-from f5_tts.model import CFM
+from f5_tts.infer.asr_cache import TranscriptionCache, audio_content_hash
+from f5_tts.infer.text_chunker import chunk_text_balanced
+from f5_tts.model import CFM, DurationPredictor
+from f5_tts.model.modules import check_attn_backend, resample
 from f5_tts.model.utils import (
     get_tokenizer,
     convert_char_to_pinyin,
 )
 
-_ref_audio_cache = {}
+# asr transcription cache, keyed by reference audio content. set F5TTS_ASR_CACHE_DB to persist, see configure_asr_cache()
+_ref_audio_cache = TranscriptionCache(
+    max_size=int(os.environ.get("F5TTS_ASR_CACHE_SIZE", 1024)), db_path=os.environ.get("F5TTS_ASR_CACHE_DB")
+)
 
 device = (
     "cuda"
@@ -58,8 +66,18 @@ ode_method = "euler"
 nfe_step = 32  # 16, 32
 cfg_strength = 2.0
 sway_sampling_coef = -1.0
+sampler = None  # ode solver, see f5_tts.model.samplers, None for the model's ode_method (torchdiffeq)
+cfg_interval = None  # (start, end), guidance only for t within, see CFM.sample
+cfg_reuse_steps = 0  # steps reusing the guidance delta of the last guided one
+cfg_schedule = "constant"  # guidance strength over time, see f5_tts.model.cfm.CFG_SCHEDULES
 speed = 1.0
 fix_duration = None
+batch_size = 1  # non-streaming, chunks per CFM.sample call, see benchmark_chunk_batching (slower on CPU)
+max_chunk_frames = 2062  # mel frame budget per chunk, ref + gen, ~22s
+max_duration = 4096  # longest mel CFM.sample generates, see max_duration there
+vocoder_batch_frames = 16384  # non-streaming, frame budget of a padded vocoder batch (mels x longest), ~8 chunks
+vocoder_block_frames = None  # streaming, mel frames vocoded per block (None for whole chunks), see vocode_blocks
+vocoder_context_frames = {"vocos": 32, "bigvgan": 64}  # mel context around a block, covering the receptive field
 
 # -----------------------------------------
 
@@ -97,8 +115,45 @@ def chunk_text(text, max_chars=135):
     return chunks
 
 
+# chunk text into pieces fitting a mel frame budget
+
+
+def chunk_text_by_frames(text, ref_text, ref_audio_len, max_frames=max_chunk_frames, speed=speed):
+    """
+    Splits the input text into chunks whose mel length, estimated the way infer_batch_process does
+    (reference frames per utf-8 byte of reference text), stays within max_frames, reference included.
+    Never above max_duration, whatever max_frames. Cuts at sentence, then clause, then syllable boundaries,
+    and balances chunk lengths, see text_chunker.py.
+
+    Args:
+        text (str): The text to be split.
+        ref_text (str): The reference text.
+        ref_audio_len (int): The reference audio length in mel frames.
+        max_frames (int): The mel frame budget per chunk, reference included.
+        speed (float): The speed the chunks are generated at.
+
+    Returns:
+        List[str]: A list of text chunks.
+    """
+    gen_frames = min(max_frames, max_duration) - ref_audio_len - 1
+    if gen_frames <= 0:
+        raise ValueError(
+            f"Reference audio takes {ref_audio_len} frames, nothing left to generate within {max_frames} frames."
+        )
+    max_bytes = int(gen_frames * speed * len(ref_text.encode("utf-8")) / ref_audio_len)
+    return chunk_text_balanced(text, max(max_bytes, 1))
+
+
 # load vocoder
-def load_vocoder(vocoder_name="vocos", is_local=False, local_path="", device=device, hf_cache_dir=None):
+def load_vocoder(
+    vocoder_name="vocos",
+    is_local=False,
+    local_path="",
+    device=device,
+    hf_cache_dir=None,
+    dtype=None,  # autocast dtype for vocode(), e.g. torch.float16 or torch.bfloat16. None for float32
+    compile=False,  # torch.compile the vocoder, dynamic over mel lengths
+):
     if vocoder_name == "vocos":
         # vocoder = Vocos.from_pretrained("charactr/vocos-mel-24khz").to(device)
         if is_local:
@@ -136,9 +191,84 @@ def load_vocoder(vocoder_name="vocos", is_local=False, local_path="", device=dev
 
         vocoder.remove_weight_norm()
         vocoder = vocoder.eval().to(device)
+
+    # execution options read by vocode()
+    if dtype is not None and vocoder_name == "bigvgan":
+        print("BigVGAN runs in float32, ignoring vocoder dtype", dtype)
+        dtype = None
+    vocoder.autocast_dtype = dtype
+    if compile:
+        (vocoder.backbone if vocoder_name == "vocos" else vocoder).compile(dynamic=True)
     return vocoder
 
 
+# vocode mels of several chunks in one vocoder call
+
+
+def vocode(vocoder, mels, mel_spec_type="vocos", max_batch_frames=None):
+    """
+    Decode mels (list of ``d n``, on the vocoder device) into waves, returned as float32 tensors on that device.
+
+    The mels are padded with silence (the log mel floor) to the longest one and decoded in one batch, each wave
+    then trimmed to its ``n * hop_length`` samples. The last frames of a shorter mel hear that silence where
+    decoding it alone would zero-pad the convolutions. On CPU, and for a single mel, each is decoded as is.
+    With ``max_batch_frames``, mels are grouped by length into batches of at most that many padded frames
+    (at least one mel each), bounding memory whatever the number of mels.
+    With ``load_vocoder(dtype=...)`` the convolutional backbone of vocos runs under autocast. Its ISTFT head stays
+    in float32, as the exponentiated magnitudes overflow half precision.
+    """
+    if len(mels) > 1 and mels[0].device.type == "cpu":  # no kernel launches to save, padding would only add work
+        return [wave for mel in mels for wave in vocode(vocoder, [mel], mel_spec_type)]
+
+    if max_batch_frames is not None and len(mels) * max(mel.shape[-1] for mel in mels) > max_batch_frames:
+        waves = [None] * len(mels)
+        batch = []
+        for i in sorted(range(len(mels)), key=lambda i: mels[i].shape[-1]):
+            if batch and (len(batch) + 1) * mels[i].shape[-1] > max_batch_frames:
+                for j, wave in zip(batch, vocode(vocoder, [mels[j] for j in batch], mel_spec_type)):
+                    waves[j] = wave
+                batch = []
+            batch.append(i)
+        for j, wave in zip(batch, vocode(vocoder, [mels[j] for j in batch], mel_spec_type)):
+            waves[j] = wave
+        return waves
+
+    lens = [mel.shape[-1] for mel in mels]
+    batch = mels[0].new_full((len(mels), mels[0].shape[0], max(lens)), math.log(1e-5))
+    for i, mel in enumerate(mels):
+        batch[i, :, : lens[i]] = mel
+
+    dtype = getattr(vocoder, "autocast_dtype", None)
+    device_type = batch.device.type
+    with torch.inference_mode():
+        if mel_spec_type == "vocos":
+            with torch.autocast(device_type, dtype=dtype, enabled=dtype is not None):
+                x = vocoder.backbone(batch)
+            waves = vocoder.head(x.float())
+        elif mel_spec_type == "bigvgan":
+            waves = vocoder(batch).squeeze(1)
+    return [wave[: n * hop_length] for wave, n in zip(waves, lens)]
+
+
+def vocode_blocks(vocoder, mel, mel_spec_type="vocos", block_frames=128, context_frames=None):
+    """
+    Decode a mel (``d n``) block by block, yielding the wave of each ``block_frames`` frames as soon as it is ready,
+    so that playback can start before the whole mel is vocoded and memory stays bounded by a block.
+
+    Each block is decoded with ``context_frames`` of the mel on both sides (default ``vocoder_context_frames``),
+    whose samples are then dropped. With the receptive field of the vocoder covered, the blocks join without
+    seams, matching decoding the whole mel up to float rounding, so no cross-fade is needed between them.
+    """
+    if context_frames is None:
+        context_frames = vocoder_context_frames[mel_spec_type]
+    num_frames = mel.shape[-1]
+    for start in range(0, num_frames, block_frames):
+        end = min(start + block_frames, num_frames)
+        window_start, window_end = max(start - context_frames, 0), min(end + context_frames, num_frames)
+        wave = vocode(vocoder, [mel[:, window_start:window_end]], mel_spec_type)[0]
+        yield wave[(start - window_start) * hop_length : (end - window_start) * hop_length]
+
+
 # load asr pipeline
 
 asr_pipe = None
@@ -178,6 +308,13 @@ def transcribe(ref_audio, language=None):
     )["text"].strip()
 
 
+def configure_asr_cache(max_size=1024, db_path=None, max_disk_size=100_000):
+    global _ref_audio_cache
+    _ref_audio_cache.close()
+    _ref_audio_cache = TranscriptionCache(max_size=max_size, db_path=db_path, max_disk_size=max_disk_size)
+    return _ref_audio_cache
+
+
 # load model checkpoint for inference
 
 
@@ -197,6 +334,8 @@ def load_checkpoint(model, ckpt_path, device: str, dtype=None, use_ema=True):
         from safetensors.torch import load_file
 
         checkpoint = load_file(ckpt_path, device=device)
+        # a duration predictor stored alongside, see load_duration_predictor
+        checkpoint = {k: v for k, v in checkpoint.items() if not k.startswith("duration_predictor.")}
     else:
         checkpoint = torch.load(ckpt_path, map_location=device, weights_only=True)
 
@@ -248,6 +387,8 @@ def load_model(
     print("model : ", ckpt_path, "\n")
 
     vocab_char_map, vocab_size = get_tokenizer(vocab_file, tokenizer)
+    if "attn_backend" in model_cfg:
+        model_cfg = {**model_cfg, "attn_backend": check_attn_backend(model_cfg["attn_backend"], device)}
     model = CFM(
         transformer=model_cls(**model_cfg, text_num_embeds=vocab_size, mel_dim=n_mel_channels),
         mel_spec_kwargs=dict(
@@ -270,81 +411,228 @@ def load_model(
     return model
 
 
-def remove_silence_edges(audio, silence_threshold=-42):
-    # Remove silence from the start
-    non_silent_start_idx = silence.detect_leading_silence(audio, silence_threshold=silence_threshold)
-    audio = audio[non_silent_start_idx:]
+# load duration predictor, saved in the checkpoint when trained with Trainer(duration_predictor=...)
+
+
+def _duration_predictor_config(state_dict):
+    # constructor arguments of a DurationPredictor, from the shapes of its weights
+    text_num_embeds, text_dim = state_dict["text_embed.weight"].shape
+    conv_layers = len({k.split(".")[1] for k in state_dict if k.startswith("text_blocks.")})
+    conv_mult = state_dict["text_blocks.0.pwconv1.weight"].shape[0] // text_dim if conv_layers else 2
+    return dict(text_num_embeds=text_num_embeds - 1, text_dim=text_dim, conv_layers=conv_layers, conv_mult=conv_mult)
+
+
+def load_duration_predictor(ckpt_path, vocab_char_map, device=device):
+    ckpt_type = ckpt_path.split(".")[-1]
+    if ckpt_type == "safetensors":
+        from safetensors.torch import load_file
+
+        # weights under a duration_predictor. prefix (next to the model's), or a file of the predictor alone
+        checkpoint = load_file(ckpt_path, device="cpu")
+        prefix = "duration_predictor."
+        if any(k.startswith(prefix) for k in checkpoint):
+            checkpoint = {k[len(prefix) :]: v for k, v in checkpoint.items() if k.startswith(prefix)}
+        if "text_embed.weight" in checkpoint and "to_duration.weight" in checkpoint:
+            checkpoint = {
+                "duration_predictor_state_dict": checkpoint,
+                "duration_predictor_config": _duration_predictor_config(checkpoint),
+            }
+    else:
+        checkpoint = torch.load(ckpt_path, map_location="cpu", weights_only=True)
+    if "duration_predictor_state_dict" not in checkpoint:
+        raise ValueError(f"No duration predictor in {ckpt_path}, train one with Trainer(duration_predictor=...)")
 
-    # Remove silence from the end
-    non_silent_end_duration = audio.duration_seconds
-    for ms in reversed(audio):
-        if ms.dBFS > silence_threshold:
-            break
-        non_silent_end_duration -= 0.001
-    trimmed_audio = audio[: int(non_silent_end_duration * 1000)]
+    duration_predictor = DurationPredictor(**checkpoint["duration_predictor_config"], vocab_char_map=vocab_char_map)
+    duration_predictor.load_state_dict(checkpoint["duration_predictor_state_dict"])
+    del checkpoint
 
-    return trimmed_audio
+    return duration_predictor.to(device).eval()
+
+
+# silence detection on in-memory audio (c nw tensors), vectorized with framed rms
+# same policies as pydub.silence (positions in ms, thresholds in dBFS), without per-ms python loops
+
+
+def _ms_to_samples(ms, sr):
+    return ms * sr // 1000
+
+
+def _squared_cumsum(audio):
+    power = audio.double().square().mean(dim=0)  # mean over channels, as pydub rms over interleaved samples
+    return F.pad(power.cumsum(dim=0), (1, 0))
+
+
+def _slice_rms(cumsum, start_ms, end_ms, sr):
+    start = _ms_to_samples(start_ms, sr).clamp(max=cumsum.shape[0] - 1)
+    end = _ms_to_samples(end_ms, sr).clamp(max=cumsum.shape[0] - 1)
+    num = (end - start).clamp(min=1)
+    return ((cumsum[end] - cumsum[start]) / num).clamp(min=0).sqrt()
+
+
+def audio_len_ms(audio, sr):
+    return round(audio.shape[-1] * 1000 / sr)
+
+
+def detect_silence(audio, sr, min_silence_len=1000, silence_thresh=-16, seek_step=1, cumsum=None):
+    """Silent ranges [start_ms, end_ms], as pydub.silence.detect_silence."""
+    seg_len = audio_len_ms(audio, sr)
+    if seg_len < min_silence_len:
+        return []
+    if cumsum is None:
+        cumsum = _squared_cumsum(audio)
+
+    last_slice_start = seg_len - min_silence_len
+    slice_starts = torch.arange(0, last_slice_start + 1, seek_step)
+    if last_slice_start % seek_step:
+        slice_starts = torch.cat((slice_starts, torch.tensor([last_slice_start])))
+    rms = _slice_rms(cumsum, slice_starts, slice_starts + min_silence_len, sr)
+    silence_starts = slice_starts[rms <= 10 ** (silence_thresh / 20)]
+    if len(silence_starts) == 0:
+        return []
+
+    # overlapping silent slices are merged into one range, a new range starts after a gap longer than a slice
+    breaks = torch.nonzero(silence_starts.diff() > min_silence_len).squeeze(-1)
+    range_starts = torch.cat((silence_starts[:1], silence_starts[breaks + 1]))
+    range_ends = torch.cat((silence_starts[breaks], silence_starts[-1:])) + min_silence_len
+    return torch.stack((range_starts, range_ends), dim=-1).tolist()
+
+
+def detect_nonsilent(audio, sr, min_silence_len=1000, silence_thresh=-16, seek_step=1, cumsum=None):
+    """Non-silent ranges [start_ms, end_ms], as pydub.silence.detect_nonsilent."""
+    silent_ranges = detect_silence(audio, sr, min_silence_len, silence_thresh, seek_step, cumsum=cumsum)
+    len_seg = audio_len_ms(audio, sr)
+    if not silent_ranges:
+        return [[0, len_seg]]
+    if silent_ranges[0][0] == 0 and silent_ranges[0][1] == len_seg:
+        return []
+
+    prev_end_i = 0
+    nonsilent_ranges = []
+    for start_i, end_i in silent_ranges:
+        nonsilent_ranges.append([prev_end_i, start_i])
+        prev_end_i = end_i
+    if end_i != len_seg:
+        nonsilent_ranges.append([prev_end_i, len_seg])
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
+    return nonsilent_ranges
+
+
+def split_on_silence(audio, sr, min_silence_len=1000, silence_thresh=-16, keep_silence=100, seek_step=1, cumsum=None):
+    """Non-silent segments of audio padded with keep_silence ms, as pydub.silence.split_on_silence."""
+    len_seg = audio_len_ms(audio, sr)
+    output_ranges = [
+        [start - keep_silence, end + keep_silence]
+        for start, end in detect_nonsilent(audio, sr, min_silence_len, silence_thresh, seek_step, cumsum=cumsum)
+    ]
+    for range_i, range_ii in zip(output_ranges, output_ranges[1:]):
+        if range_ii[0] < range_i[1]:
+            range_i[1] = (range_i[1] + range_ii[0]) // 2
+            range_ii[0] = range_i[1]
+    return [
+        audio[:, _ms_to_samples(max(start, 0), sr) : _ms_to_samples(min(end, len_seg), sr)]
+        for start, end in output_ranges
+    ]
+
+
+def remove_silence_edges(audio, sr, silence_threshold=-42):
+    len_ms = audio_len_ms(audio, sr)
+    if len_ms == 0:
+        return audio
+    cumsum = _squared_cumsum(audio)
+    threshold = 10 ** (silence_threshold / 20)
+
+    # Remove silence from the start, checked in 10ms chunks
+    chunk_starts = torch.arange(0, len_ms, 10)
+    loud = _slice_rms(cumsum, chunk_starts, (chunk_starts + 10).clamp(max=len_ms), sr) >= threshold
+    start_ms = chunk_starts[loud.nonzero()[0, 0]].item() if loud.any() else len_ms
+
+    # Remove silence from the end, checked in 1ms steps
+    ms = torch.arange(start_ms, len_ms)
+    loud = _slice_rms(cumsum, ms, ms + 1, sr) > threshold
+    end_ms = ms[loud.nonzero()[-1, 0]].item() + 1 if loud.any() else start_ms
+
+    return audio[:, _ms_to_samples(start_ms, sr) : _ms_to_samples(end_ms, sr)]
+
+
+def clip_ref_audio(audio, sr, show_info=print):
+    """Clip reference audio to at most ~12s, preferably at long, then short silences."""
+    cumsum = _squared_cumsum(audio)
+    max_samples, min_samples = _ms_to_samples(12000, sr), _ms_to_samples(6000, sr)
+
+    def take_segments(segs, attempt):
+        kept, length = [], 0
+        for seg in segs:
+            if length > min_samples and length + seg.shape[-1] > max_samples:
+                show_info(f"Audio is over 15s, clipping short. ({attempt})")
+                break
+            kept.append(seg)
+            length += seg.shape[-1]
+        return torch.cat(kept, dim=-1) if kept else audio[:, :0]
+
+    # 1. try to find long silence for clipping
+    segs = split_on_silence(
+        audio, sr, min_silence_len=1000, silence_thresh=-50, keep_silence=1000, seek_step=10, cumsum=cumsum
+    )
+    clipped = take_segments(segs, 1)
+
+    # 2. try to find short silence for clipping if 1. failed
+    if clipped.shape[-1] > max_samples:
+        segs = split_on_silence(
+            audio, sr, min_silence_len=100, silence_thresh=-40, keep_silence=1000, seek_step=10, cumsum=cumsum
+        )
+        clipped = take_segments(segs, 2)
+
+    # 3. if no proper silence found for clipping
+    if clipped.shape[-1] > max_samples:
+        clipped = clipped[:, :max_samples]
+        show_info("Audio is over 15s, clipping short. (3)")
+
+    return clipped
 
 
 # preprocess reference audio and text
 
 
-def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_info=print, device=device):
+def load_ref_audio(path):
+    """
+    Decode a reference audio file into (audio, sr), audio a float32 c nw tensor. With torchaudio, falling back to
+    pydub (ffmpeg) for formats the installed torchaudio backend cannot decode, e.g. m4a or webm uploads.
+    """
+    try:
+        return torchaudio.load(path)
+    except Exception:
+        from pydub import AudioSegment
+
+        aseg = AudioSegment.from_file(path)
+        samples = np.array(aseg.get_array_of_samples(), dtype=np.float32).reshape(-1, aseg.channels).T
+        return torch.from_numpy(samples / (1 << (8 * aseg.sample_width - 1))), aseg.frame_rate
+
+
+def preprocess_ref_audio(ref_audio_orig, ref_text, clip_short=True, show_info=print, device=device):
+    """In-memory version of preprocess_ref_audio_text, returns (audio, sr, ref_text) with audio a c nw tensor."""
     show_info("Converting audio...")
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-        aseg = AudioSegment.from_file(ref_audio_orig)
+    audio, sr = load_ref_audio(ref_audio_orig)
 
-        if clip_short:
-            # 1. try to find long silence for clipping
-            non_silent_segs = silence.split_on_silence(
-                aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=1000, seek_step=10
-            )
-            non_silent_wave = AudioSegment.silent(duration=0)
-            for non_silent_seg in non_silent_segs:
-                if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 12000:
-                    show_info("Audio is over 15s, clipping short. (1)")
-                    break
-                non_silent_wave += non_silent_seg
-
-            # 2. try to find short silence for clipping if 1. failed
-            if len(non_silent_wave) > 12000:
-                non_silent_segs = silence.split_on_silence(
-                    aseg, min_silence_len=100, silence_thresh=-40, keep_silence=1000, seek_step=10
-                )
-                non_silent_wave = AudioSegment.silent(duration=0)
-                for non_silent_seg in non_silent_segs:
-                    if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 12000:
-                        show_info("Audio is over 15s, clipping short. (2)")
-                        break
-                    non_silent_wave += non_silent_seg
-
-            aseg = non_silent_wave
-
-            # 3. if no proper silence found for clipping
-            if len(aseg) > 12000:
-                aseg = aseg[:12000]
-                show_info("Audio is over 15s, clipping short. (3)")
-
-        aseg = remove_silence_edges(aseg) + AudioSegment.silent(duration=50)
-        aseg.export(f.name, format="wav")
-        ref_audio = f.name
+    if clip_short:
+        audio = clip_ref_audio(audio, sr, show_info=show_info)
 
-    # Compute a hash of the reference audio file
-    with open(ref_audio, "rb") as audio_file:
-        audio_data = audio_file.read()
-        audio_hash = hashlib.md5(audio_data).hexdigest()
+    audio = remove_silence_edges(audio, sr)
+    audio = F.pad(audio, (0, _ms_to_samples(50, sr)))
 
     if not ref_text.strip():
-        global _ref_audio_cache
-        if audio_hash in _ref_audio_cache:
+        # Hash the decoded audio content rather than a file, so hits hold across restarts and encodings
+        audio_hash = audio_content_hash(audio, sr)
+        cached_text = _ref_audio_cache.get(audio_hash)
+        if cached_text is not None:
             # Use cached asr transcription
             show_info("Using cached reference text...")
-            ref_text = _ref_audio_cache[audio_hash]
+            ref_text = cached_text
         else:
             show_info("No reference text provided, transcribing reference audio...")
-            ref_text = transcribe(ref_audio)
+            ref_text = transcribe({"raw": audio.mean(dim=0).numpy(), "sampling_rate": sr})
             # Cache the transcribed text (not caching custom ref_text, enabling users to do manual tweak)
-            _ref_audio_cache[audio_hash] = ref_text
+            _ref_audio_cache.put(audio_hash, ref_text)
     else:
         show_info("Using custom reference text...")
 
@@ -357,9 +645,129 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_in
 
     print("\nref_text  ", ref_text)
 
+    return audio, sr, ref_text
+
+
+def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_info=print, device=device):
+    audio, sr, ref_text = preprocess_ref_audio(ref_audio_orig, ref_text, clip_short, show_info, device)
+
+    # callers expect a path to the processed audio
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+        ref_audio = f.name
+    torchaudio.save(ref_audio, audio, sr)
+
     return ref_audio, ref_text
 
 
+# cross-fade generated chunks
+
+
+@functools.lru_cache(maxsize=8)
+def get_fade_windows(cross_fade_samples):
+    fade_in = np.linspace(0, 1, cross_fade_samples)
+    fade_out = fade_in[::-1].copy()
+    fade_in.flags.writeable, fade_out.flags.writeable = False, False
+    return fade_out, fade_in
+
+
+def cross_fade_into(tail, wave, cross_fade_samples, fade=True):
+    # append wave to the held back tail, fading it in unless it continues the same chunk.
+    # returns the samples ready for output and the new tail
+    overlap_samples = min(cross_fade_samples, len(tail), len(wave)) if fade else 0
+    if overlap_samples > 0:
+        fade_out, fade_in = get_fade_windows(overlap_samples)
+        cross_faded_overlap = tail[-overlap_samples:] * fade_out + wave[:overlap_samples] * fade_in
+        wave = np.concatenate([tail[:-overlap_samples], cross_faded_overlap, wave[overlap_samples:]])
+    else:
+        wave = np.concatenate([tail, wave])
+
+    ready = len(wave) - min(cross_fade_samples, len(wave))
+    return wave[:ready], wave[ready:]
+
+
+def cross_fade_segments(waves, cross_fade_samples):
+    """
+    Yield the cross-faded concatenation of ``waves`` piece by piece, consuming them lazily.
+    Only the last ``cross_fade_samples`` of output are held back, until the next wave fades into them.
+    """
+    tail = np.zeros(0, dtype=np.float32)
+    for wave in waves:
+        ready, tail = cross_fade_into(tail, wave, cross_fade_samples)
+        if len(ready) > 0:
+            yield ready
+
+    if len(tail) > 0:
+        yield tail
+
+
+def cross_fade_block_segments(chunks, cross_fade_samples):
+    """
+    cross_fade_segments over chunks arriving as iterables of consecutive blocks (see vocode_blocks), same samples.
+    Blocks are passed on as they come. The start of a chunk is gathered only until it covers the fade into the
+    previous one.
+    """
+    tail = np.zeros(0, dtype=np.float32)
+    for blocks in chunks:
+        head = np.zeros(0, dtype=np.float32)  # start of the chunk, not faded in yet
+        faded = False
+        for block in blocks:
+            if faded:
+                ready, tail = cross_fade_into(tail, block, cross_fade_samples, fade=False)
+            else:
+                head = np.concatenate([head, block])
+                if len(head) < min(cross_fade_samples, len(tail)):
+                    continue
+                ready, tail = cross_fade_into(tail, head, cross_fade_samples)
+                faded = True
+            if len(ready) > 0:
+                yield ready
+        if not faded:  # chunk shorter than the fade
+            ready, tail = cross_fade_into(tail, head, cross_fade_samples)
+            if len(ready) > 0:
+                yield ready
+
+    if len(tail) > 0:
+        yield tail
+
+
+def assemble_waves(waves, cross_fade_duration=cross_fade_duration, sample_rate=target_sample_rate, writer=None):
+    """
+    Concatenate generated chunks, cross-fading ``cross_fade_duration`` seconds between neighbours.
+
+    The output length is known upfront, so the result is allocated once and every chunk is written in place,
+    instead of re-concatenating the accumulated wave for each chunk.
+    With ``writer`` (anything with ``write(array)``, e.g. ``soundfile.SoundFile``), finished samples are streamed
+    to it instead and the number of samples written is returned.
+    """
+    cross_fade_samples = max(int(cross_fade_duration * sample_rate), 0)
+
+    if writer is not None:
+        num_samples = 0
+        for segment in cross_fade_segments(waves, cross_fade_samples):
+            writer.write(segment)
+            num_samples += len(segment)
+        return num_samples
+
+    # overlap with the accumulated output, same rule as cross-fading pairwise
+    starts, overlaps, total = [], [], 0
+    for wave in waves:
+        overlap_samples = min(cross_fade_samples, total, len(wave))
+        starts.append(total - overlap_samples)
+        overlaps.append(overlap_samples)
+        total += len(wave) - overlap_samples
+
+    final_wave = np.empty(total, dtype=np.result_type(*[wave.dtype for wave in waves]))
+    for wave, start, overlap_samples in zip(waves, starts, overlaps):
+        if overlap_samples > 0:
+            fade_out, fade_in = get_fade_windows(overlap_samples)
+            overlap = final_wave[start : start + overlap_samples]
+            overlap *= fade_out
+            overlap += wave[:overlap_samples] * fade_in
+        final_wave[start + overlap_samples : start + len(wave)] = wave[overlap_samples:]
+
+    return final_wave
+
+
 # infer process: chunk text -> infer batches [i.e. infer_batch_process()]
 
 
@@ -377,14 +785,27 @@ def infer_process(
     nfe_step=nfe_step,
     cfg_strength=cfg_strength,
     sway_sampling_coef=sway_sampling_coef,
+    sampler=sampler,
+    cfg_interval=cfg_interval,
+    cfg_reuse_steps=cfg_reuse_steps,
+    cfg_schedule=cfg_schedule,
     speed=speed,
     fix_duration=fix_duration,
     device=device,
+    scheduler=None,
+    batch_size=batch_size,
+    duration_predictor=None,
+    max_chunk_frames=max_chunk_frames,
 ):
     # Split the input text into batches
-    audio, sr = torchaudio.load(ref_audio)
-    max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (22 - audio.shape[-1] / sr))
-    gen_text_batches = chunk_text(gen_text, max_chars=max_chars)
+    if isinstance(ref_audio, str):
+        audio, sr = torchaudio.load(ref_audio)
+        ref_prompt = (audio, sr)
+    else:  # preprocessed VoicePrompt, see voice_registry.py
+        audio, sr, ref_text = ref_audio.audio, ref_audio.sample_rate, ref_audio.ref_text
+        ref_prompt = ref_audio
+    ref_audio_len = int(audio.shape[-1] / sr * target_sample_rate) // hop_length
+    gen_text_batches = chunk_text_by_frames(gen_text, ref_text, ref_audio_len, max_frames=max_chunk_frames, speed=speed)
     for i, gen_text in enumerate(gen_text_batches):
         print(f"gen_text {i}", gen_text)
     print("\n")
@@ -392,7 +813,7 @@ def infer_process(
     show_info(f"Generating audio in {len(gen_text_batches)} batches...")
     return next(
         infer_batch_process(
-            (audio, sr),
+            ref_prompt,
             ref_text,
             gen_text_batches,
             model_obj,
@@ -404,9 +825,16 @@ def infer_process(
             nfe_step=nfe_step,
             cfg_strength=cfg_strength,
             sway_sampling_coef=sway_sampling_coef,
+            sampler=sampler,
+            cfg_interval=cfg_interval,
+            cfg_reuse_steps=cfg_reuse_steps,
+            cfg_schedule=cfg_schedule,
             speed=speed,
             fix_duration=fix_duration,
             device=device,
+            scheduler=scheduler,
+            batch_size=batch_size,
+            duration_predictor=duration_predictor,
         )
     )
 
@@ -427,135 +855,246 @@ def infer_batch_process(
     nfe_step=32,
     cfg_strength=2.0,
     sway_sampling_coef=-1,
+    sampler=None,
+    cfg_interval=None,
+    cfg_reuse_steps=0,
+    cfg_schedule="constant",
     speed=1,
     fix_duration=None,
     device=None,
     streaming=False,
     chunk_size=2048,
+    vocoder_block_frames=vocoder_block_frames,  # streaming, vocode chunks block by block, see vocode_blocks
+    vocoder_batch_frames=vocoder_batch_frames,  # non-streaming, frame budget of a vocoder batch, see vocode
+    scheduler=None,  # BatchScheduler, to batch chunks together with those of concurrent requests
+    batch_size=batch_size,  # non-streaming, chunks sampled together in padded batches, 1 samples them one by one
+    duration_predictor=None,  # DurationPredictor, to size the generated mel instead of the utf-8 byte ratio
 ):
-    audio, sr = ref_audio
-    if audio.shape[0] > 1:
-        audio = torch.mean(audio, dim=0, keepdim=True)
-
-    rms = torch.sqrt(torch.mean(torch.square(audio)))
-    if rms < target_rms:
-        audio = audio * target_rms / rms
-    if sr != target_sample_rate:
-        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-        audio = resampler(audio)
-    audio = audio.to(device)
+    if isinstance(ref_audio, tuple):
+        audio, sr = ref_audio
+        if audio.shape[0] > 1:
+            audio = torch.mean(audio, dim=0, keepdim=True)
+
+        rms = torch.sqrt(torch.mean(torch.square(audio)))
+        if rms < target_rms:
+            audio = audio * target_rms / rms
+        audio = resample(audio, sr, target_sample_rate)
+        audio = audio.to(device)
+        cond, ref_tokens = audio, None
+
+        if len(ref_text[-1].encode("utf-8")) == 1:
+            ref_text = ref_text + " "
+    else:  # preprocessed VoicePrompt, skip loudness normalization, resampling, mel and ref_text tokenization
+        voice = ref_audio
+        audio, rms, target_rms, ref_text = voice.audio.to(device), voice.rms, voice.target_rms, voice.ref_text
+        cond, ref_tokens = voice.ref_mel.unsqueeze(0).to(device), voice.ref_tokens
 
     generated_waves = []
     spectrograms = []
 
-    if len(ref_text[-1].encode("utf-8")) == 1:
-        ref_text = ref_text + " "
+    ref_audio_len = audio.shape[-1] // hop_length
+    if duration_predictor is not None:
+        ref_text_tokens = len(ref_tokens if ref_tokens is not None else convert_char_to_pinyin([ref_text])[0])
 
-    def process_batch(gen_text):
+    def prepare_batch(gen_text):
         local_speed = speed
         if len(gen_text.encode("utf-8")) < 10:
             local_speed = 0.3
 
         # Prepare the text
-        text_list = [ref_text + gen_text]
-        final_text_list = convert_char_to_pinyin(text_list)
+        if ref_tokens is not None:
+            final_text_list = [ref_tokens + convert_char_to_pinyin([gen_text])[0]]
+        else:
+            text_list = [ref_text + gen_text]
+            final_text_list = convert_char_to_pinyin(text_list)
 
-        ref_audio_len = audio.shape[-1] // hop_length
         if fix_duration is not None:
             duration = int(fix_duration * target_sample_rate / hop_length)
+        elif duration_predictor is not None:
+            duration = duration_predictor.predict(
+                final_text_list, ref_text_tokens, ref_audio_len, speed=local_speed
+            ).item()
         else:
             # Calculate duration
             ref_text_len = len(ref_text.encode("utf-8"))
             gen_text_len = len(gen_text.encode("utf-8"))
             duration = ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / local_speed)
 
+        return final_text_list, duration
+
+    def get_ref_mel():  # n d
+        if cond.ndim == 3:
+            return cond[0]
+        with torch.inference_mode():
+            return model_obj.mel_spec(cond).permute(0, 2, 1)[0]
+
+    def decode(mels):  # generated mels, d n each, vocoded together. waves and mels stay on device
+        waves = vocode(vocoder, mels, mel_spec_type, max_batch_frames=vocoder_batch_frames)
+        if rms < target_rms:
+            waves = [wave * rms / target_rms for wave in waves]
+        return list(zip(waves, mels))
+
+    def sample_batch(gen_text):  # generated mel of a chunk, d n
+        final_text_list, duration = prepare_batch(gen_text)
+
         # inference
         with torch.inference_mode():
             generated, _ = model_obj.sample(
-                cond=audio,
+                cond=cond,
                 text=final_text_list,
                 duration=duration,
                 steps=nfe_step,
                 cfg_strength=cfg_strength,
                 sway_sampling_coef=sway_sampling_coef,
+                sampler=sampler,
+                cfg_interval=cfg_interval,
+                cfg_reuse_steps=cfg_reuse_steps,
+                cfg_schedule=cfg_schedule,
+                max_duration=max_duration,
             )
             del _
 
             generated = generated.to(torch.float32)  # generated mel spectrogram
-            generated = generated[:, ref_audio_len:, :]
-            generated = generated.permute(0, 2, 1)
-            if mel_spec_type == "vocos":
-                generated_wave = vocoder.decode(generated)
-            elif mel_spec_type == "bigvgan":
-                generated_wave = vocoder(generated)
-            if rms < target_rms:
-                generated_wave = generated_wave * rms / target_rms
-
-            # wav -> numpy
-            generated_wave = generated_wave.squeeze().cpu().numpy()
-
-            if streaming:
-                for j in range(0, len(generated_wave), chunk_size):
-                    yield generated_wave[j : j + chunk_size], target_sample_rate
-            else:
-                generated_cpu = generated[0].cpu().numpy()
-                del generated
-                yield generated_wave, generated_cpu
+            generated = generated[0, ref_audio_len:, :]
+            return generated.permute(1, 0)
+
+    def sample_batches(gen_texts):  # generated mels of the chunks, d n each
+        # chunks of one request share the reference prompt, sample them together as one padded batch
+        if len(gen_texts) == 1:
+            return [sample_batch(gen_texts[0])]
+
+        ref_mel = get_ref_mel().unsqueeze(0)
+        texts, durations = [], []
+        for gen_text in gen_texts:
+            final_text_list, duration = prepare_batch(gen_text)
+            texts.append(final_text_list[0])
+            # mirror the duration floor and clamp done in CFM.sample, so we know where each output ends
+            durations.append(min(max(duration, max(len(final_text_list[0]), ref_mel.shape[1]) + 1), max_duration))
+
+        with torch.inference_mode():
+            generated, _ = model_obj.sample(
+                cond=ref_mel.expand(len(texts), -1, -1),
+                text=texts,
+                duration=torch.tensor(durations, dtype=torch.long, device=ref_mel.device),
+                lens=torch.full((len(texts),), ref_mel.shape[1], dtype=torch.long, device=ref_mel.device),
+                steps=nfe_step,
+                cfg_strength=cfg_strength,
+                sway_sampling_coef=sway_sampling_coef,
+                sampler=sampler,
+                cfg_interval=cfg_interval,
+                cfg_reuse_steps=cfg_reuse_steps,
+                cfg_schedule=cfg_schedule,
+                max_duration=max_duration,
+            )
+            del _
+
+            generated = generated.to(torch.float32)  # generated mel spectrogram
+            return [generated[i, ref_audio_len:dur, :].permute(1, 0) for i, dur in enumerate(durations)]
 
     if streaming:
-        for gen_text in progress.tqdm(gen_text_batches) if progress is not None else gen_text_batches:
-            for chunk in process_batch(gen_text):
-                yield chunk
+        # producer thread samples and vocodes the next text chunk while the current one is being consumed,
+        # queueing the wave block by block (whole chunks without vocoder_block_frames), then None once the chunk ends.
+        # chunk slots, so generation stays at most a couple of chunks ahead of playback
+        wave_queue = queue.Queue()
+        chunk_slots = threading.Semaphore(2)
+        stop_event = threading.Event()
+
+        def acquire_slot():  # gives up once the consumer is gone
+            while not stop_event.is_set():
+                if chunk_slots.acquire(timeout=0.1):
+                    return True
+            return False
+
+        def producer():
+            try:
+                for gen_text in gen_text_batches:
+                    if not acquire_slot():
+                        return
+                    generated = sample_batch(gen_text)
+                    block_frames = vocoder_block_frames or max(generated.shape[-1], 1)
+                    for block in vocode_blocks(vocoder, generated, mel_spec_type, block_frames=block_frames):
+                        if stop_event.is_set():
+                            return
+                        if rms < target_rms:
+                            block = block * rms / target_rms
+                        wave_queue.put(block.cpu().numpy())
+                    wave_queue.put(None)
+            except Exception as e:  # surface errors to the consumer
+                wave_queue.put(e)
+
+        producer_thread = threading.Thread(target=producer, daemon=True)
+        producer_thread.start()
+
+        def queued_blocks():  # of the next chunk
+            while (block := wave_queue.get()) is not None:
+                if isinstance(block, Exception):
+                    raise block
+                yield block
+            chunk_slots.release()
+
+        def queued_chunks():
+            for _ in progress.tqdm(gen_text_batches) if progress is not None else gen_text_batches:
+                yield queued_blocks()
+
+        # same cross-fade as the non-streaming path, applied incrementally
+        cross_fade_samples = max(int(cross_fade_duration * target_sample_rate), 0)
+        try:
+            for segment in cross_fade_block_segments(queued_chunks(), cross_fade_samples):
+                for j in range(0, len(segment), chunk_size):
+                    yield segment[j : j + chunk_size], target_sample_rate
+        finally:
+            # wait out the chunk being sampled, the model and its caches are free for the next caller once we return
+            stop_event.set()
+            producer_thread.join()
     else:
-        with ThreadPoolExecutor() as executor:
-            futures = [executor.submit(process_batch, gen_text) for gen_text in gen_text_batches]
+        if scheduler is not None:
+            # hand chunks over to the shared scheduler, which batches them with chunks of concurrent requests
+            ref_mel = get_ref_mel()
+            futures = []
+            for gen_text in gen_text_batches:
+                final_text_list, duration = prepare_batch(gen_text)
+                futures.append(
+                    scheduler.submit(
+                        ref_mel,
+                        final_text_list[0],
+                        ref_audio_len,
+                        duration,
+                        ref_rms=rms,
+                        target_rms=target_rms,
+                        nfe_step=nfe_step,
+                        cfg_strength=cfg_strength,
+                        sway_sampling_coef=sway_sampling_coef,
+                        sampler=sampler,
+                        cfg_interval=cfg_interval,
+                        cfg_reuse_steps=cfg_reuse_steps,
+                        cfg_schedule=cfg_schedule,
+                    )
+                )
             for future in progress.tqdm(futures) if progress is not None else futures:
-                result = future.result()
-                if result:
-                    generated_wave, generated_mel_spec = next(result)
-                    generated_waves.append(generated_wave)
-                    spectrograms.append(generated_mel_spec)
+                generated_wave, generated_mel_spec = future.result()
+                generated_waves.append(generated_wave)
+                spectrograms.append(generated_mel_spec)
+        else:
+            # sort by length to limit padding, then sample batch_size chunks per CFM.sample call
+            order = sorted(range(len(gen_text_batches)), key=lambda i: len(gen_text_batches[i].encode("utf-8")))
+            batches = [order[i : i + max(batch_size, 1)] for i in range(0, len(order), max(batch_size, 1))]
+            mels = [None] * len(gen_text_batches)
+            for batch in progress.tqdm(batches) if progress is not None else batches:
+                for i, mel in zip(batch, sample_batches([gen_text_batches[i] for i in batch])):
+                    mels[i] = mel
+            # then vocode the mels of all chunks together, whatever the batch size, in batches of bounded frames
+            for generated_wave, generated_mel_spec in decode(mels) if mels else []:
+                generated_waves.append(generated_wave)
+                spectrograms.append(generated_mel_spec)
 
         if generated_waves:
-            if cross_fade_duration <= 0:
-                # Simply concatenate
-                final_wave = np.concatenate(generated_waves)
-            else:
-                # Combine all generated waves with cross-fading
-                final_wave = generated_waves[0]
-                for i in range(1, len(generated_waves)):
-                    prev_wave = final_wave
-                    next_wave = generated_waves[i]
-
-                    # Calculate cross-fade samples, ensuring it does not exceed wave lengths
-                    cross_fade_samples = int(cross_fade_duration * target_sample_rate)
-                    cross_fade_samples = min(cross_fade_samples, len(prev_wave), len(next_wave))
-
-                    if cross_fade_samples <= 0:
-                        # No overlap possible, concatenate
-                        final_wave = np.concatenate([prev_wave, next_wave])
-                        continue
-
-                    # Overlapping parts
-                    prev_overlap = prev_wave[-cross_fade_samples:]
-                    next_overlap = next_wave[:cross_fade_samples]
-
-                    # Fade out and fade in
-                    fade_out = np.linspace(1, 0, cross_fade_samples)
-                    fade_in = np.linspace(0, 1, cross_fade_samples)
-
-                    # Cross-faded overlap
-                    cross_faded_overlap = prev_overlap * fade_out + next_overlap * fade_in
-
-                    # Combine
-                    new_wave = np.concatenate(
-                        [prev_wave[:-cross_fade_samples], cross_faded_overlap, next_wave[cross_fade_samples:]]
-                    )
-
-                    final_wave = new_wave
+            # waves -> numpy, one device to host copy for all chunks
+            splits = np.cumsum([len(wave) for wave in generated_waves])[:-1]
+            generated_waves = np.split(torch.cat(generated_waves).cpu().numpy(), splits)
+            final_wave = assemble_waves(generated_waves, cross_fade_duration)
 
             # Create a combined spectrogram
-            combined_spectrogram = np.concatenate(spectrograms, axis=1)
+            combined_spectrogram = torch.cat(spectrograms, dim=1).cpu().numpy()
 
             yield final_wave, target_sample_rate, combined_spectrogram
 
@@ -567,15 +1106,12 @@ def infer_batch_process(
 
 
 def remove_silence_for_generated_wav(filename):
-    aseg = AudioSegment.from_file(filename)
-    non_silent_segs = silence.split_on_silence(
-        aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=500, seek_step=10
+    audio, sr = torchaudio.load(filename)
+    non_silent_segs = split_on_silence(
+        audio, sr, min_silence_len=1000, silence_thresh=-50, keep_silence=500, seek_step=10
     )
-    non_silent_wave = AudioSegment.silent(duration=0)
-    for non_silent_seg in non_silent_segs:
-        non_silent_wave += non_silent_seg
-    aseg = non_silent_wave
-    aseg.export(filename, format="wav")
+    non_silent_wave = torch.cat(non_silent_segs, dim=-1) if non_silent_segs else audio[:, :0]
+    torchaudio.save(filename, non_silent_wave, sr, encoding="PCM_S", bits_per_sample=16)
 
 
 # save spectrogram
@@ -0,0 +1,149 @@
+# Registry of preprocessed voice prompts
+# Reference audio / text preprocessing is done once per voice, instead of once per request
+
+from __future__ import annotations
+
+import hashlib
+import os
+
+import torch
+
+from f5_tts.infer.utils_infer import (
+    device,
+    hop_length,
+    preprocess_ref_audio,
+    target_rms,
+    target_sample_rate,
+)
+from f5_tts.model.modules import resample
+from f5_tts.model.utils import convert_char_to_pinyin
+
+
+class VoicePrompt:
+    """
+    Everything inference needs from a reference voice, can be passed as ``ref_audio`` to
+    ``infer_process`` / ``infer_batch_process`` in place of the audio path / (audio, sr) tuple.
+    """
+
+    def __init__(
+        self,
+        voice_id,
+        audio,
+        ref_text,
+        rms,
+        ref_mel,
+        ref_tokens,
+        target_rms=target_rms,
+        sample_rate=target_sample_rate,
+    ):
+        self.voice_id = voice_id
+        self.audio = audio  # 1 nw, trimmed, loudness normalized and resampled
+        self.ref_text = ref_text
+        self.rms = rms  # rms of the trimmed audio before normalization
+        self.ref_mel = ref_mel  # n d
+        self.ref_tokens = ref_tokens  # tokenized ref_text, pinyin or char
+        self.target_rms = target_rms  # loudness the audio was normalized to, if it was quieter
+        self.sample_rate = sample_rate
+
+    @property
+    def duration(self):
+        return self.audio.shape[-1] / self.sample_rate
+
+    @property
+    def ref_mel_len(self):
+        return self.audio.shape[-1] // hop_length
+
+    def state_dict(self):
+        return {
+            "voice_id": self.voice_id,
+            "audio": self.audio,
+            "ref_text": self.ref_text,
+            "rms": self.rms,
+            "ref_mel": self.ref_mel,
+            "ref_tokens": self.ref_tokens,
+            "target_rms": self.target_rms,
+            "sample_rate": self.sample_rate,
+        }
+
+
+class VoiceRegistry:
+    """
+    Precompute and hold voice prompts, optionally persisted to ``cache_dir`` keyed by content hash
+    (reference audio bytes, reference text and mel settings), so a restart skips preprocessing too.
+    """
+
+    def __init__(self, model_obj, cache_dir=None, target_rms=target_rms, device=device):
+        self.model_obj = model_obj
+        self.cache_dir = cache_dir
+        self.target_rms = target_rms
+        self.device = device
+        self.voices = {}
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __contains__(self, voice_id):
+        return voice_id in self.voices
+
+    def __len__(self):
+        return len(self.voices)
+
+    def list(self):
+        return list(self.voices.keys())
+
+    def get(self, voice_id):
+        if voice_id not in self.voices:
+            raise KeyError(f"Voice '{voice_id}' not registered. Available: {self.list()}")
+        return self.voices[voice_id]
+
+    def register(self, voice_id, ref_audio, ref_text="", clip_short=True, show_info=print):
+        key = self._content_hash(ref_audio, ref_text, clip_short)
+        cache_path = os.path.join(self.cache_dir, f"{key}.pt") if self.cache_dir is not None else None
+
+        if cache_path is not None and os.path.exists(cache_path):
+            show_info(f"Loading cached voice prompt {voice_id} ...")
+            state = torch.load(cache_path, map_location="cpu", weights_only=True)
+            state["voice_id"] = voice_id
+            voice = VoicePrompt(**state)
+        else:
+            show_info(f"Preprocessing voice prompt {voice_id} ...")
+            voice = self._build(voice_id, ref_audio, ref_text, clip_short, show_info)
+            if cache_path is not None:
+                torch.save(voice.state_dict(), cache_path)
+
+        self.voices[voice_id] = voice
+        return voice
+
+    def _content_hash(self, ref_audio, ref_text, clip_short):
+        mel_spec = self.model_obj.mel_spec
+        settings = (
+            f"{mel_spec.extractor.__name__}_{mel_spec.n_fft}_{mel_spec.hop_length}_{mel_spec.win_length}_"
+            f"{mel_spec.n_mel_channels}_{mel_spec.target_sample_rate}_{self.target_rms}_{clip_short}"
+        )
+        md5 = hashlib.md5()
+        with open(ref_audio, "rb") as f:
+            md5.update(f.read())
+        md5.update(ref_text.encode("utf-8"))
+        md5.update(settings.encode("utf-8"))
+        return md5.hexdigest()
+
+    def _build(self, voice_id, ref_audio, ref_text, clip_short, show_info):
+        audio, sr, ref_text = preprocess_ref_audio(
+            ref_audio, ref_text, clip_short=clip_short, show_info=show_info, device=self.device
+        )
+
+        if audio.shape[0] > 1:
+            audio = torch.mean(audio, dim=0, keepdim=True)
+        rms = torch.sqrt(torch.mean(torch.square(audio))).item()
+        if rms < self.target_rms:
+            audio = audio * self.target_rms / rms
+        audio = resample(audio, sr, target_sample_rate)
+
+        with torch.inference_mode():
+            ref_mel = self.model_obj.mel_spec(audio.to(self.model_obj.device)).permute(0, 2, 1)[0].float().cpu()
+
+        if len(ref_text[-1].encode("utf-8")) == 1:
+            ref_text = ref_text + " "
+        ref_tokens = convert_char_to_pinyin([ref_text])[0]
+
+        return VoicePrompt(voice_id, audio, ref_text, rms, ref_mel, ref_tokens, target_rms=self.target_rms)
@@ -4,7 +4,9 @@ from f5_tts.model.backbones.unett import UNetT
 from f5_tts.model.backbones.dit import DiT
 from f5_tts.model.backbones.mmdit import MMDiT
 
+from f5_tts.model.duration import DurationPredictor
+
 from f5_tts.model.trainer import Trainer
 
 
-__all__ = ["CFM", "UNetT", "DiT", "MMDiT", "Trainer"]
+__all__ = ["CFM", "UNetT", "DiT", "MMDiT", "DurationPredictor", "Trainer"]
@@ -9,6 +9,8 @@ d - dimension
 
 from __future__ import annotations
 
+from functools import partial
+
 import torch
 from torch import nn
 import torch.nn.functional as F
@@ -88,15 +90,53 @@ class InputEmbedding(nn.Module):
         self.proj = nn.Linear(mel_dim * 2 + text_dim, out_dim)
         self.conv_pos_embed = ConvPositionEmbedding(dim=out_dim)
 
-    def forward(self, x: float["b n d"], cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
+    def cond_proj(self, cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
+        # cond audio and text part of the input projection, x part excluded
         if drop_audio_cond:  # cfg for cond audio
             cond = torch.zeros_like(cond)
 
-        x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
-        x = self.conv_pos_embed(x) + x
+        return F.linear(torch.cat((cond, text_embed), dim=-1), self.proj.weight[:, cond.shape[-1] :], self.proj.bias)
+
+    def forward(
+        self,
+        x: float["b n d"],  # noqa: F722
+        cond: float["b n d"],  # noqa: F722
+        text_embed: float["b n d"],  # noqa: F722
+        drop_audio_cond=False,
+        cond_proj: float["b n d"] | None = None,  # noqa: F722. precomputed with cond_proj(), cond and text unused
+        mask: bool["b n"] | None = None,  # noqa: F722. zero padding for the convolutions, as at sequence ends
+    ):
+        if cond_proj is not None:
+            x = F.linear(x, self.proj.weight[:, : x.shape[-1]]).repeat(cond_proj.shape[0] // x.shape[0], 1, 1)
+            x = x + cond_proj
+        else:
+            if drop_audio_cond:  # cfg for cond audio
+                cond = torch.zeros_like(cond)
+            x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
+
+        x = self.conv_pos_embed(x, mask=mask) + x
         return x
 
 
+# step-invariant conditioning of one sampling call
+
+
+class InferenceSession:
+    """
+    Everything DiT computes from cond audio, text, sequence length or time step alone, computed on first use and
+    reused by all ode steps of one CFM.sample call: the cond audio and text part of the input projection (per cfg
+    branch), rotary tables, and for each time step the time embedding and AdaLN modulation of every block.
+    Only the noised input path is left to compute per step. Cleared with DiT.clear_cache().
+    """
+
+    def __init__(self):
+        self.cond_proj = {}  # (drop_audio_cond, drop_text, cfg_infer) -> b n d, or 2b n d if cfg_infer
+        self.rope = None
+        self.times = None  # precomputed time schedule, T
+        self.time_cond = []  # of each step of times: (time embedding, modulation of each block, final modulation)
+        self.last_time = self.last_time_cond = None  # time off the schedule, shared by the cfg branches of a step
+
+
 # Transformer backbone using DiT blocks
 
 
@@ -117,6 +157,7 @@ class DiT(nn.Module):
         qk_norm=None,
         conv_layers=0,
         pe_attn_head=None,
+        attn_backend="torch",  # torch | math | efficient | flash | cudnn, see modules.ATTN_BACKENDS, check_attn_backend
         long_skip_connection=False,
         checkpoint_activations=False,
     ):
@@ -128,7 +169,7 @@ class DiT(nn.Module):
         self.text_embed = TextEmbedding(
             text_num_embeds, text_dim, mask_padding=text_mask_padding, conv_layers=conv_layers
         )
-        self.text_cond, self.text_uncond = None, None  # text cache
+        self.session = None  # inference cache, see InferenceSession
         self.input_embed = InputEmbedding(mel_dim, text_dim, dim)
 
         self.rotary_embed = RotaryEmbedding(dim_head)
@@ -146,6 +187,7 @@ class DiT(nn.Module):
                     dropout=dropout,
                     qk_norm=qk_norm,
                     pe_attn_head=pe_attn_head,
+                    attn_backend=attn_backend,
                 )
                 for _ in range(depth)
             ]
@@ -180,7 +222,56 @@ class DiT(nn.Module):
         return ckpt_forward
 
     def clear_cache(self):
-        self.text_cond, self.text_uncond = None, None
+        self.session = None
+
+    def get_cond_proj(self, cond, text, seq_len, drop_audio_cond, drop_text, cfg_infer):
+        session = self.session
+        key = (drop_audio_cond, drop_text, cfg_infer)
+        if key not in session.cond_proj:
+            if cfg_infer:  # cond and text, then neither
+                text_embed = torch.cat(
+                    (self.text_embed(text, seq_len, drop_text=False), self.text_embed(text, seq_len, drop_text=True))
+                )
+                cond = torch.cat((cond, torch.zeros_like(cond)))
+                drop_audio_cond = False
+            else:
+                text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
+            session.cond_proj[key] = self.input_embed.cond_proj(cond, text_embed, drop_audio_cond=drop_audio_cond)
+        return session.cond_proj[key]
+
+    def compute_time_cond(self, time: float["T"]):  # noqa: F821
+        t = self.time_embed(time)  # T d
+        return t, [block.attn_norm.modulation(t) for block in self.transformer_blocks], self.norm_out.modulation(t)
+
+    def get_time_cond(self, time):
+        # looked up without syncing on the value of time, which would stall every step on cuda: a step of the
+        # precomputed schedule by its offset in it, else computed once per time tensor, as the solver passes the same
+        # one to the cfg branches of an evaluation
+        session = self.session
+        times = session.times
+        if times is not None and time.untyped_storage().data_ptr() == times.untyped_storage().data_ptr():
+            step, remainder = divmod(time.storage_offset() - times.storage_offset(), times.stride(0))
+            if remainder == 0 and 0 <= step < len(session.time_cond):
+                return session.time_cond[step]
+        if session.last_time is not time:
+            session.last_time, session.last_time_cond = time, self.compute_time_cond(time.reshape(1))  # 1 d
+        return session.last_time_cond
+
+    def precompute_time_cond(self, times: float["T"]):  # noqa: F821
+        # time embedding and AdaLN modulations of a whole time schedule, one matmul per linear over all steps,
+        # instead of one per step. get_time_cond() then looks them up for the steps of this same tensor
+        if self.session is None:
+            self.session = InferenceSession()
+        t, modulations, final_modulation = self.compute_time_cond(times)
+        self.session.times = times
+        self.session.time_cond = [
+            (
+                t[step],
+                [tuple(chunk[step] for chunk in modulation) for modulation in modulations],
+                tuple(chunk[step] for chunk in final_modulation),
+            )
+            for step in (slice(i, i + 1) for i in range(len(times)))  # 1 d, broadcast over batch
+        ]
 
     def forward(
         self,
@@ -192,41 +283,125 @@ class DiT(nn.Module):
         drop_text,  # cfg for text
         mask: bool["b n"] | None = None,  # noqa: F722
         cache=False,
+        cfg_infer=False,  # cond and uncond passes in one forward, output 2b: cond then uncond
+        pack: tuple[int["b"], int["b"]] | None = None,  # noqa: F821. rows and offsets to pack sequences, see below
     ):
+        if pack is not None:
+            return self.forward_packed(x, cond, text, time, drop_audio_cond, drop_text, mask, *pack)
+
         batch, seq_len = x.shape[0], x.shape[1]
-        if time.ndim == 0:
-            time = time.repeat(batch)
+        modulations = final_modulation = None
+
+        if cache and time.ndim == 0:  # inference, step-invariant conditioning reused, see InferenceSession
+            if self.session is None:
+                self.session = InferenceSession()
+            if self.session.rope is None:
+                self.session.rope = self.rotary_embed.forward_from_seq_len(seq_len)
+            rope = self.session.rope
+
+            t, modulations, final_modulation = self.get_time_cond(time)
+            cond_proj = self.get_cond_proj(cond, text, seq_len, drop_audio_cond, drop_text, cfg_infer)
+            x = self.input_embed(x, None, None, cond_proj=cond_proj)
+            if cfg_infer and mask is not None:
+                mask = torch.cat((mask, mask))
 
-        # t: conditioning time, text: text, x: noised audio + cond audio + text
-        t = self.time_embed(time)
-        if cache:
-            if drop_text:
-                if self.text_uncond is None:
-                    self.text_uncond = self.text_embed(text, seq_len, drop_text=True)
-                text_embed = self.text_uncond
-            else:
-                if self.text_cond is None:
-                    self.text_cond = self.text_embed(text, seq_len, drop_text=False)
-                text_embed = self.text_cond
         else:
-            text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
-        x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
+            if time.ndim == 0:
+                time = time.repeat(batch)
+
+            # t: conditioning time, text: text, x: noised audio + cond audio + text
+            t = self.time_embed(time)
+            if cfg_infer:  # b n d -> 2b n d, second half with audio cond and text dropped
+                text_embed = torch.cat(
+                    (self.text_embed(text, seq_len, drop_text=False), self.text_embed(text, seq_len, drop_text=True))
+                )
+                x, cond = torch.cat((x, x)), torch.cat((cond, torch.zeros_like(cond)))
+                drop_audio_cond = False
+                t = torch.cat((t, t))
+                if mask is not None:
+                    mask = torch.cat((mask, mask))
+            else:
+                text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
+            x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
+
+            rope = self.rotary_embed.forward_from_seq_len(seq_len)
+
+        x = self.transformer_trunk(x, t, mask, rope, modulations, final_modulation)
+        output = self.proj_out(x)
+
+        return output
 
-        rope = self.rotary_embed.forward_from_seq_len(seq_len)
+    def packed_block(self, block, x, t, token_seq, mask, rope):
+        # modulation of the block from the time embedding of each sequence, gathered for each token here, so that
+        # only one block's per token copies are alive at a time (recomputed under activation checkpointing)
+        modulation = tuple(chunk[token_seq] for chunk in block.attn_norm.modulation(t))
+        return block(x, None, mask, rope, modulation)
 
+    def transformer_trunk(self, x, t, mask, rope, modulations=None, final_modulation=None, token_seq=None):
+        # token_seq: packed rows, sequence of each token, t then being the time embedding of each sequence
         if self.long_skip_connection is not None:
             residual = x
 
-        for block in self.transformer_blocks:
-            if self.checkpoint_activations:
-                x = torch.utils.checkpoint.checkpoint(self.ckpt_wrapper(block), x, t, mask, rope)
+        for i, block in enumerate(self.transformer_blocks):
+            if token_seq is not None:
+                block_fn, inputs = partial(self.packed_block, block), (x, t, token_seq, mask, rope)
+            else:
+                modulation = modulations[i] if modulations is not None else None
+                block_fn, inputs = block, (x, t, mask, rope, modulation)
+            if self.checkpoint_activations and torch.is_grad_enabled():
+                x = torch.utils.checkpoint.checkpoint(self.ckpt_wrapper(block_fn), *inputs)
             else:
-                x = block(x, t, mask=mask, rope=rope)
+                x = block_fn(*inputs)
 
         if self.long_skip_connection is not None:
             x = self.long_skip_connection(torch.cat((x, residual), dim=-1))
 
-        x = self.norm_out(x, t)
-        output = self.proj_out(x)
+        return self.norm_out(x, t, modulation=final_modulation)
+
+    def forward_packed(
+        self,
+        x: float["b n d"],  # nosied input audio  # noqa: F722
+        cond: float["b n d"],  # masked cond audio  # noqa: F722
+        text: int["b nt"],  # text  # noqa: F722
+        time: float["b"],  # time step  # noqa: F821
+        drop_audio_cond,
+        drop_text,
+        mask: bool["b n"],  # noqa: F722
+        rows: int["b"],  # noqa: F821
+        offsets: int["b"],  # noqa: F821
+    ):
+        """
+        Training forward on sequences packed into rows, sequence i taking frames offsets[i]:offsets[i] + len of
+        row rows[i] (see dataset.pack_sequences), so that the transformer blocks spend no compute on padding.
+        Takes and returns the padded b n d batch. Embeddings, whose convolutions and text positions are per
+        sequence, are computed on it; the blocks run on the packed rows with attention, rotary positions and
+        time conditioning per segment.
+        """
+        lens = mask.sum(dim=-1)
+        seq_idx = torch.repeat_interleave(torch.arange(lens.shape[0], device=lens.device), lens)
+        pos = torch.arange(seq_idx.shape[0], device=lens.device) - torch.repeat_interleave(lens.cumsum(0) - lens, lens)
+        row, col = rows[seq_idx], offsets[seq_idx] + pos
+        num_rows, row_len = rows.max().item() + 1, (offsets + lens).max().item()
+
+        segment_ids = torch.zeros(num_rows, row_len, dtype=torch.long, device=x.device)  # 0 for padding
+        segment_ids[row, col] = seq_idx + 1
+        positions = torch.zeros_like(segment_ids)
+        positions[row, col] = pos
+        token_seq = (segment_ids - 1).clamp(min=0)  # sequence of each token, padding taking the first one's
+
+        text_embed = self.text_embed(text, x.shape[1], drop_text=drop_text)
+        x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond, mask=mask)
+        packed = x.new_zeros(num_rows, row_len, x.shape[-1])
+        packed[row, col] = x[seq_idx, pos]
+
+        # time conditioning per sequence, gathered for each token block by block in the trunk
+        t = self.time_embed(time)
+        final_modulation = tuple(chunk[token_seq] for chunk in self.norm_out.modulation(t))
+        rope = self.rotary_embed(positions)
+
+        packed = self.transformer_trunk(packed, t, segment_ids, rope, None, final_modulation, token_seq=token_seq)
+        packed = self.proj_out(packed)
 
+        output = packed.new_zeros(*x.shape[:2], packed.shape[-1])
+        output[seq_idx, pos] = packed[row, col]
         return output
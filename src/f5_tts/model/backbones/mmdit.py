@@ -96,12 +96,14 @@ class MMDiT(nn.Module):
         text_num_embeds=256,
         text_mask_padding=True,
         qk_norm=None,
+        attn_backend="torch",  # torch | math | efficient | flash | cudnn, see modules.ATTN_BACKENDS, check_attn_backend
     ):
         super().__init__()
 
         self.time_embed = TimestepEmbedding(dim)
         self.text_embed = TextEmbedding(dim, text_num_embeds, mask_padding=text_mask_padding)
         self.text_cond, self.text_uncond = None, None  # text cache
+        self.text_cfg = None  # text cache of batched cfg, cond and uncond stacked along batch
         self.audio_embed = AudioEmbedding(mel_dim, dim)
 
         self.rotary_embed = RotaryEmbedding(dim_head)
@@ -119,6 +121,7 @@ class MMDiT(nn.Module):
                     ff_mult=ff_mult,
                     context_pre_only=i == depth - 1,
                     qk_norm=qk_norm,
+                    attn_backend=attn_backend,
                 )
                 for i in range(depth)
             ]
@@ -144,6 +147,7 @@ class MMDiT(nn.Module):
 
     def clear_cache(self):
         self.text_cond, self.text_uncond = None, None
+        self.text_cfg = None
 
     def forward(
         self,
@@ -155,6 +159,7 @@ class MMDiT(nn.Module):
         drop_text,  # cfg for text
         mask: bool["b n"] | None = None,  # noqa: F722
         cache=False,
+        cfg_infer=False,  # cond and uncond passes in one forward, output 2b: cond then uncond
     ):
         batch = x.shape[0]
         if time.ndim == 0:
@@ -162,7 +167,18 @@ class MMDiT(nn.Module):
 
         # t: conditioning (time), c: context (text + masked cond audio), x: noised input audio
         t = self.time_embed(time)
-        if cache:
+        if cfg_infer:  # b n d -> 2b n d, second half with audio cond and text dropped
+            c = self.text_cfg
+            if c is None or not cache:
+                c = torch.cat((self.text_embed(text, drop_text=False), self.text_embed(text, drop_text=True)))
+                if cache:
+                    self.text_cfg = c
+            x, cond = torch.cat((x, x)), torch.cat((cond, torch.zeros_like(cond)))
+            drop_audio_cond = False
+            t = torch.cat((t, t))
+            if mask is not None:
+                mask = torch.cat((mask, mask))
+        elif cache:
             if drop_text:
                 if self.text_uncond is None:
                     self.text_uncond = self.text_embed(text, drop_text=True)
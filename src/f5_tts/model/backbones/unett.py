@@ -120,6 +120,7 @@ class UNetT(nn.Module):
         qk_norm=None,
         conv_layers=0,
         pe_attn_head=None,
+        attn_backend="torch",  # torch | math | efficient | flash | cudnn, see modules.ATTN_BACKENDS, check_attn_backend
         skip_connect_type: Literal["add", "concat", "none"] = "concat",
     ):
         super().__init__()
@@ -132,6 +133,7 @@ class UNetT(nn.Module):
             text_num_embeds, text_dim, mask_padding=text_mask_padding, conv_layers=conv_layers
         )
         self.text_cond, self.text_uncond = None, None  # text cache
+        self.text_cfg = None  # text cache of batched cfg, cond and uncond stacked along batch
         self.input_embed = InputEmbedding(mel_dim, text_dim, dim)
 
         self.rotary_embed = RotaryEmbedding(dim_head)
@@ -150,7 +152,7 @@ class UNetT(nn.Module):
 
             attn_norm = RMSNorm(dim)
             attn = Attention(
-                processor=AttnProcessor(pe_attn_head=pe_attn_head),
+                processor=AttnProcessor(pe_attn_head=pe_attn_head, attn_backend=attn_backend),
                 dim=dim,
                 heads=heads,
                 dim_head=dim_head,
@@ -180,6 +182,7 @@ class UNetT(nn.Module):
 
     def clear_cache(self):
         self.text_cond, self.text_uncond = None, None
+        self.text_cfg = None
 
     def forward(
         self,
@@ -191,6 +194,7 @@ class UNetT(nn.Module):
         drop_text,  # cfg for text
         mask: bool["b n"] | None = None,  # noqa: F722
         cache=False,
+        cfg_infer=False,  # cond and uncond passes in one forward, output 2b: cond then uncond
     ):
         batch, seq_len = x.shape[0], x.shape[1]
         if time.ndim == 0:
@@ -198,7 +202,20 @@ class UNetT(nn.Module):
 
         # t: conditioning time, c: context (text + masked cond audio), x: noised input audio
         t = self.time_embed(time)
-        if cache:
+        if cfg_infer:  # b n d -> 2b n d, second half with audio cond and text dropped
+            text_embed = self.text_cfg
+            if text_embed is None or not cache:
+                text_embed = torch.cat(
+                    (self.text_embed(text, seq_len, drop_text=False), self.text_embed(text, seq_len, drop_text=True))
+                )
+                if cache:
+                    self.text_cfg = text_embed
+            x, cond = torch.cat((x, x)), torch.cat((cond, torch.zeros_like(cond)))
+            drop_audio_cond = False
+            t = torch.cat((t, t))
+            if mask is not None:
+                mask = torch.cat((mask, mask))
+        elif cache:
             if drop_text:
                 if self.text_uncond is None:
                     self.text_uncond = self.text_embed(text, seq_len, drop_text=True)
@@ -19,6 +19,7 @@ from torch.nn.utils.rnn import pad_sequence
 from torchdiffeq import odeint
 
 from f5_tts.model.modules import MelSpec
+from f5_tts.model.samplers import get_sampler
 from f5_tts.model.utils import (
     default,
     exists,
@@ -29,6 +30,26 @@ from f5_tts.model.utils import (
 )
 
 
+# torchdiffeq methods stepping over a given grid (the others choose their steps)
+FIXED_GRID_ODEINT_METHODS = (
+    "euler",
+    "midpoint",
+    "heun2",
+    "heun3",
+    "rk4",
+    "explicit_adams",
+    "implicit_adams",
+    "fixed_adams",
+)
+
+# guidance strength multiplier over time, all averaging 1 over [0, 1]
+CFG_SCHEDULES = {
+    "constant": lambda t: 1.0,
+    "linear": lambda t: 2 * (1 - t),  # strong while the coarse structure forms, fading out on details
+    "cosine": lambda t: 1 + torch.cos(torch.pi * t),
+}
+
+
 class CFM(nn.Module):
     def __init__(
         self,
@@ -96,6 +117,13 @@ class CFM(nn.Module):
         duplicate_test=False,
         t_inter=0.1,
         edit_mask=None,
+        batch_cfg=True,
+        precompute_time_cond=True,
+        sampler: str | None = None,  # see samplers.py, None for torchdiffeq.odeint with odeint_kwargs
+        return_trajectory=False,  # keep the state at every step (steps + 1 copies of the mel), for debugging
+        cfg_interval: tuple[float, float] | None = None,  # guidance for t within, conditional pass only elsewhere
+        cfg_reuse_steps=0,  # after each guided evaluation, that many reuse its (pred - null_pred) delta
+        cfg_schedule="constant",  # guidance strength over time, see CFG_SCHEDULES
     ):
         self.eval()
         # raw wave
@@ -156,21 +184,89 @@ class CFM(nn.Module):
 
         # neural ode
 
+        if cfg_schedule not in CFG_SCHEDULES:
+            raise ValueError(f"Unknown cfg_schedule: {cfg_schedule}, choose from {', '.join(CFG_SCHEDULES)}")
+        guidance = dict(delta=None, reused=0)  # last guidance delta, and how many evaluations reused it
+        # guided or not at each point of the time grid, decided on host once the grid is known
+        guided_grid = dict(times=None, guided=None, last_time=None, last_guided=None)
+
+        def is_guided(t):
+            # without comparing t on device, which would sync every evaluation on cuda: a point of the grid by its
+            # offset in it (solvers pass t[i] views), else the value is read once per time tensor, e.g. midpoint
+            # half steps or adaptive_heun, which syncs on its error estimate anyway
+            if cfg_strength < 1e-5:
+                return False
+            if cfg_interval is None:
+                return True
+            times = guided_grid["times"]
+            if t.untyped_storage().data_ptr() == times.untyped_storage().data_ptr():
+                step, remainder = divmod(t.storage_offset() - times.storage_offset(), times.stride(0))
+                if remainder == 0 and 0 <= step < len(guided_grid["guided"]):
+                    return guided_grid["guided"][step]
+            if guided_grid["last_time"] is not t:
+                guided_grid["last_time"] = t
+                guided_grid["last_guided"] = cfg_interval[0] <= t.item() <= cfg_interval[1]
+            return guided_grid["last_guided"]
+
         def fn(t, x):
             # at each step, conditioning is fixed
             # step_cond = torch.where(cond_mask, cond, torch.zeros_like(cond))
 
             # predict flow
-            pred = self.transformer(
-                x=x, cond=step_cond, text=text, time=t, mask=mask, drop_audio_cond=False, drop_text=False, cache=True
-            )
-            if cfg_strength < 1e-5:
-                return pred
-
-            null_pred = self.transformer(
-                x=x, cond=step_cond, text=text, time=t, mask=mask, drop_audio_cond=True, drop_text=True, cache=True
-            )
-            return pred + (pred - null_pred) * cfg_strength
+            guided = is_guided(t)
+            if not guided:
+                guidance["delta"] = None
+            if not guided or (exists(guidance["delta"]) and guidance["reused"] < cfg_reuse_steps):
+                pred = self.transformer(
+                    x=x,
+                    cond=step_cond,
+                    text=text,
+                    time=t,
+                    mask=mask,
+                    drop_audio_cond=False,
+                    drop_text=False,
+                    cache=True,
+                )
+                if not guided:
+                    return pred
+                guidance["reused"] += 1
+                return pred + guidance["delta"] * (cfg_strength * CFG_SCHEDULES[cfg_schedule](t))
+
+            if batch_cfg:  # cond and uncond passes stacked along batch, one transformer forward per step
+                pred, null_pred = self.transformer(
+                    x=x,
+                    cond=step_cond,
+                    text=text,
+                    time=t,
+                    mask=mask,
+                    drop_audio_cond=False,
+                    drop_text=False,
+                    cache=True,
+                    cfg_infer=True,
+                ).chunk(2)
+            else:
+                pred = self.transformer(
+                    x=x,
+                    cond=step_cond,
+                    text=text,
+                    time=t,
+                    mask=mask,
+                    drop_audio_cond=False,
+                    drop_text=False,
+                    cache=True,
+                )
+                null_pred = self.transformer(
+                    x=x,
+                    cond=step_cond,
+                    text=text,
+                    time=t,
+                    mask=mask,
+                    drop_audio_cond=True,
+                    drop_text=True,
+                    cache=True,
+                )
+            guidance["delta"], guidance["reused"] = pred - null_pred, 0
+            return pred + guidance["delta"] * (cfg_strength * CFG_SCHEDULES[cfg_schedule](t))
 
         # noise input
         # to make sure batch inference result is same with different batch size, and for sure single inference
@@ -190,14 +286,45 @@ class CFM(nn.Module):
             y0 = (1 - t_start) * y0 + t_start * test_cond
             steps = int(steps * (1 - t_start))
 
+        # steps counts function evaluations, solvers evaluating several times per step get fewer steps
+        nfe = steps
+        if exists(sampler):
+            solver, nfe_per_step = get_sampler(sampler)
+            steps = max(steps // nfe_per_step, 1)
+
         t = torch.linspace(t_start, 1, steps + 1, device=self.device, dtype=step_cond.dtype)
         if sway_sampling_coef is not None:
             t = t + sway_sampling_coef * (torch.cos(torch.pi / 2 * t) - 1 + t)
+        if cfg_interval is not None:
+            guided_grid["times"] = t
+            guided_grid["guided"] = [cfg_interval[0] <= step_t <= cfg_interval[1] for step_t in t.tolist()]
+
+        # caches of this call (text, time conditioning, session) cleared even if sampling fails, as a server
+        # goes on sampling other requests with the same model
+        try:
+            if precompute_time_cond and hasattr(self.transformer, "precompute_time_cond"):
+                # time conditioning of the whole schedule computed up front, batched over steps
+                self.transformer.precompute_time_cond(t)
+
+            # only the current state is kept while integrating, unless the trajectory is asked for
+            trajectory = [] if return_trajectory else None
+            if exists(sampler):
+                sampled = solver(fn, y0, t, nfe=nfe, trajectory=trajectory)
+                if return_trajectory:
+                    trajectory = torch.stack(trajectory)
+            elif return_trajectory:
+                trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
+                sampled = trajectory[-1]
+            else:
+                # fixed grid solvers still step over the whole schedule, but only output its end
+                odeint_kwargs = self.odeint_kwargs
+                if odeint_kwargs.get("method") in FIXED_GRID_ODEINT_METHODS:
+                    options = {**odeint_kwargs.get("options", {}), "grid_constructor": lambda func, y0, t_out: t}
+                    odeint_kwargs = {**odeint_kwargs, "options": options}
+                sampled = odeint(fn, y0, t[[0, -1]], **odeint_kwargs)[-1]
+        finally:
+            self.transformer.clear_cache()
 
-        trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
-        self.transformer.clear_cache()
-
-        sampled = trajectory[-1]
         out = sampled
         out = torch.where(cond_mask, cond, out)
 
@@ -214,7 +341,11 @@ class CFM(nn.Module):
         *,
         lens: int["b"] | None = None,  # noqa: F821
         noise_scheduler: str | None = None,
+        pack: tuple[int["b"], int["b"]] | None = None,  # noqa: F821. rows and offsets from dataset.pack_sequences
     ):
+        if pack is not None and not hasattr(self.transformer, "forward_packed"):
+            raise ValueError(f"Sequence packing is not supported by {type(self.transformer).__name__}, only DiT")
+
         # handle raw wave
         if inp.ndim == 2:
             inp = self.mel_spec(inp)
@@ -272,9 +403,22 @@ class CFM(nn.Module):
 
         # if want rigourously mask out padding, record in collate_fn in dataset.py, and pass in here
         # adding mask will use more memory, thus also need to adjust batchsampler with scaled down threshold for long sequences
-        pred = self.transformer(
-            x=φ, cond=cond, text=text, time=time, drop_audio_cond=drop_audio_cond, drop_text=drop_text
-        )
+        # packed sequences (pack_length of the dataset) take the mask, padding then gets no compute at all
+        if pack is not None:
+            pred = self.transformer(
+                x=φ,
+                cond=cond,
+                text=text,
+                time=time,
+                drop_audio_cond=drop_audio_cond,
+                drop_text=drop_text,
+                mask=mask,
+                pack=pack,
+            )
+        else:
+            pred = self.transformer(
+                x=φ, cond=cond, text=text, time=time, drop_audio_cond=drop_audio_cond, drop_text=drop_text
+            )
 
         # flow matching loss
         loss = F.mse_loss(pred, flow, reduction="none")
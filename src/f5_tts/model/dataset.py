@@ -1,8 +1,9 @@
 import json
+import os
 from importlib.resources import files
 
+import numpy as np
 import torch
-import torch.nn.functional as F
 import torchaudio
 from datasets import Dataset as Dataset_
 from datasets import load_from_disk
@@ -10,7 +11,7 @@ from torch import nn
 from torch.utils.data import Dataset, Sampler
 from tqdm import tqdm
 
-from f5_tts.model.modules import MelSpec
+from f5_tts.model.modules import MelSpec, resample
 from f5_tts.model.utils import default
 
 
@@ -61,9 +62,7 @@ class HFDataset(Dataset):
 
         audio_tensor = torch.from_numpy(audio).float()
 
-        if sample_rate != self.target_sample_rate:
-            resampler = torchaudio.transforms.Resample(sample_rate, self.target_sample_rate)
-            audio_tensor = resampler(audio_tensor)
+        audio_tensor = resample(audio_tensor, sample_rate, self.target_sample_rate)
 
         audio_tensor = audio_tensor.unsqueeze(0)  # 't -> 1 t')
 
@@ -79,6 +78,45 @@ class HFDataset(Dataset):
         )
 
 
+class MelShards:
+    """
+    Log mel spectrograms precomputed by train/datasets/prepare_mel_shards.py, memory-mapped from fixed-dtype shard
+    files. Row i of the dataset is the d n block of index[i, 2] frames at element offset index[i, 1] of shard
+    index[i, 0], returned as a zero-copy tensor view (cast to float32 by collate_fn).
+    """
+
+    def __init__(self, mel_dir):
+        self.mel_dir = mel_dir
+        with open(f"{mel_dir}/mel_info.json", "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+        self.index = np.load(f"{mel_dir}/mel_index.npy")
+        self.shards = None  # memory-mapped on first access, in each dataloader worker
+
+    def __getstate__(self):  # pickled to dataloader workers without the memory maps
+        state = self.__dict__.copy()
+        state["shards"] = None
+        return state
+
+    def __len__(self):
+        return len(self.index)
+
+    def check_mel_spec(self, **mel_spec_kwargs):
+        for key, value in mel_spec_kwargs.items():
+            if self.info[key] != value:
+                raise ValueError(f"Mels in {self.mel_dir} were computed with {key}={self.info[key]}, not {value}")
+
+    def __getitem__(self, index):
+        if self.shards is None:
+            # copy-on-write mapping, so that tensors are writable while the shard files are never written
+            self.shards = [
+                np.memmap(f"{self.mel_dir}/{name}", dtype=self.info["dtype"], mode="c") for name in self.info["shards"]
+            ]
+        shard, offset, frames = self.index[index].tolist()
+        n_mel_channels = self.info["n_mel_channels"]
+        mel = self.shards[shard][offset : offset + n_mel_channels * frames]
+        return torch.from_numpy(mel).view(n_mel_channels, frames)
+
+
 class CustomDataset(Dataset):
     def __init__(
         self,
@@ -92,6 +130,7 @@ class CustomDataset(Dataset):
         mel_spec_type="vocos",
         preprocessed_mel=False,
         mel_spec_module: nn.Module | None = None,
+        mel_shards: MelShards | None = None,
     ):
         self.data = custom_dataset
         self.durations = durations
@@ -101,6 +140,17 @@ class CustomDataset(Dataset):
         self.win_length = win_length
         self.mel_spec_type = mel_spec_type
         self.preprocessed_mel = preprocessed_mel
+        self.mel_shards = mel_shards  # preprocessed mels, instead of the mel_spec column of the rows
+
+        if mel_shards is not None:
+            mel_shards.check_mel_spec(
+                target_sample_rate=target_sample_rate,
+                hop_length=hop_length,
+                n_mel_channels=n_mel_channels,
+                n_fft=n_fft,
+                win_length=win_length,
+                mel_spec_type=mel_spec_type,
+            )
 
         if not preprocessed_mel:
             self.mel_spectrogram = default(
@@ -138,7 +188,9 @@ class CustomDataset(Dataset):
 
             index = (index + 1) % len(self.data)
 
-        if self.preprocessed_mel:
+        if self.mel_shards is not None:
+            mel_spec = self.mel_shards[index]
+        elif self.preprocessed_mel:
             mel_spec = torch.tensor(row["mel_spec"])
         else:
             audio, source_sample_rate = torchaudio.load(audio_path)
@@ -148,9 +200,7 @@ class CustomDataset(Dataset):
                 audio = torch.mean(audio, dim=0, keepdim=True)
 
             # resample if necessary
-            if source_sample_rate != self.target_sample_rate:
-                resampler = torchaudio.transforms.Resample(source_sample_rate, self.target_sample_rate)
-                audio = resampler(audio)
+            audio = resample(audio, source_sample_rate, self.target_sample_rate)
 
             # to mel spectrogram
             mel_spec = self.mel_spectrogram(audio)
@@ -251,21 +301,28 @@ def load_dataset(
     """
     dataset_type    - "CustomDataset" if you want to use tokenizer name and default data path to load for train_dataset
                     - "CustomDatasetPath" if you just want to pass the full path to a preprocessed dataset without relying on tokenizer
+    audio_type      - "raw" to compute mels from the audio files on the fly
+                    - "mel" for mels precomputed with train/datasets/prepare_mel_shards.py (mel/ next to raw.arrow)
     """
 
     print("Loading dataset ...")
 
-    if dataset_type == "CustomDataset":
-        rel_data_path = str(files("f5_tts").joinpath(f"../../data/{dataset_name}"))
-        if audio_type == "raw":
+    if dataset_type in ("CustomDataset", "CustomDatasetPath"):
+        if dataset_type == "CustomDataset":
+            rel_data_path = str(files("f5_tts").joinpath(f"../../data/{dataset_name}"))
+        else:
+            rel_data_path = dataset_name
+        mel_shards = None
+        if audio_type == "mel" and not os.path.isdir(f"{rel_data_path}/mel"):  # mel.arrow with mel_spec lists
+            train_dataset = Dataset_.from_file(f"{rel_data_path}/mel.arrow")
+        else:
             try:
                 train_dataset = load_from_disk(f"{rel_data_path}/raw")
             except:  # noqa: E722
                 train_dataset = Dataset_.from_file(f"{rel_data_path}/raw.arrow")
-            preprocessed_mel = False
-        elif audio_type == "mel":
-            train_dataset = Dataset_.from_file(f"{rel_data_path}/mel.arrow")
-            preprocessed_mel = True
+            if audio_type == "mel":
+                mel_shards = MelShards(f"{rel_data_path}/mel")
+        preprocessed_mel = audio_type == "mel"
         with open(f"{rel_data_path}/duration.json", "r", encoding="utf-8") as f:
             data_dict = json.load(f)
         durations = data_dict["duration"]
@@ -274,22 +331,10 @@ def load_dataset(
             durations=durations,
             preprocessed_mel=preprocessed_mel,
             mel_spec_module=mel_spec_module,
+            mel_shards=mel_shards,
             **mel_spec_kwargs,
         )
 
-    elif dataset_type == "CustomDatasetPath":
-        try:
-            train_dataset = load_from_disk(f"{dataset_name}/raw")
-        except:  # noqa: E722
-            train_dataset = Dataset_.from_file(f"{dataset_name}/raw.arrow")
-
-        with open(f"{dataset_name}/duration.json", "r", encoding="utf-8") as f:
-            data_dict = json.load(f)
-        durations = data_dict["duration"]
-        train_dataset = CustomDataset(
-            train_dataset, durations=durations, preprocessed_mel=preprocessed_mel, **mel_spec_kwargs
-        )
-
     elif dataset_type == "HFDataset":
         print(
             "Should manually modify the path of huggingface dataset to your need.\n"
@@ -306,25 +351,42 @@ def load_dataset(
 # collation
 
 
-def collate_fn(batch):
+def pack_sequences(lengths: list[int], pack_length: int):
+    """
+    First-fit decreasing packing of sequences into rows of pack_length frames, for DiT.forward_packed. Returns
+    the row of each sequence and its offset in the row. Sequences longer than pack_length get a row of their own.
+    """
+    rows, offsets, row_ends = [0] * len(lengths), [0] * len(lengths), []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        row = next((r for r, end in enumerate(row_ends) if end + lengths[i] <= pack_length), len(row_ends))
+        if row == len(row_ends):
+            row_ends.append(0)
+        rows[i], offsets[i] = row, row_ends[row]
+        row_ends[row] += lengths[i]
+    return torch.LongTensor(rows), torch.LongTensor(offsets)
+
+
+def collate_fn(batch, pack_length: int | None = None):
     mel_specs = [item["mel_spec"].squeeze(0) for item in batch]
     mel_lengths = torch.LongTensor([spec.shape[-1] for spec in mel_specs])
     max_mel_length = mel_lengths.amax()
 
-    padded_mel_specs = []
-    for spec in mel_specs:  # TODO. maybe records mask for attention here
-        padding = (0, max_mel_length - spec.size(-1))
-        padded_spec = F.pad(spec, padding, value=0)
-        padded_mel_specs.append(padded_spec)
+    # zero padded, in one copy per mel, casting views of fp16 mel shards to float32 on the way
+    padded_mel_specs = torch.zeros(len(mel_specs), mel_specs[0].shape[0], int(max_mel_length), dtype=torch.float32)
+    for i, spec in enumerate(mel_specs):  # TODO. maybe records mask for attention here
+        padded_mel_specs[i, :, : spec.shape[-1]] = spec
 
-    mel_specs = torch.stack(padded_mel_specs)
+    mel_specs = padded_mel_specs
 
     text = [item["text"] for item in batch]
     text_lengths = torch.LongTensor([len(item) for item in text])
 
-    return dict(
+    collated = dict(
         mel=mel_specs,
         mel_lengths=mel_lengths,
         text=text,
         text_lengths=text_lengths,
     )
+    if pack_length is not None:  # layout of the sequences packed into rows of pack_length frames
+        collated["pack_rows"], collated["pack_offsets"] = pack_sequences(mel_lengths.tolist(), pack_length)
+    return collated
@@ -0,0 +1,120 @@
+"""
+ein notation:
+b - batch
+n - sequence
+nt - text sequence
+d - dimension
+"""
+
+from __future__ import annotations
+
+import math
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from f5_tts.model.modules import ConvNeXtV2Block
+from f5_tts.model.utils import exists, list_str_to_idx, list_str_to_tensor
+
+
+class DurationPredictor(nn.Module):
+    """
+    Lightweight per-token duration model, replacing the utf-8 byte ratio used to size the generated mel.
+
+    A small convnext text encoder predicts how many mel frames each token takes, in context.
+    Trained on (text, mel length) pairs only, no alignment needed: token durations of an utterance sum to its length.
+    At inference the reference prompt sets the pace, the generated part gets
+    ``ref_mel_len * (sum of gen token durations) / (sum of ref token durations)`` frames,
+    so e.g. vietnamese diacritics no longer count as extra length.
+    """
+
+    def __init__(
+        self,
+        text_num_embeds=256,
+        text_dim=256,
+        conv_layers=4,
+        conv_mult=2,
+        init_frames_per_token=7.0,  # ~15 chars/s at 24khz, hop 256
+        vocab_char_map: dict[str:int] | None = None,
+    ):
+        super().__init__()
+        self.config = dict(
+            text_num_embeds=text_num_embeds,
+            text_dim=text_dim,
+            conv_layers=conv_layers,
+            conv_mult=conv_mult,
+            init_frames_per_token=init_frames_per_token,
+        )
+
+        self.text_embed = nn.Embedding(text_num_embeds + 1, text_dim)  # use 0 as filler token
+        self.text_blocks = nn.ModuleList(
+            [ConvNeXtV2Block(text_dim, text_dim * conv_mult) for _ in range(conv_layers)]
+        )
+        self.norm = nn.LayerNorm(text_dim)
+        self.to_duration = nn.Linear(text_dim, 1)
+
+        # start out from a constant rate, softplus^-1
+        nn.init.zeros_(self.to_duration.weight)
+        nn.init.constant_(self.to_duration.bias, math.log(math.expm1(init_frames_per_token)))
+
+        self.vocab_char_map = vocab_char_map
+
+    @property
+    def device(self):
+        return next(self.parameters()).device
+
+    def tokenize(self, text: int["b nt"] | list[str]) -> int["b nt"]:  # noqa: F722
+        if isinstance(text, list):
+            if exists(self.vocab_char_map):
+                text = list_str_to_idx(text, self.vocab_char_map)
+            else:
+                text = list_str_to_tensor(text)
+        return text.to(self.device)
+
+    def token_durations(self, text: int["b nt"] | list[str]) -> float["b nt"]:  # noqa: F722
+        text = self.tokenize(text) + 1  # use 0 as filler token. preprocess of batch pad -1, see list_str_to_idx()
+        text_mask = (text != 0).unsqueeze(-1)
+
+        x = self.text_embed(text)
+        for block in self.text_blocks:
+            x = block(x.masked_fill(~text_mask, 0.0))
+        x = self.norm(x)
+
+        durations = F.softplus(self.to_duration(x).squeeze(-1))
+        return durations.masked_fill(~text_mask.squeeze(-1), 0.0)
+
+    def forward(
+        self,
+        text: int["b nt"] | list[str],  # noqa: F722
+        *,
+        lens: int["b"],  # noqa: F821
+    ):
+        # token durations should add up to the mel length, l1 in log space so long and short utterances weigh the same
+        pred = self.token_durations(text).sum(dim=-1)
+        return F.l1_loss(pred.clamp(min=1.0).log(), lens.to(pred.device).float().log())
+
+    @torch.no_grad()
+    def predict(
+        self,
+        text: int["b nt"] | list[str],  # noqa: F722  ref_text + gen_text, tokenized
+        ref_text_len: int | int["b"],  # noqa: F821  number of tokens belonging to ref_text
+        ref_mel_len: int | int["b"],  # noqa: F821
+        speed=1.0,
+    ) -> int["b"]:  # noqa: F821
+        """Total mel length, ref + gen, to pass as ``duration`` to ``CFM.sample``."""
+        self.eval()
+        durations = self.token_durations(text)
+        batch, device = durations.shape[0], durations.device
+
+        if isinstance(ref_text_len, int):
+            ref_text_len = torch.full((batch,), ref_text_len, device=device)
+        if isinstance(ref_mel_len, int):
+            ref_mel_len = torch.full((batch,), ref_mel_len, device=device)
+        ref_text_len, ref_mel_len = ref_text_len.to(device), ref_mel_len.to(device)
+
+        is_ref = torch.arange(durations.shape[1], device=device)[None, :] < ref_text_len[:, None]
+        ref_frames = durations.masked_fill(~is_ref, 0.0).sum(dim=-1).clamp(min=1e-3)
+        gen_frames = durations.masked_fill(is_ref, 0.0).sum(dim=-1)
+
+        return ref_mel_len + (ref_mel_len.float() * gen_frames / ref_frames / speed).long()
@@ -10,6 +10,7 @@ d - dimension
 from __future__ import annotations
 
 import math
+import warnings
 from typing import Optional
 
 import torch
@@ -25,6 +26,23 @@ from x_transformers.x_transformers import apply_rotary_pos_emb
 
 mel_basis_cache = {}
 hann_window_cache = {}
+mel_stft_cache = {}
+resampler_cache = {}
+
+
+def get_resampler(orig_sample_rate, target_sample_rate, device="cpu", dtype=torch.float32):
+    # resampling kernels are built once per sample rates, device and dtype, and then reused
+    key = f"{orig_sample_rate}_{target_sample_rate}_{torch.device(device)}_{dtype}"
+    if key not in resampler_cache:
+        resampler = torchaudio.transforms.Resample(orig_sample_rate, target_sample_rate)
+        resampler_cache[key] = resampler.to(device=device, dtype=dtype)
+    return resampler_cache[key]
+
+
+def resample(waveform, orig_sample_rate, target_sample_rate):
+    if orig_sample_rate == target_sample_rate:
+        return waveform
+    return get_resampler(orig_sample_rate, target_sample_rate, waveform.device, waveform.dtype)(waveform)
 
 
 def get_bigvgan_mel_spectrogram(
@@ -80,17 +98,23 @@ def get_vocos_mel_spectrogram(
     hop_length=256,
     win_length=1024,
 ):
-    mel_stft = torchaudio.transforms.MelSpectrogram(
-        sample_rate=target_sample_rate,
-        n_fft=n_fft,
-        win_length=win_length,
-        hop_length=hop_length,
-        n_mels=n_mel_channels,
-        power=1,
-        center=True,
-        normalized=False,
-        norm=None,
-    ).to(waveform.device)
+    device = waveform.device
+    key = f"{n_fft}_{n_mel_channels}_{target_sample_rate}_{hop_length}_{win_length}_{device}"
+
+    if key not in mel_stft_cache:
+        mel_stft_cache[key] = torchaudio.transforms.MelSpectrogram(
+            sample_rate=target_sample_rate,
+            n_fft=n_fft,
+            win_length=win_length,
+            hop_length=hop_length,
+            n_mels=n_mel_channels,
+            power=1,
+            center=True,
+            normalized=False,
+            norm=None,
+        ).to(device)
+
+    mel_stft = mel_stft_cache[key]
     if len(waveform.shape) == 3:
         waveform = waveform.squeeze(1)  # 'b 1 nw -> b nw'
 
@@ -176,16 +200,17 @@ class ConvPositionEmbedding(nn.Module):
         )
 
     def forward(self, x: float["b n d"], mask: bool["b n"] | None = None):  # noqa: F722
-        if mask is not None:
-            mask = mask[..., None]
-            x = x.masked_fill(~mask, 0.0)
+        if mask is None:
+            return self.conv1d(x.permute(0, 2, 1)).permute(0, 2, 1)
 
+        # padding zeroed before each convolution, as the zero padding at sequence ends
+        mask = mask[:, None, :]
         x = x.permute(0, 2, 1)
-        x = self.conv1d(x)
-        out = x.permute(0, 2, 1)
-
-        if mask is not None:
-            out = out.masked_fill(~mask, 0.0)
+        for layer in self.conv1d:
+            if isinstance(layer, nn.Conv1d):
+                x = x.masked_fill(~mask, 0.0)
+            x = layer(x)
+        out = x.masked_fill(~mask, 0.0).permute(0, 2, 1)
 
         return out
 
@@ -298,6 +323,11 @@ class RMSNorm(nn.Module):
 # return with modulated x for attn input, and params for later mlp modulation
 
 
+def broadcast_modulation(modulation):
+    # b d -> b 1 d, same for the whole sequence. b n d (per token, e.g. packed sequences of different time steps) as is
+    return modulation.unsqueeze(1) if modulation.ndim == 2 else modulation
+
+
 class AdaLayerNorm(nn.Module):
     def __init__(self, dim):
         super().__init__()
@@ -307,11 +337,15 @@ class AdaLayerNorm(nn.Module):
 
         self.norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
 
-    def forward(self, x, emb=None):
-        emb = self.linear(self.silu(emb))
-        shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = torch.chunk(emb, 6, dim=1)
+    def modulation(self, emb):
+        return torch.chunk(self.linear(self.silu(emb)), 6, dim=-1)
 
-        x = self.norm(x) * (1 + scale_msa[:, None]) + shift_msa[:, None]
+    def forward(self, x, emb=None, modulation=None):  # modulation: precomputed from emb, see DiT InferenceSession
+        if modulation is None:
+            modulation = self.modulation(emb)
+        shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = modulation
+
+        x = self.norm(x) * (1 + broadcast_modulation(scale_msa)) + broadcast_modulation(shift_msa)
         return x, gate_msa, shift_mlp, scale_mlp, gate_mlp
 
 
@@ -328,11 +362,15 @@ class AdaLayerNorm_Final(nn.Module):
 
         self.norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
 
-    def forward(self, x, emb):
-        emb = self.linear(self.silu(emb))
-        scale, shift = torch.chunk(emb, 2, dim=1)
+    def modulation(self, emb):
+        return torch.chunk(self.linear(self.silu(emb)), 2, dim=-1)
+
+    def forward(self, x, emb=None, modulation=None):
+        if modulation is None:
+            modulation = self.modulation(emb)
+        scale, shift = modulation
 
-        x = self.norm(x) * (1 + scale)[:, None, :] + shift[:, None, :]
+        x = self.norm(x) * (1 + broadcast_modulation(scale)) + broadcast_modulation(shift)
         return x
 
 
@@ -429,6 +467,102 @@ class Attention(nn.Module):
             return self.processor(self, x, mask=mask, rope=rope)
 
 
+# Attention backends of scaled_dot_product_attention
+
+ATTN_BACKENDS = ("torch", "math", "efficient", "flash", "cudnn")  # torch: let pytorch pick the kernel
+CUDA_ATTN_BACKENDS = ("efficient", "cudnn")  # no cpu kernels, "No viable backend" elsewhere
+
+
+def check_attn_backend(attn_backend, device):
+    # attn_backend to build a model with for device, "torch" in place of a cuda only kernel elsewhere
+    sdpa_backends(attn_backend)  # validate
+    if attn_backend in CUDA_ATTN_BACKENDS and torch.device(device).type != "cuda":
+        warnings.warn(f"attn_backend {attn_backend} is CUDA only, falling back to 'torch' on {device}.")
+        return "torch"
+    return attn_backend
+
+
+def sdpa_backends(attn_backend):
+    # torch.nn.attention.SDPBackend list for sdpa_kernel, None to leave the choice to pytorch
+    if attn_backend not in ATTN_BACKENDS:
+        raise ValueError(f"Unknown attn_backend: {attn_backend}, choose from {', '.join(ATTN_BACKENDS)}")
+    if attn_backend == "torch":
+        return None
+    try:
+        from torch.nn.attention import SDPBackend
+    except ImportError:
+        raise ImportError(f"attn_backend {attn_backend} requires PyTorch 2.3, please upgrade or use 'torch'.")
+    return [
+        {
+            "math": SDPBackend.MATH,
+            "efficient": SDPBackend.EFFICIENT_ATTENTION,
+            "flash": SDPBackend.FLASH_ATTENTION,
+            "cudnn": SDPBackend.CUDNN_ATTENTION,
+        }[attn_backend]
+    ]
+
+
+def varlen_flash_attention(query, key, value, segment_ids):
+    # flash kernels take no mask, attend within each segment (run of equal non-zero ids) of the unpadded tokens.
+    # packed along tokens with cumulative sequence lengths where varlen flash attention is there (CUDA, PyTorch 2.9+),
+    # else one segment at a time. padded query positions are left zero
+    batch_size, heads, seq_len, head_dim = query.shape
+    try:
+        from torch.nn.attention.varlen import varlen_attn
+    except ImportError:
+        varlen_attn = None
+
+    valid = segment_ids > 0
+    lens = torch.unique_consecutive(segment_ids[valid], return_counts=True)[1]
+    packed = [tensor.transpose(1, 2)[valid] for tensor in (query, key, value)]  # (sum lens) h d
+
+    if varlen_attn is not None and query.is_cuda:
+        cu_seqlens = F.pad(lens.cumsum(dim=0, dtype=torch.int32), (1, 0))
+        max_len = lens.max().item()
+        out = varlen_attn(*packed, cu_seqlens, cu_seqlens, max_len, max_len)
+    else:
+        out = []
+        for segment in zip(*(tensor.split(lens.tolist()) for tensor in packed)):
+            q, k, v = (tensor.transpose(0, 1).unsqueeze(0) for tensor in segment)  # n h d -> 1 h n d
+            out.append(F.scaled_dot_product_attention(q, k, v)[0].transpose(0, 1))
+        out = torch.cat(out)
+
+    x = query.new_zeros(batch_size, seq_len, heads, head_dim)
+    x[valid] = out
+    return x.transpose(1, 2)
+
+
+def masked_attention(query, key, value, mask=None, attn_backend="torch"):
+    """
+    Scaled dot product attention over ``b h n d``.
+
+    ``mask`` is either a boolean key padding mask (``b n``), or integer segment ids (``b n``) of packed sequences,
+    tokens attending only to those of the same segment, 0 for padding.
+    The key padding mask is broadcast as ``b 1 1 n`` over heads and queries rather than expanded to a dense
+    ``b h n n`` one, which the math kernel would materialize and which keeps fused kernels from being picked.
+    Segments need a ``b 1 n n`` block diagonal mask, except with the flash backend which attends per segment.
+    ``attn_backend`` restricts the kernel scaled_dot_product_attention may use, see ``ATTN_BACKENDS``, the cuda only
+    ones left to pytorch off cuda.
+    """
+    if mask is None:
+        attn_mask = None
+    elif mask.dtype == torch.bool:
+        attn_mask = mask[:, None, None, :]
+    else:  # padding attends to padding, so that no row is fully masked
+        attn_mask = mask[:, None, :, None] == mask[:, None, None, :]
+    if attn_backend == "torch" or (attn_backend in CUDA_ATTN_BACKENDS and not query.is_cuda):
+        return F.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask, dropout_p=0.0, is_causal=False)
+
+    from torch.nn.attention import sdpa_kernel
+
+    with sdpa_kernel(sdpa_backends(attn_backend)):
+        if attn_backend == "flash" and mask is not None:
+            if mask.dtype == torch.bool:  # one segment per sequence
+                mask = mask * torch.arange(1, mask.shape[0] + 1, device=mask.device)[:, None]
+            return varlen_flash_attention(query, key, value, mask)
+        return F.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask, dropout_p=0.0, is_causal=False)
+
+
 # Attention processor
 
 
@@ -436,14 +570,17 @@ class AttnProcessor:
     def __init__(
         self,
         pe_attn_head: int | None = None,  # number of attention head to apply rope, None for all
+        attn_backend: str = "torch",  # kernel of scaled_dot_product_attention, see ATTN_BACKENDS
     ):
         self.pe_attn_head = pe_attn_head
+        sdpa_backends(attn_backend)  # validate
+        self.attn_backend = attn_backend
 
     def __call__(
         self,
         attn: Attention,
         x: float["b n d"],  # noised input x  # noqa: F722
-        mask: bool["b n"] | None = None,  # noqa: F722
+        mask: bool["b n"] | int["b n"] | None = None,  # noqa: F722. key padding mask, or segment ids if packed
         rope=None,  # rotary position embedding
     ) -> torch.FloatTensor:
         batch_size = x.shape[0]
@@ -480,14 +617,7 @@ class AttnProcessor:
                 key = apply_rotary_pos_emb(key, freqs, k_xpos_scale)
 
         # mask. e.g. inference got a batch with different target durations, mask out the padding
-        if mask is not None:
-            attn_mask = mask
-            attn_mask = attn_mask.unsqueeze(1).unsqueeze(1)  # 'b n -> b 1 1 n'
-            attn_mask = attn_mask.expand(batch_size, attn.heads, query.shape[-2], key.shape[-2])
-        else:
-            attn_mask = None
-
-        x = F.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask, dropout_p=0.0, is_causal=False)
+        x = masked_attention(query, key, value, mask=mask, attn_backend=self.attn_backend)
         x = x.transpose(1, 2).reshape(batch_size, -1, attn.heads * head_dim)
         x = x.to(query.dtype)
 
@@ -497,7 +627,7 @@ class AttnProcessor:
         x = attn.to_out[1](x)
 
         if mask is not None:
-            mask = mask.unsqueeze(-1)
+            mask = mask.unsqueeze(-1) if mask.dtype == torch.bool else mask.unsqueeze(-1) > 0
             x = x.masked_fill(~mask, 0.0)
 
         return x
@@ -508,8 +638,12 @@ class AttnProcessor:
 
 
 class JointAttnProcessor:
-    def __init__(self):
-        pass
+    def __init__(
+        self,
+        attn_backend: str = "torch",  # kernel of scaled_dot_product_attention, see ATTN_BACKENDS
+    ):
+        sdpa_backends(attn_backend)  # validate
+        self.attn_backend = attn_backend
 
     def __call__(
         self,
@@ -572,14 +706,8 @@ class JointAttnProcessor:
         value = torch.cat([value, c_value], dim=2)
 
         # mask. e.g. inference got a batch with different target durations, mask out the padding
-        if mask is not None:
-            attn_mask = F.pad(mask, (0, c.shape[1]), value=True)  # no mask for c (text)
-            attn_mask = attn_mask.unsqueeze(1).unsqueeze(1)  # 'b n -> b 1 1 n'
-            attn_mask = attn_mask.expand(batch_size, attn.heads, query.shape[-2], key.shape[-2])
-        else:
-            attn_mask = None
-
-        x = F.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask, dropout_p=0.0, is_causal=False)
+        attn_mask = F.pad(mask, (0, c.shape[1]), value=True) if mask is not None else None  # no mask for c (text)
+        x = masked_attention(query, key, value, mask=attn_mask, attn_backend=self.attn_backend)
         x = x.transpose(1, 2).reshape(batch_size, -1, attn.heads * head_dim)
         x = x.to(query.dtype)
 
@@ -608,12 +736,14 @@ class JointAttnProcessor:
 
 
 class DiTBlock(nn.Module):
-    def __init__(self, dim, heads, dim_head, ff_mult=4, dropout=0.1, qk_norm=None, pe_attn_head=None):
+    def __init__(
+        self, dim, heads, dim_head, ff_mult=4, dropout=0.1, qk_norm=None, pe_attn_head=None, attn_backend="torch"
+    ):
         super().__init__()
 
         self.attn_norm = AdaLayerNorm(dim)
         self.attn = Attention(
-            processor=AttnProcessor(pe_attn_head=pe_attn_head),
+            processor=AttnProcessor(pe_attn_head=pe_attn_head, attn_backend=attn_backend),
             dim=dim,
             heads=heads,
             dim_head=dim_head,
@@ -624,19 +754,19 @@ class DiTBlock(nn.Module):
         self.ff_norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
         self.ff = FeedForward(dim=dim, mult=ff_mult, dropout=dropout, approximate="tanh")
 
-    def forward(self, x, t, mask=None, rope=None):  # x: noised input, t: time embedding
+    def forward(self, x, t, mask=None, rope=None, modulation=None):  # x: noised input, t: time embedding
         # pre-norm & modulation for attention input
-        norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attn_norm(x, emb=t)
+        norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attn_norm(x, emb=t, modulation=modulation)
 
         # attention
         attn_output = self.attn(x=norm, mask=mask, rope=rope)
 
         # process attention output for input x
-        x = x + gate_msa.unsqueeze(1) * attn_output
+        x = x + broadcast_modulation(gate_msa) * attn_output
 
-        norm = self.ff_norm(x) * (1 + scale_mlp[:, None]) + shift_mlp[:, None]
+        norm = self.ff_norm(x) * (1 + broadcast_modulation(scale_mlp)) + broadcast_modulation(shift_mlp)
         ff_output = self.ff(norm)
-        x = x + gate_mlp.unsqueeze(1) * ff_output
+        x = x + broadcast_modulation(gate_mlp) * ff_output
 
         return x
 
@@ -655,7 +785,16 @@ class MMDiTBlock(nn.Module):
     """
 
     def __init__(
-        self, dim, heads, dim_head, ff_mult=4, dropout=0.1, context_dim=None, context_pre_only=False, qk_norm=None
+        self,
+        dim,
+        heads,
+        dim_head,
+        ff_mult=4,
+        dropout=0.1,
+        context_dim=None,
+        context_pre_only=False,
+        qk_norm=None,
+        attn_backend="torch",
     ):
         super().__init__()
         if context_dim is None:
@@ -665,7 +804,7 @@ class MMDiTBlock(nn.Module):
         self.attn_norm_c = AdaLayerNorm_Final(context_dim) if context_pre_only else AdaLayerNorm(context_dim)
         self.attn_norm_x = AdaLayerNorm(dim)
         self.attn = Attention(
-            processor=JointAttnProcessor(),
+            processor=JointAttnProcessor(attn_backend=attn_backend),
             dim=dim,
             heads=heads,
             dim_head=dim_head,
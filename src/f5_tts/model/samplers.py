@@ -0,0 +1,139 @@
+"""
+ODE solvers for CFM.sample, integrating the flow dy/dt = fn(t, y) from noise (t=0) to mel (t=1).
+
+A sampler takes the velocity function, the initial noise and the time grid, and returns the final state. The state
+is updated in place, starting from y0 itself, so that only the current one is held; pass a list as ``trajectory`` to
+also collect a copy of the state at each accepted step (y0 first). The number of function evaluations (NFE, i.e.
+transformer forwards per cfg branch) is what the budget ``steps`` of CFM.sample counts: the grid holds
+``steps // nfe_per_step`` intervals, so all samplers cost about the same for a given ``steps``.
+
+euler         1 NFE per step, first order
+midpoint      2 NFE per step, second order
+heun          2 NFE per step, second order (trapezoidal predictor-corrector)
+dpm_solver_2m 1 NFE per step, second order multistep reusing the previous velocity, DPM-Solver++(2M) written
+              for the linear interpolation path x_t = t x1 + (1 - t) x0 of flow matching
+adaptive_heun step size chosen from the heun-euler error estimate, with the NFE budget as hard limit
+"""
+
+from __future__ import annotations
+
+import math
+
+import torch
+
+
+def _record(trajectory, y):
+    if trajectory is not None:
+        trajectory.append(y.clone())
+
+
+def euler(fn, y0, t, nfe=None, trajectory=None):
+    y = y0
+    _record(trajectory, y)
+    for t0, t1 in zip(t[:-1], t[1:]):
+        y += (t1 - t0) * fn(t0, y)
+        _record(trajectory, y)
+    return y
+
+
+def midpoint(fn, y0, t, nfe=None, trajectory=None):
+    y = y0
+    _record(trajectory, y)
+    for t0, t1 in zip(t[:-1], t[1:]):
+        half_dt = (t1 - t0) / 2
+        y_mid = y + half_dt * fn(t0, y)
+        y += (t1 - t0) * fn(t0 + half_dt, y_mid)
+        _record(trajectory, y)
+    return y
+
+
+def heun(fn, y0, t, nfe=None, trajectory=None):
+    y = y0
+    _record(trajectory, y)
+    for t0, t1 in zip(t[:-1], t[1:]):
+        dt = t1 - t0
+        k1 = fn(t0, y)
+        k2 = fn(t1, y + dt * k1)
+        y += dt / 2 * (k1 + k2)
+        _record(trajectory, y)
+    return y
+
+
+def dpm_solver_2m(fn, y0, t, nfe=None, trajectory=None):
+    # x1 (data) prediction from velocity: x1 = y + (1 - t) v. with alpha_t = t, sigma_t = 1 - t, the first order
+    # DPM-Solver++ update is exactly euler, the second order one extrapolates the x1 prediction linearly in
+    # lambda = log(alpha_t / sigma_t). steps without a previous prediction at t > 0 (lambda = -inf at t = 0) and the
+    # last step (t = 1) are first order
+    def log_snr(t):
+        return math.log(t) - math.log1p(-t)
+
+    y = y0
+    _record(trajectory, y)
+    prev_t = prev_x1 = None
+    times = t.tolist()  # step coefficients computed on host, one copy of the grid instead of a sync per step
+    for i, (t0, t1) in enumerate(zip(t[:-1], t[1:])):
+        v = fn(t0, y)
+        s0, s1 = times[i], times[i + 1]
+        x1 = y + (1 - s0) * v
+        if prev_x1 is None or s0 <= 0 or s1 >= 1:
+            y += (t1 - t0) * v
+        else:
+            r = (log_snr(s0) - log_snr(prev_t)) / (log_snr(s1) - log_snr(s0))
+            x1_corrected = x1 + (x1 - prev_x1) / (2 * r)
+            y.mul_((1 - s1) / (1 - s0)).add_(x1_corrected, alpha=(s1 - s0) / (1 - s0))
+        prev_t, prev_x1 = (s0, x1) if s0 > 0 else (None, None)
+        _record(trajectory, y)
+    return y
+
+
+def adaptive_heun(fn, y0, t, nfe=None, trajectory=None, rtol=1e-2, atol=1e-2, safety=0.9):
+    # heun step with euler as embedded lower order estimate, rejected steps reuse the velocity at the step start.
+    # the step never gets smaller than what the evaluations left can afford to reach the end, so at most nfe
+    # evaluations are done, the last step being euler if a single one is left
+    t_end = t[-1]
+    budget = nfe if nfe is not None else 2 * (len(t) - 1)
+    dt = t[1] - t[0]  # initial step from the schedule
+
+    y, t0, k1 = y0, t[0], None
+    _record(trajectory, y)
+    while t0 < t_end and budget > 0:
+        if k1 is None:
+            k1 = fn(t0, y)
+            budget -= 1
+        remaining = t_end - t0
+        if budget == 0:  # no evaluation left for a correction
+            y += remaining * k1
+            _record(trajectory, y)
+            break
+
+        # this step, then heun steps of 2 evaluations (or a last euler one) with the rest of the budget
+        min_dt = remaining / (1 + budget // 2)
+        dt = torch.clamp(dt, min=min_dt, max=remaining)
+        y_euler = y + dt * k1
+        k2 = fn(t0 + dt, y_euler)
+        budget -= 1
+        y_heun = y + dt / 2 * (k1 + k2)
+
+        scale = atol + rtol * torch.maximum(y.abs(), y_heun.abs())
+        error = ((y_heun - y_euler) / scale).pow(2).flatten(1).mean(dim=1).sqrt().amax().item()
+        if error <= 1 or dt <= min_dt:
+            y, k1 = y_heun, None
+            t0 = t_end if dt >= remaining else t0 + dt
+            _record(trajectory, y)
+        dt = dt * (min(max(safety * error**-0.5, 0.2), 5.0) if error > 0 else 5.0)
+    return y
+
+
+SAMPLERS = {  # name -> (solver, NFE per step)
+    "euler": (euler, 1),
+    "midpoint": (midpoint, 2),
+    "heun": (heun, 2),
+    "dpm_solver_2m": (dpm_solver_2m, 1),
+    "adaptive_heun": (adaptive_heun, 2),
+}
+
+
+def get_sampler(name):
+    if name not in SAMPLERS:
+        raise ValueError(f"Unknown sampler: {name}, choose from {', '.join(SAMPLERS)}")
+    return SAMPLERS[name]
@@ -3,6 +3,7 @@ from __future__ import annotations
 import gc
 import math
 import os
+from functools import partial
 
 import torch
 import torchaudio
@@ -35,6 +36,7 @@ class Trainer:
         batch_size_per_gpu=32,
         batch_size_type: str = "sample",
         max_samples=32,
+        pack_length: int | None = None,  # pack sequences into rows of pack_length frames, DiT only
         grad_accumulation_steps=1,
         max_grad_norm=1.0,
         noise_scheduler: str | None = None,
@@ -81,6 +83,7 @@ class Trainer:
                     "batch_size_per_gpu": batch_size_per_gpu,
                     "batch_size_type": batch_size_type,
                     "max_samples": max_samples,
+                    "pack_length": pack_length,
                     "grad_accumulation_steps": grad_accumulation_steps,
                     "max_grad_norm": max_grad_norm,
                     "noise_scheduler": noise_scheduler,
@@ -119,6 +122,7 @@ class Trainer:
         self.batch_size_per_gpu = batch_size_per_gpu
         self.batch_size_type = batch_size_type
         self.max_samples = max_samples
+        self.pack_length = pack_length
         self.grad_accumulation_steps = grad_accumulation_steps
         self.max_grad_norm = max_grad_norm
 
@@ -139,10 +143,23 @@ class Trainer:
             self.optimizer = AdamW(model.parameters(), lr=learning_rate)
         self.model, self.optimizer = self.accelerator.prepare(self.model, self.optimizer)
 
+        # duration predictor is trained alongside, on the same batches, with its own optimizer
+        if self.duration_predictor is not None:
+            self.duration_optimizer = AdamW(duration_predictor.parameters(), lr=learning_rate)
+            self.duration_predictor, self.duration_optimizer = self.accelerator.prepare(
+                self.duration_predictor, self.duration_optimizer
+            )
+
     @property
     def is_main(self):
         return self.accelerator.is_main_process
 
+    @property
+    def trained_models(self):
+        if self.duration_predictor is not None:
+            return self.model, self.duration_predictor
+        return (self.model,)
+
     def save_checkpoint(self, update, last=False):
         self.accelerator.wait_for_everyone()
         if self.is_main:
@@ -153,6 +170,11 @@ class Trainer:
                 scheduler_state_dict=self.scheduler.state_dict(),
                 update=update,
             )
+            if self.duration_predictor is not None:
+                duration_predictor = self.accelerator.unwrap_model(self.duration_predictor)
+                checkpoint["duration_predictor_state_dict"] = duration_predictor.state_dict()
+                checkpoint["duration_predictor_config"] = duration_predictor.config
+                checkpoint["duration_optimizer_state_dict"] = self.duration_optimizer.state_dict()
             if not os.path.exists(self.checkpoint_path):
                 os.makedirs(self.checkpoint_path)
             if last:
@@ -244,6 +266,11 @@ class Trainer:
             self.accelerator.unwrap_model(self.optimizer).load_state_dict(checkpoint["optimizer_state_dict"])
             if self.scheduler:
                 self.scheduler.load_state_dict(checkpoint["scheduler_state_dict"])
+            if self.duration_predictor is not None and "duration_predictor_state_dict" in checkpoint:
+                self.accelerator.unwrap_model(self.duration_predictor).load_state_dict(
+                    checkpoint["duration_predictor_state_dict"]
+                )
+                self.duration_optimizer.load_state_dict(checkpoint["duration_optimizer_state_dict"])
             update = checkpoint["update"]
         else:
             checkpoint["model_state_dict"] = {
@@ -275,10 +302,11 @@ class Trainer:
         else:
             generator = None
 
+        collate = partial(collate_fn, pack_length=self.pack_length)
         if self.batch_size_type == "sample":
             train_dataloader = DataLoader(
                 train_dataset,
-                collate_fn=collate_fn,
+                collate_fn=collate,
                 num_workers=num_workers,
                 pin_memory=True,
                 persistent_workers=True,
@@ -298,7 +326,7 @@ class Trainer:
             )
             train_dataloader = DataLoader(
                 train_dataset,
-                collate_fn=collate_fn,
+                collate_fn=collate,
                 num_workers=num_workers,
                 pin_memory=True,
                 persistent_workers=True,
@@ -357,18 +385,25 @@ class Trainer:
             )
 
             for batch in current_dataloader:
-                with self.accelerator.accumulate(self.model):
+                with self.accelerator.accumulate(*self.trained_models):
                     text_inputs = batch["text"]
                     mel_spec = batch["mel"].permute(0, 2, 1)
                     mel_lengths = batch["mel_lengths"]
 
-                    # TODO. add duration predictor training
-                    if self.duration_predictor is not None and self.accelerator.is_local_main_process:
-                        dur_loss = self.duration_predictor(mel_spec, lens=batch.get("durations"))
-                        self.accelerator.log({"duration loss": dur_loss.item()}, step=global_update)
+                    if self.duration_predictor is not None:
+                        dur_loss = self.duration_predictor(text_inputs, lens=mel_lengths)
+                        self.accelerator.backward(dur_loss)
+                        self.duration_optimizer.step()
+                        self.duration_optimizer.zero_grad()
+
+                        if self.accelerator.is_local_main_process:
+                            self.accelerator.log({"duration loss": dur_loss.item()}, step=global_update)
+                            if self.logger == "tensorboard":
+                                self.writer.add_scalar("duration loss", dur_loss.item(), global_update)
 
+                    pack = (batch["pack_rows"], batch["pack_offsets"]) if "pack_rows" in batch else None
                     loss, cond, pred = self.model(
-                        mel_spec, text=text_inputs, lens=mel_lengths, noise_scheduler=self.noise_scheduler
+                        mel_spec, text=text_inputs, lens=mel_lengths, noise_scheduler=self.noise_scheduler, pack=pack
                     )
                     self.accelerator.backward(loss)
 
@@ -0,0 +1,121 @@
+"""
+Benchmark padded batched attention: the dense b h n n boolean mask expanded from the key padding mask, as the attention
+processors used to build it, vs. the b 1 1 n key padding mask of modules.masked_attention with each attention backend
+available on the device. Reports time and peak memory of one attention call (forward, or forward and backward with
+--train) over q, k, v of b h n d, sequences of the batch padded to the longest one.
+
+python src/f5_tts/scripts/benchmark_attention.py --device cuda --seq_lens 1024 2048 4096 --train
+python src/f5_tts/scripts/benchmark_attention.py --device cpu --seq_lens 512 1024 2048
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import torch
+import torch.nn.functional as F
+
+from f5_tts.model.modules import ATTN_BACKENDS, masked_attention
+
+
+def dense_mask_attention(query, key, value, mask):
+    attn_mask = mask.unsqueeze(1).unsqueeze(1)  # 'b n -> b 1 1 n'
+    attn_mask = attn_mask.expand(query.shape[0], query.shape[1], query.shape[-2], key.shape[-2])
+    return F.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask, dropout_p=0.0, is_causal=False)
+
+
+def worker(args, seq_len, mode, results):
+    torch.set_num_threads(args.num_threads or torch.get_num_threads())
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+    torch.manual_seed(0)
+
+    shape = (args.batch_size, args.heads, seq_len, args.dim_head)
+    query, key, value = (torch.randn(shape, device=device, dtype=dtype, requires_grad=args.train) for _ in range(3))
+    # sequence lengths spread from min_fill of the longest one to the longest one
+    lens = torch.linspace(args.min_fill * seq_len, seq_len, args.batch_size, device=device).long()
+    mask = torch.arange(seq_len, device=device)[None, :] < lens[:, None]
+
+    def attention():
+        with torch.set_grad_enabled(args.train):
+            if mode == "dense":
+                x = dense_mask_attention(query, key, value, mask)
+            else:
+                x = masked_attention(query, key, value, mask=mask, attn_backend=mode)
+            if args.train:
+                x.masked_fill(~mask[:, None, :, None], 0.0).sum().backward()
+
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        attention()  # warm up
+    except RuntimeError as e:  # backend not available for this device, dtype or shape
+        results.put(str(e).splitlines()[0])
+        return
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start_memory = torch.cuda.memory_allocated()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        attention()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        peak_memory = (torch.cuda.max_memory_allocated() - start_memory) / 2**20
+    else:  # growth of the peak resident set, warm up included
+        peak_memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss) / 2**10
+    results.put(((time.perf_counter() - start) / args.repeat * 1000, peak_memory))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--dtype", default=None, help="default float16 on cuda, float32 on cpu")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--modes", nargs="+", default=["dense", *ATTN_BACKENDS], choices=["dense", *ATTN_BACKENDS])
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--heads", type=int, default=16)
+    parser.add_argument("--dim_head", type=int, default=64)
+    parser.add_argument("--seq_lens", type=int, nargs="+", default=[1024, 2048, 4096])
+    parser.add_argument("--min_fill", type=float, default=0.5, help="shortest sequence, relative to the longest")
+    parser.add_argument("--train", action="store_true", help="forward and backward")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    args.dtype = args.dtype or ("float16" if args.device.startswith("cuda") else "float32")
+
+    # one process per run, so that the peak memory of a run is not hidden by the previous one
+    context = multiprocessing.get_context("spawn")
+    print(
+        f"\n{args.device} {args.dtype}, batch {args.batch_size}, {args.heads} heads of {args.dim_head}, "
+        f"{'forward and backward' if args.train else 'forward'}\n"
+    )
+    for seq_len in args.seq_lens:
+        baseline = None
+        for mode in args.modes:
+            results = context.Queue()
+            process = context.Process(target=worker, args=(args, seq_len, mode, results))
+            process.start()
+            process.join()
+            label = "dense b h n n mask" if mode == "dense" else f"{mode} b 1 1 n mask"
+            if process.exitcode != 0:  # e.g. killed out of memory
+                print(f"n {seq_len:>5} {label:<22}: failed, exit code {process.exitcode}")
+                continue
+            result = results.get()
+            if isinstance(result, str):
+                print(f"n {seq_len:>5} {label:<22}: not available, {result[:80]}")
+                continue
+            elapsed, peak_memory = result
+            baseline = baseline or elapsed
+            print(
+                f"n {seq_len:>5} {label:<22}: {elapsed:8.1f} ms, x{baseline / elapsed:.2f}, "
+                f"peak memory {peak_memory:7.0f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark classifier-free guided sampling: conditional and unconditional transformer passes run one after the other
+(2 forwards per step) vs. stacked along batch (1 forward per step). Reports throughput and peak memory.
+Weights are randomly initialized unless a checkpoint is given, speed and memory do not depend on them.
+
+python src/f5_tts/scripts/benchmark_batched_cfg.py --models F5TTS_Base F5TTS_Small --device cpu --nfe_step 16
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from importlib.resources import files
+
+sys.path.append(os.getcwd())
+
+import torch
+from omegaconf import OmegaConf
+
+from f5_tts.infer.utils_infer import hop_length, load_checkpoint, target_sample_rate
+from f5_tts.model import CFM, DiT, UNetT  # noqa: F401. used for config
+
+
+def build_model(model_name, ckpt_file, device):
+    model_cfg = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{model_name}.yaml"))).model
+    model_cls = globals()[model_cfg.backbone]
+    model = CFM(
+        transformer=model_cls(**model_cfg.arch, text_num_embeds=256, mel_dim=model_cfg.mel_spec.n_mel_channels),
+        mel_spec_kwargs=model_cfg.mel_spec,
+    ).to(device)
+    if ckpt_file:
+        model = load_checkpoint(model, ckpt_file, device, use_ema=True)
+    return model
+
+
+def run(model, args, batch_size, batch_cfg):
+    ref_len = int(args.ref_seconds * target_sample_rate / hop_length)
+    duration = ref_len + int(args.gen_seconds * target_sample_rate / hop_length)
+    cond = torch.randn(batch_size, ref_len, model.num_channels, device=model.device)
+    text = torch.randint(0, 256, (batch_size, int((args.ref_seconds + args.gen_seconds) * 12)), device=model.device)
+
+    def sample():
+        model.sample(
+            cond,
+            text,
+            duration,
+            steps=args.nfe_step,
+            cfg_strength=2.0,
+            sway_sampling_coef=-1.0,
+            batch_cfg=batch_cfg,
+        )
+
+    sample()  # warm up
+
+    if model.device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        sample()
+    peak_memory = None
+    if model.device.type == "cuda":
+        torch.cuda.synchronize()
+        peak_memory = torch.cuda.max_memory_allocated() / 2**20
+    elapsed = (time.perf_counter() - start) / args.repeat
+
+    return elapsed, batch_size * args.gen_seconds / elapsed, peak_memory
+
+
+def worker(model_name, args, batch_size, batch_cfg, results):
+    torch.set_num_threads(args.num_threads or torch.get_num_threads())
+    model = build_model(model_name, args.ckpt_file, torch.device(args.device))
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    elapsed, throughput, peak_memory = run(model, args, batch_size, batch_cfg)
+    if peak_memory is None:  # growth of the peak resident set over sampling, model weights excluded
+        peak_memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss) / 2**10
+    results.put((elapsed, throughput, peak_memory))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=["F5TTS_Base", "F5TTS_Small"])
+    parser.add_argument("--ckpt_file", default=None, help="only with a single model")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1])
+    parser.add_argument("--ref_seconds", type=float, default=3.0)
+    parser.add_argument("--gen_seconds", type=float, default=5.0)
+    parser.add_argument("--nfe_step", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    # one process per run, so that the peak memory of a run is not hidden by the previous one
+    context = multiprocessing.get_context("spawn")
+    print(
+        f"\ndevice {args.device}, {args.nfe_step} NFE, {args.ref_seconds}s reference + {args.gen_seconds}s generated\n"
+    )
+    for model_name in args.models:
+        for batch_size in args.batch_sizes:
+            baseline = None
+            for batch_cfg in (False, True):
+                results = context.Queue()
+                process = context.Process(target=worker, args=(model_name, args, batch_size, batch_cfg, results))
+                process.start()
+                elapsed, throughput, peak_memory = results.get()
+                process.join()
+                baseline = baseline or elapsed
+                print(
+                    f"{model_name} batch {batch_size} {'batched cfg' if batch_cfg else 'two passes '}: "
+                    f"{elapsed:.2f} s/sample call, {throughput:.2f} s audio/s, x{baseline / elapsed:.2f}, "
+                    f"peak memory {peak_memory:.0f} MiB"
+                )
+
+
+if __name__ == "__main__":
+    main()
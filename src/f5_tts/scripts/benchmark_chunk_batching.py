@@ -0,0 +1,123 @@
+"""
+Benchmark non-streaming long-text inference: chunks sampled one by one vs. together in padded batches.
+
+python src/f5_tts/scripts/benchmark_chunk_batching.py --ckpt_file model/model_last.pt --vocab_file model/vocab.txt \
+    --ref_audio ref.wav --ref_text "cả hai bên hãy cố gắng hiểu cho nhau" --batch_sizes 1 4 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from importlib.resources import files
+
+sys.path.append(os.getcwd())
+
+import torch
+from omegaconf import OmegaConf
+
+from f5_tts.infer.utils_infer import (
+    device,
+    infer_process,
+    load_model,
+    load_vocoder,
+    preprocess_ref_audio_text,
+)
+from f5_tts.model import DiT, UNetT  # noqa: F401. used for config
+
+
+# ~2,000 characters of Vietnamese news-style prose
+ARTICLE = (
+    "Sáng nay, tại Hà Nội, hội nghị về chuyển đổi số trong lĩnh vực giáo dục đã chính thức khai mạc với sự tham dự "
+    "của hơn năm trăm đại biểu đến từ các trường đại học, viện nghiên cứu và doanh nghiệp công nghệ trên cả nước. "
+    "Phát biểu tại phiên khai mạc, đại diện ban tổ chức cho biết chuyển đổi số không chỉ là việc đưa thiết bị hiện "
+    "đại vào lớp học, mà còn là thay đổi cách dạy, cách học và cách quản lý nhà trường. Theo số liệu được công bố, "
+    "trong năm vừa qua, tỷ lệ trường phổ thông sử dụng hệ thống quản lý học tập trực tuyến đã tăng gần gấp đôi so "
+    "với cùng kỳ, đặc biệt ở các tỉnh miền núi phía Bắc và khu vực Tây Nguyên. Tuy nhiên, nhiều giáo viên vẫn gặp "
+    "khó khăn khi tiếp cận công cụ mới do thiếu thời gian đào tạo và hạ tầng mạng chưa ổn định. Một hiệu trưởng "
+    "đến từ tỉnh Lào Cai chia sẻ rằng nhà trường đã phải tận dụng các buổi chiều cuối tuần để bồi dưỡng kỹ năng "
+    "cho đội ngũ, đồng thời kêu gọi phụ huynh hỗ trợ thiết bị cho học sinh có hoàn cảnh khó khăn. Bên cạnh đó, các "
+    "chuyên gia cũng cảnh báo về nguy cơ mất an toàn thông tin khi dữ liệu của học sinh được lưu trữ trên nhiều nền "
+    "tảng khác nhau mà chưa có tiêu chuẩn thống nhất. Họ đề xuất xây dựng một khung pháp lý rõ ràng, quy định trách "
+    "nhiệm của từng bên liên quan và bảo đảm quyền riêng tư của người học. Trong phiên thảo luận buổi chiều, các "
+    "doanh nghiệp giới thiệu nhiều giải pháp ứng dụng trí tuệ nhân tạo, từ hệ thống chấm bài tự động đến trợ lý "
+    "ảo giúp học sinh ôn tập môn tiếng Anh và toán học. Một số đại biểu bày tỏ lo ngại rằng việc phụ thuộc quá "
+    "nhiều vào công nghệ có thể làm giảm khả năng tư duy độc lập của học sinh, vì vậy cần có sự cân bằng hợp lý "
+    "giữa phương pháp truyền thống và phương pháp mới. Kết thúc ngày làm việc đầu tiên, ban tổ chức đã ghi nhận hơn "
+    "ba mươi ý kiến đóng góp và cam kết tổng hợp thành báo cáo gửi lên các cơ quan quản lý. Hội nghị sẽ tiếp tục "
+    "vào ngày mai với các phiên chuyên đề về đào tạo giáo viên, phát triển học liệu số và hợp tác quốc tế. Nhiều "
+    "người kỳ vọng rằng những kết quả của hội nghị sẽ góp phần tạo nên một môi trường học tập hiện đại, công bằng "
+    "và hiệu quả hơn cho thế hệ trẻ Việt Nam trong những năm tới. Trước đó, bộ chủ quản cũng đã ban hành kế hoạch "
+    "hỗ trợ máy tính bảng cho học sinh vùng sâu vùng xa, dự kiến hoàn thành trong hai năm."
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="F5TTS_Base")
+    parser.add_argument("--ckpt_file", default="model/model_last.pt")
+    parser.add_argument("--vocab_file", default="model/vocab.txt")
+    parser.add_argument("--vocoder_name", default="vocos")
+    parser.add_argument("--ref_audio", default="ref.wav")
+    parser.add_argument("--ref_text", default="cả hai bên hãy cố gắng hiểu cho nhau")
+    parser.add_argument("--gen_file", default=None, help="text file to synthesize, default a built-in article")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--nfe_step", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.gen_file is not None:
+        with open(args.gen_file, encoding="utf-8") as f:
+            gen_text = f.read()
+    else:
+        gen_text = ARTICLE
+
+    model_cfg = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{args.model}.yaml"))).model
+    model_cls = globals()[model_cfg.backbone]
+    vocoder = load_vocoder(vocoder_name=args.vocoder_name)
+    model = load_model(model_cls, model_cfg.arch, args.ckpt_file, args.vocoder_name, args.vocab_file)
+
+    ref_audio, ref_text = preprocess_ref_audio_text(args.ref_audio, args.ref_text)
+
+    def run(batch_size):
+        return infer_process(
+            ref_audio,
+            ref_text,
+            gen_text,
+            model,
+            vocoder,
+            mel_spec_type=args.vocoder_name,
+            show_info=lambda *args: None,
+            progress=None,
+            nfe_step=args.nfe_step,
+            batch_size=batch_size,
+        )
+
+    run(1)  # warm up
+
+    print(f"\n{len(gen_text)} characters, device {device}\n")
+    baseline = None
+    for batch_size in args.batch_sizes:
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            wave, sr, _ = run(batch_size)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        elapsed = (time.perf_counter() - start) / args.repeat
+        baseline = baseline or elapsed
+
+        audio_duration = len(wave) / sr
+        memory = ""
+        if torch.cuda.is_available():
+            memory = f", peak memory {torch.cuda.max_memory_allocated() / 2**30:.2f} GiB"
+        print(
+            f"batch_size {batch_size}: {elapsed:.2f} s for {audio_duration:.1f} s audio, "
+            f"RTF {elapsed / audio_duration:.3f}, x{baseline / elapsed:.2f}{memory}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare mel lengths estimated for generation against the real ones, on a prepared dataset (raw.arrow):
+utf-8 byte ratio heuristic (before) vs. DurationPredictor (after).
+Each utterance is synthesized with the previous one as reference, frames estimated beyond the real length
+are generated and vocoded for nothing (trailing silence), frames short of it cut speech.
+
+python src/f5_tts/scripts/benchmark_duration_predictor.py --dataset_dir data/your_training_dataset \
+    --ckpt_file ckpts/your_training_dataset/model_last.pt
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+from datasets import Dataset as Dataset_
+
+from f5_tts.infer.utils_infer import device, hop_length, load_duration_predictor, target_sample_rate
+from f5_tts.model.utils import get_tokenizer
+
+
+def report(name, estimated, real):
+    error = estimated - real
+    wasted = np.clip(error, 0, None)
+    missing = np.clip(-error, 0, None)
+    print(
+        f"{name:>10}: mean abs error {np.abs(error).mean():7.1f} frames ({np.abs(error / real).mean() * 100:5.1f}%) | "
+        f"wasted {wasted.mean():7.1f} frames/request ({wasted.sum() / real.sum() * 100:5.1f}% of output) | "
+        f"short {missing.mean():7.1f} frames/request"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_dir", required=True, help="prepared dataset, with raw.arrow and vocab.txt")
+    parser.add_argument("--ckpt_file", required=True, help="checkpoint trained with a duration predictor")
+    parser.add_argument("--vocab_file", default=None, help="default vocab.txt in dataset_dir")
+    parser.add_argument("--num_pairs", type=int, default=1000)
+    args = parser.parse_args()
+
+    vocab_char_map, _ = get_tokenizer(args.vocab_file or os.path.join(args.dataset_dir, "vocab.txt"), "custom")
+    duration_predictor = load_duration_predictor(args.ckpt_file, vocab_char_map, device=device)
+
+    dataset = Dataset_.from_file(os.path.join(args.dataset_dir, "raw.arrow"))
+    num_pairs = min(args.num_pairs, len(dataset) - 1)
+    rows = dataset.select(range(num_pairs + 1))
+
+    texts = [list(text) for text in rows["text"]]
+    frames = np.array([int(duration * target_sample_rate / hop_length) for duration in rows["duration"]])
+
+    heuristic, predicted, real = [], [], []
+    for i in range(num_pairs):
+        ref_text, gen_text = texts[i], texts[i + 1]
+        ref_mel_len = frames[i]
+
+        # same as prepare_batch in infer_batch_process
+        ref_text_len = len("".join(ref_text).encode("utf-8"))
+        gen_text_len = len("".join(gen_text).encode("utf-8"))
+        heuristic.append(ref_mel_len + int(ref_mel_len / ref_text_len * gen_text_len))
+
+        predicted.append(duration_predictor.predict([ref_text + gen_text], len(ref_text), int(ref_mel_len)).item())
+        real.append(ref_mel_len + frames[i + 1])
+
+    heuristic, predicted, real = np.array(heuristic), np.array(predicted), np.array(real)
+    print(f"\n{num_pairs} requests, {(real - frames[:num_pairs]).mean():.1f} generated frames on average\n")
+    report("byte ratio", heuristic, real)
+    report("predictor", predicted, real)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark the per-call overhead of building the resampling kernel and the mel filterbank for every file, as
+CustomDataset, HFDataset, infer_batch_process, the voice registry and the eval prompts used to, vs. the transforms
+cached in modules.resampler_cache and modules.mel_stft_cache. Each call resamples a clip to 24 kHz and computes its
+log mel, as a training sample (on cpu) or a reference audio (on --device) is preprocessed.
+
+python src/f5_tts/scripts/benchmark_feature_cache.py --device cuda --sample_rates 16000 44100
+python src/f5_tts/scripts/benchmark_feature_cache.py --device cpu --seconds 2 10
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import torch
+import torchaudio
+
+from f5_tts.model.modules import MelSpec, resample
+
+
+def uncached_features(audio, sample_rate, device):
+    # resampler and mel transform built for each call
+    audio = torchaudio.transforms.Resample(sample_rate, 24000)(audio).to(device)
+    mel_stft = torchaudio.transforms.MelSpectrogram(
+        sample_rate=24000,
+        n_fft=1024,
+        win_length=1024,
+        hop_length=256,
+        n_mels=100,
+        power=1,
+        center=True,
+        normalized=False,
+        norm=None,
+    ).to(device)
+    return mel_stft(audio).clamp(min=1e-5).log()
+
+
+def cached_features(audio, sample_rate, device, mel_spec):
+    return mel_spec(resample(audio, sample_rate, 24000).to(device))
+
+
+def timed(fn, device, repeat):
+    fn()  # warm up, caches filled
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--sample_rates", type=int, nargs="+", default=[16000, 44100])
+    parser.add_argument("--seconds", type=float, nargs="+", default=[2.0, 10.0], help="clip durations")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    torch.set_num_threads(args.num_threads or torch.get_num_threads())
+
+    mel_spec, repeat = MelSpec(), args.repeat  # vocos mel, as the configs
+    print("\nresample to 24 kHz and log mel, per call\n")
+    for path, device in (("training", torch.device("cpu")), ("inference", torch.device(args.device))):
+        for sample_rate in args.sample_rates:
+            for seconds in args.seconds:
+                torch.manual_seed(0)
+                audio = 0.1 * torch.randn(1, int(seconds * sample_rate))
+                with torch.inference_mode():
+                    expected, before = timed(lambda: uncached_features(audio, sample_rate, device), device, repeat)
+                    mel, after = timed(lambda: cached_features(audio, sample_rate, device, mel_spec), device, repeat)
+                print(
+                    f"{path:<9} on {device.type}, {sample_rate:>5} Hz, {seconds:4.1f} s: "
+                    f"{before:7.2f} ms -> {after:7.2f} ms, overhead {before - after:6.2f} ms, "
+                    f"x{before / after:.2f}, same mel {torch.equal(mel, expected)}"
+                )
+
+
+if __name__ == "__main__":
+    main()
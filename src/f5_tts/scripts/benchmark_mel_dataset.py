@@ -0,0 +1,76 @@
+"""
+Benchmark training dataloader throughput: CustomDataset computing mels from the audio files (audio_type "raw") vs.
+reading mels precomputed by train/datasets/prepare_mel_shards.py from memory-mapped shards (audio_type "mel").
+Reports samples per second over random batches, collation included, and the deviation of the stored mels from
+those computed on the fly.
+
+python src/f5_tts/scripts/benchmark_mel_dataset.py data/your_dataset_pinyin --num_workers 0 4 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from importlib.resources import files
+
+sys.path.append(os.getcwd())
+
+import torch
+from omegaconf import OmegaConf
+from torch.utils.data import DataLoader
+
+from f5_tts.model.dataset import collate_fn, load_dataset
+
+
+def samples_per_second(dataset, args, num_workers):
+    generator = torch.Generator().manual_seed(0)
+    loader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=True,
+        generator=generator,
+        num_workers=num_workers,
+        collate_fn=collate_fn,
+    )
+    batches = iter(loader)
+    next(batches)  # warm up, workers started
+    start = time.perf_counter()
+    samples = 0
+    for _, batch in zip(range(args.num_batches), batches):
+        samples += len(batch["text"])
+    return samples / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset_dir", help="Prepared dataset, with raw.arrow, duration.json and mel/")
+    parser.add_argument("--model", default="F5TTS_v1_Base", help="Config to take the mel settings from")
+    parser.add_argument("--num_workers", type=int, nargs="+", default=[0, 4])
+    parser.add_argument("--batch_size", type=int, default=16, help="samples per batch")
+    parser.add_argument("--num_batches", type=int, default=50)
+    args = parser.parse_args()
+
+    mel_spec_kwargs = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{args.model}.yaml"))).model.mel_spec
+    datasets = {
+        audio_type: load_dataset(
+            args.dataset_dir, dataset_type="CustomDatasetPath", audio_type=audio_type, mel_spec_kwargs=mel_spec_kwargs
+        )
+        for audio_type in ("raw", "mel")
+    }
+
+    errors = []
+    for index in range(min(len(datasets["raw"]), 20)):
+        computed, stored = (datasets[audio_type][index]["mel_spec"] for audio_type in ("raw", "mel"))
+        errors.append((stored.float() - computed).abs().max().item())
+    print(f"\n{len(datasets['raw'])} samples, stored mels within {max(errors):.1e} of computed ones\n")
+
+    for num_workers in args.num_workers:
+        baseline = None
+        for audio_type, dataset in datasets.items():
+            throughput = samples_per_second(dataset, args, num_workers)
+            baseline = baseline or throughput
+            print(f"{num_workers} workers, {audio_type:<3}: {throughput:8.1f} samples/s, x{throughput / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark reference audio preprocessing (clip to ~12s + edge silence trimming):
+previous pydub path (per-ms python loop, temp file round-trip) vs. framed rms on in-memory tensors.
+
+python src/f5_tts/scripts/benchmark_preprocess_ref_audio.py original_voice_ref/*/*.wav
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+
+import torch.nn.functional as F
+import torchaudio
+from pydub import AudioSegment, silence
+
+from f5_tts.infer.utils_infer import clip_ref_audio, load_ref_audio, remove_silence_edges
+
+
+# previous implementation, kept here for reference
+
+
+def legacy_remove_silence_edges(audio, silence_threshold=-42):
+    non_silent_start_idx = silence.detect_leading_silence(audio, silence_threshold=silence_threshold)
+    audio = audio[non_silent_start_idx:]
+
+    non_silent_end_duration = audio.duration_seconds
+    for ms in reversed(audio):
+        if ms.dBFS > silence_threshold:
+            break
+        non_silent_end_duration -= 0.001
+    return audio[: int(non_silent_end_duration * 1000)]
+
+
+def legacy_preprocess(ref_audio_orig):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+        aseg = AudioSegment.from_file(ref_audio_orig)
+
+        for min_silence_len, silence_thresh in [(1000, -50), (100, -40)]:
+            non_silent_segs = silence.split_on_silence(
+                aseg, min_silence_len=min_silence_len, silence_thresh=silence_thresh, keep_silence=1000, seek_step=10
+            )
+            non_silent_wave = AudioSegment.silent(duration=0)
+            for non_silent_seg in non_silent_segs:
+                if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 12000:
+                    break
+                non_silent_wave += non_silent_seg
+            if len(non_silent_wave) <= 12000:
+                break
+        aseg = non_silent_wave[:12000]
+
+        aseg = legacy_remove_silence_edges(aseg) + AudioSegment.silent(duration=50)
+        aseg.export(f.name, format="wav")
+    audio, sr = torchaudio.load(f.name)
+    os.remove(f.name)
+    return audio, sr
+
+
+def preprocess(ref_audio_orig):
+    audio, sr = load_ref_audio(ref_audio_orig)
+    audio = clip_ref_audio(audio, sr, show_info=lambda *args: None)
+    audio = remove_silence_edges(audio, sr)
+    audio = F.pad(audio, (0, sr * 50 // 1000))
+    return audio, sr
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+", help="reference audio files")
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    total_legacy, total_new = 0.0, 0.0
+    for path in args.files:
+        timings = []
+        for fn in (legacy_preprocess, preprocess):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                audio, sr = fn(path)
+            timings.append((time.perf_counter() - start) / args.repeat)
+            timings.append(audio.shape[-1] / sr)
+        total_legacy += timings[0]
+        total_new += timings[2]
+        print(
+            f"{os.path.basename(path)}: legacy {timings[0] * 1000:.1f} ms -> {timings[1]:.3f}s audio | "
+            f"vectorized {timings[2] * 1000:.1f} ms -> {timings[3]:.3f}s audio | x{timings[0] / timings[2]:.1f}"
+        )
+
+    print(f"\ntotal: legacy {total_legacy * 1000:.1f} ms, vectorized {total_new * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark the peak memory of CFM.sample keeping the whole ode trajectory (return_trajectory=True, steps + 1 copies
+of the mel, as torchdiffeq.odeint returns it) vs. only the current state (default), for several batch sizes.
+Weights are randomly initialized unless a checkpoint is given, memory does not depend on them. Activations of a
+transformer block do not depend on depth, --depth can be lowered to get CPU numbers in reasonable time.
+
+python src/f5_tts/scripts/benchmark_sampling_memory.py --model F5TTS_v1_Base --device cuda --batch_sizes 1 8 32
+python src/f5_tts/scripts/benchmark_sampling_memory.py --model F5TTS_Small --device cpu --depth 2
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from importlib.resources import files
+
+sys.path.append(os.getcwd())
+
+import torch
+from omegaconf import OmegaConf
+
+from f5_tts.infer.utils_infer import hop_length, load_checkpoint, target_sample_rate
+from f5_tts.model import CFM, DiT, UNetT  # noqa: F401. used for config
+
+
+def build_model(args, device):
+    model_cfg = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{args.model}.yaml"))).model
+    model_cls = globals()[model_cfg.backbone]
+    arch = dict(model_cfg.arch)
+    if args.depth:
+        arch["depth"] = args.depth
+    model = CFM(
+        transformer=model_cls(**arch, text_num_embeds=256, mel_dim=model_cfg.mel_spec.n_mel_channels),
+        mel_spec_kwargs=model_cfg.mel_spec,
+        odeint_kwargs=dict(method=args.ode_method),
+    ).to(device)
+    if args.ckpt_file:
+        model = load_checkpoint(model, args.ckpt_file, device, use_ema=True)
+    return model
+
+
+def worker(args, batch_size, return_trajectory, results):
+    torch.set_num_threads(args.num_threads or torch.get_num_threads())
+    device = torch.device(args.device)
+    model = build_model(args, device)
+
+    ref_len = int(args.ref_seconds * target_sample_rate / hop_length)
+    duration = ref_len + int(args.gen_seconds * target_sample_rate / hop_length)
+    cond = torch.randn(batch_size, ref_len, model.num_channels, device=device)
+    text = torch.randint(0, 256, (batch_size, int((args.ref_seconds + args.gen_seconds) * 12)), device=device)
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start_memory = torch.cuda.memory_allocated()
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    model.sample(
+        cond,
+        text,
+        duration,
+        steps=args.nfe_step,
+        cfg_strength=2.0,
+        sway_sampling_coef=-1.0,
+        return_trajectory=return_trajectory,
+    )
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        peak_memory = (torch.cuda.max_memory_allocated() - start_memory) / 2**20
+    else:  # growth of the peak resident set over sampling, model weights excluded
+        peak_memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss) / 2**10
+    results.put((time.perf_counter() - start, peak_memory))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="F5TTS_v1_Base")
+    parser.add_argument("--ckpt_file", default=None)
+    parser.add_argument("--depth", type=int, default=None, help="override the number of transformer blocks")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--ref_seconds", type=float, default=3.0)
+    parser.add_argument("--gen_seconds", type=float, default=5.0)
+    parser.add_argument("--nfe_step", type=int, default=32)
+    parser.add_argument("--ode_method", default="euler")
+    args = parser.parse_args()
+
+    # one process per run, so that the peak memory of a run is not hidden by the previous one
+    context = multiprocessing.get_context("spawn")
+    depth = f", depth {args.depth}" if args.depth else ""
+    print(
+        f"\n{args.model}{depth} on {args.device}, {args.nfe_step} NFE, "
+        f"{args.ref_seconds}s reference + {args.gen_seconds}s generated\n"
+    )
+    for batch_size in args.batch_sizes:
+        baseline = None
+        for return_trajectory in (True, False):
+            results = context.Queue()
+            process = context.Process(target=worker, args=(args, batch_size, return_trajectory, results))
+            process.start()
+            elapsed, peak_memory = results.get()
+            process.join()
+            baseline = baseline or peak_memory
+            print(
+                f"batch {batch_size:>2} {'trajectory   ' if return_trajectory else 'current state'}: "
+                f"peak memory {peak_memory:8.0f} MiB ({peak_memory - baseline:+.0f} MiB), {elapsed:.1f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
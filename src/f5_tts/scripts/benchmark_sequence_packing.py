@@ -0,0 +1,141 @@
+"""
+Benchmark training steps (forward and backward of CFM) on padded batches vs. sequences packed into rows of
+--pack_length frames (Trainer(pack_length=...), DiT.forward_packed). Utterance durations are drawn uniformly between
+--min_seconds and --max_seconds; batches are either random (batch_size_type "sample") or of similar durations
+(--sorted, as DynamicBatchSampler of batch_size_type "frame" groups them). Reports the padding ratio of both layouts,
+throughput in real (non-padding) frames per second and peak memory. Weights are randomly initialized.
+
+python src/f5_tts/scripts/benchmark_sequence_packing.py --model F5TTS_v1_Base --device cuda --batch_size 16
+python src/f5_tts/scripts/benchmark_sequence_packing.py --model F5TTS_Small --device cpu --depth 2 --batch_size 8
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from importlib.resources import files
+
+sys.path.append(os.getcwd())
+
+import torch
+from omegaconf import OmegaConf
+
+from f5_tts.infer.utils_infer import hop_length, target_sample_rate
+from f5_tts.model import CFM, DiT  # noqa: F401. used for config
+from f5_tts.model.dataset import collate_fn
+
+
+def make_batches(args):
+    rng = random.Random(0)
+    min_frames, max_frames = (int(s * target_sample_rate / hop_length) for s in (args.min_seconds, args.max_seconds))
+    lengths = [rng.randint(min_frames, max_frames) for _ in range(args.batch_size * args.steps)]
+    if args.sorted:
+        lengths.sort()
+    return [lengths[i : i + args.batch_size] for i in range(0, len(lengths), args.batch_size)]
+
+
+def padding_ratio(batches, pack_length):
+    real = sum(sum(lengths) for lengths in batches)
+    padded = sum(len(lengths) * max(lengths) for lengths in batches)
+    packed = 0
+    for lengths in batches:
+        batch = collate_fn([{"mel_spec": torch.zeros(1, 1, n), "text": ""} for n in lengths], pack_length=pack_length)
+        packed += (batch["pack_rows"].max().item() + 1) * (batch["pack_offsets"] + batch["mel_lengths"]).max().item()
+    return 1 - real / padded, 1 - real / packed
+
+
+def worker(args, packed, results):
+    torch.set_num_threads(args.num_threads or torch.get_num_threads())
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+
+    model_cfg = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{args.model}.yaml"))).model
+    arch = dict(model_cfg.arch)
+    if args.depth:
+        arch["depth"] = args.depth
+    n_mels = model_cfg.mel_spec.n_mel_channels
+    model = CFM(
+        transformer=globals()[model_cfg.backbone](**arch, text_num_embeds=256, mel_dim=n_mels),
+        mel_spec_kwargs=model_cfg.mel_spec,
+    ).to(device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+
+    def train_step(lengths):
+        items = [{"mel_spec": torch.randn(1, n_mels, n), "text": [0] * (n // 8)} for n in lengths]
+        batch = collate_fn(items, pack_length=args.pack_length if packed else None)
+        pack = (batch["pack_rows"].to(device), batch["pack_offsets"].to(device)) if packed else None
+        text = torch.randint(0, 256, (len(lengths), max(lengths) // 8), device=device)
+        loss, _, _ = model(
+            batch["mel"].permute(0, 2, 1).to(device), text=text, lens=batch["mel_lengths"].to(device), pack=pack
+        )
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+    batches = make_batches(args)
+    train_step(batches[0])  # warm up
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start_memory = torch.cuda.memory_allocated()
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for lengths in batches:
+        train_step(lengths)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        peak_memory = (torch.cuda.max_memory_allocated() - start_memory) / 2**20
+    else:  # growth of the peak resident set over the timed steps
+        peak_memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss) / 2**10
+    elapsed = time.perf_counter() - start
+    results.put((sum(map(sum, batches)) / elapsed, elapsed / len(batches), peak_memory))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="F5TTS_v1_Base")
+    parser.add_argument("--depth", type=int, default=None, help="override the number of transformer blocks")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--batch_size", type=int, default=16, help="utterances per batch")
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--min_seconds", type=float, default=2.0)
+    parser.add_argument("--max_seconds", type=float, default=20.0)
+    parser.add_argument("--pack_length", type=int, default=None, help="default the frames of --max_seconds")
+    parser.add_argument("--sorted", action="store_true", help="batches of similar durations, as frame batching")
+    args = parser.parse_args()
+    args.pack_length = args.pack_length or int(args.max_seconds * target_sample_rate / hop_length)
+
+    padded_ratio, packed_ratio = padding_ratio(make_batches(args), args.pack_length)
+    depth = f", depth {args.depth}" if args.depth else ""
+    print(
+        f"\n{args.model}{depth} on {args.device}, batch {args.batch_size} of {args.min_seconds}-{args.max_seconds}s "
+        f"{'sorted' if args.sorted else 'random'} utterances, pack length {args.pack_length} frames\n"
+    )
+
+    # one process per run, so that the peak memory of a run is not hidden by the previous one
+    context = multiprocessing.get_context("spawn")
+    baseline = None
+    for packed, ratio in ((False, padded_ratio), (True, packed_ratio)):
+        results = context.Queue()
+        process = context.Process(target=worker, args=(args, packed, results))
+        process.start()
+        process.join()
+        label = "packed" if packed else "padded"
+        if process.exitcode != 0:  # e.g. killed out of memory
+            print(f"{label}: failed, exit code {process.exitcode}")
+            continue
+        frames_per_second, step_time, peak_memory = results.get()
+        baseline = baseline or frames_per_second
+        print(
+            f"{label}: padding {ratio:6.1%}, {frames_per_second:8.0f} frames/s (x{frames_per_second / baseline:.2f}), "
+            f"{step_time:.2f} s/step, peak memory {peak_memory:6.0f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark vocoding the mels of the chunks of a request: one vocoder call per chunk vs. a single vocode() call for
+all chunks, as infer_batch_process makes, with each vocoder dtype (autocast of the vocos backbone) and optionally
+torch.compile. Reports the time per request and the deviation of the waves from float32 decoding of each chunk
+alone, outside the last frames of the chunks, whose convolutions see the padding of the batch (see vocode). Vocos
+weights are randomly initialized with --random_weights, time does not depend on them.
+
+python src/f5_tts/scripts/benchmark_vocoder.py --device cuda --num_chunks 1 4 8 --dtypes float32 float16 --compile
+python src/f5_tts/scripts/benchmark_vocoder.py --device cpu --random_weights --dtypes float32 bfloat16
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import torch
+
+from f5_tts.infer.utils_infer import hop_length, load_vocoder, target_sample_rate, vocode
+from f5_tts.model.modules import MelSpec
+
+
+def build_vocoder(args, dtype=None, compile=False):
+    if not args.random_weights:
+        return load_vocoder(args.vocoder_name, device=args.device, dtype=dtype, compile=compile)
+
+    from vocos import Vocos
+    from vocos.feature_extractors import MelSpectrogramFeatures
+    from vocos.heads import ISTFTHead
+    from vocos.models import VocosBackbone
+
+    torch.manual_seed(0)
+    vocoder = Vocos(  # architecture of charactr/vocos-mel-24khz
+        MelSpectrogramFeatures(sample_rate=target_sample_rate, n_fft=1024, hop_length=hop_length, n_mels=100),
+        VocosBackbone(input_channels=100, dim=512, intermediate_dim=1536, num_layers=8),
+        ISTFTHead(dim=512, n_fft=1024, hop_length=hop_length),
+    )
+    vocoder = vocoder.eval().to(args.device)
+    vocoder.autocast_dtype = dtype
+    if compile:
+        vocoder.backbone.compile(dynamic=True)
+    return vocoder
+
+
+def timed(fn, device, repeat):
+    fn()  # warm up, compilation included
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vocoder_name", default="vocos", choices=["vocos", "bigvgan"])
+    parser.add_argument("--random_weights", action="store_true", help="vocos only, no download")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--dtypes", nargs="+", default=["float32", "float16"])
+    parser.add_argument("--compile", action="store_true")
+    parser.add_argument("--num_chunks", type=int, nargs="+", default=[1, 4, 8], help="chunks per request")
+    parser.add_argument("--chunk_seconds", type=float, default=6.0, help="longest chunk, others down to 2/3 of it")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    torch.set_num_threads(args.num_threads or torch.get_num_threads())
+    device = torch.device(args.device)
+
+    # log mels of random audio, roughly the statistics of real ones
+    max_frames = int(args.chunk_seconds * target_sample_rate / hop_length)
+    torch.manual_seed(0)
+    full = MelSpec(mel_spec_type=args.vocoder_name)(0.1 * torch.randn(1, max_frames * hop_length))[0].to(device)
+
+    print(f"\n{args.vocoder_name} on {args.device}, chunks of {args.chunk_seconds * 2 / 3:.1f}-{args.chunk_seconds}s\n")
+    reference = build_vocoder(args)
+    for num_chunks in args.num_chunks:
+        lens = torch.linspace(max_frames, max_frames * 2 / 3, num_chunks).long().tolist()
+        mels = [full[:, :n] for n in lens]
+        with torch.inference_mode():
+            decode = reference.decode if args.vocoder_name == "vocos" else reference
+            expected, baseline = timed(lambda: [decode(mel[None]).reshape(-1) for mel in mels], device, args.repeat)
+        print(f"{num_chunks} chunks, {'one call per chunk, float32':<30}: {baseline:8.1f} ms")
+
+        for dtype in args.dtypes:
+            vocoder = build_vocoder(args, None if dtype == "float32" else getattr(torch, dtype), args.compile)
+            waves, elapsed = timed(lambda: vocode(vocoder, mels, args.vocoder_name), device, args.repeat)
+            body = [slice(0, (n - 12) * hop_length) for n in lens]  # last frames see the padding, see vocode
+            error = max(
+                ((wave[s] - ref[s]).norm() / ref[s].norm()).item() for wave, ref, s in zip(waves, expected, body)
+            )
+            label = f"vocode, {dtype}{', compiled' if args.compile else ''}"
+            print(
+                f"{num_chunks} chunks, {label:<30}: {elapsed:8.1f} ms, x{baseline / elapsed:.2f}, "
+                f"relative error {error:.1e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,18 +11,18 @@ import wave
 from importlib.resources import files
 
 import torch
-import torchaudio
 from huggingface_hub import hf_hub_download
 from omegaconf import OmegaConf
 
 from f5_tts.model.backbones.dit import DiT  # noqa: F401. used for config
 from f5_tts.infer.utils_infer import (
-    chunk_text,
-    preprocess_ref_audio_text,
+    chunk_text_by_frames,
     load_vocoder,
     load_model,
     infer_batch_process,
+    max_chunk_frames,
 )
+from f5_tts.infer.voice_registry import VoiceRegistry
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -69,7 +69,17 @@ class AudioFileWriterThread(threading.Thread):
 
 
 class TTSStreamingProcessor:
-    def __init__(self, model, ckpt_file, vocab_file, ref_audio, ref_text, device=None, dtype=torch.float32):
+    def __init__(
+        self,
+        model,
+        ckpt_file,
+        vocab_file,
+        ref_audio,
+        ref_text,
+        device=None,
+        dtype=torch.float32,
+        vocoder_block_frames=128,
+    ):
         self.device = device or (
             "cuda"
             if torch.cuda.is_available()
@@ -84,9 +94,11 @@ class TTSStreamingProcessor:
         self.model_arc = model_cfg.model.arch
         self.mel_spec_type = model_cfg.model.mel_spec.mel_spec_type
         self.sampling_rate = model_cfg.model.mel_spec.target_sample_rate
+        self.vocoder_block_frames = vocoder_block_frames  # send audio of a chunk before the whole chunk is vocoded
 
         self.model = self.load_ema_model(ckpt_file, vocab_file, dtype)
         self.vocoder = self.load_vocoder_model()
+        self.voices = VoiceRegistry(self.model, device=self.device)
 
         self.update_reference(ref_audio, ref_text)
         self._warm_up()
@@ -109,20 +121,20 @@ class TTSStreamingProcessor:
         return load_vocoder(vocoder_name=self.mel_spec_type, is_local=False, local_path=None, device=self.device)
 
     def update_reference(self, ref_audio, ref_text):
-        self.ref_audio, self.ref_text = preprocess_ref_audio_text(ref_audio, ref_text)
-        self.audio, self.sr = torchaudio.load(self.ref_audio)
+        self.voice = self.voices.register("default", ref_audio, ref_text)
+        self.ref_text = self.voice.ref_text
 
-        ref_audio_duration = self.audio.shape[-1] / self.sr
-        ref_text_byte_len = len(self.ref_text.encode("utf-8"))
-        self.max_chars = int(ref_text_byte_len / (ref_audio_duration) * (25 - ref_audio_duration))
-        self.few_chars = int(ref_text_byte_len / (ref_audio_duration) * (25 - ref_audio_duration) / 2)
-        self.min_chars = int(ref_text_byte_len / (ref_audio_duration) * (25 - ref_audio_duration) / 4)
+        # mel frame budgets per chunk, reference included; smaller first chunks to start streaming sooner
+        ref_mel_len = self.voice.ref_mel_len
+        self.max_frames = max_chunk_frames
+        self.few_frames = ref_mel_len + (max_chunk_frames - ref_mel_len) // 2
+        self.min_frames = ref_mel_len + (max_chunk_frames - ref_mel_len) // 4
 
     def _warm_up(self):
         logger.info("Warming up the model...")
         gen_text = "Warm-up text for the model."
         for _ in infer_batch_process(
-            (self.audio, self.sr),
+            self.voice,
             self.ref_text,
             [gen_text],
             self.model,
@@ -130,19 +142,22 @@ class TTSStreamingProcessor:
             progress=None,
             device=self.device,
             streaming=True,
+            vocoder_block_frames=self.vocoder_block_frames,
         ):
             pass
         logger.info("Warm-up completed.")
 
     def generate_stream(self, text, conn):
-        text_batches = chunk_text(text, max_chars=self.max_chars)
+        ref_mel_len = self.voice.ref_mel_len
+        text_batches = chunk_text_by_frames(text, self.ref_text, ref_mel_len, max_frames=self.max_frames)
         if self.first_package:
-            text_batches = chunk_text(text_batches[0], max_chars=self.few_chars) + text_batches[1:]
-            text_batches = chunk_text(text_batches[0], max_chars=self.min_chars) + text_batches[1:]
+            for max_frames in (self.few_frames, self.min_frames):
+                first = chunk_text_by_frames(text_batches[0], self.ref_text, ref_mel_len, max_frames=max_frames)
+                text_batches = first + text_batches[1:]
             self.first_package = False
 
         audio_stream = infer_batch_process(
-            (self.audio, self.sr),
+            self.voice,
             self.ref_text,
             text_batches,
             self.model,
@@ -151,6 +166,7 @@ class TTSStreamingProcessor:
             device=self.device,
             streaming=True,
             chunk_size=2048,
+            vocoder_block_frames=self.vocoder_block_frames,
         )
 
         # Reset the file writer thread
@@ -245,6 +261,12 @@ if __name__ == "__main__":
 
     parser.add_argument("--device", default=None, help="Device to run the model on")
     parser.add_argument("--dtype", default=torch.float32, help="Data type to use for model inference")
+    parser.add_argument(
+        "--vocoder_block_frames",
+        type=int,
+        default=128,
+        help="Mel frames vocoded per block of a chunk, 0 to vocode whole chunks",
+    )
 
     args = parser.parse_args()
 
@@ -258,6 +280,7 @@ if __name__ == "__main__":
             ref_text=args.ref_text,
             device=args.device,
             dtype=args.dtype,
+            vocoder_block_frames=args.vocoder_block_frames or None,
         )
 
         # Start the server
@@ -0,0 +1,214 @@
+"""
+Ingest a corpus of audio files with their transcripts (<name>.wav and <name>.txt side by side) into a training dataset,
+in a single pass per file across a process pool: decode, mix down to mono and resample to 24 kHz, filter on duration
+and word count, normalize and convert the text, write the 24 kHz wav. Replaces running convert_sr.py,
+prepare_metadata.py, check_vocab_pretrained.py and prepare_csv_wavs.py one after another, which read every file
+about five times.
+
+Written to the output directory:
+    wavs/                   24 kHz mono 16-bit wavs, in the subdirectories of their source files
+    raw.arrow               training rows (audio_path, text, duration), streamed in record batches
+    duration.json           durations of the rows
+    metadata.csv            wavs/<name>.wav|<normalized text>, as prepare_csv_wavs.py reads it
+    vocab_dataset.txt       tokens of the converted texts
+    vocab_missing.txt       tokens missing from the pretrained vocab (fine-tuning only)
+    vocab.txt               pretrained vocab followed by the missing tokens, or the dataset vocab with --pretrain
+
+python src/f5_tts/train/datasets/ingest_dataset.py data/your_dataset data/your_training_dataset --workers 16
+"""
+
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+import argparse
+import json
+import time
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+
+import soundfile as sf
+import torch
+import torchaudio
+from datasets.arrow_writer import ArrowWriter
+from tqdm import tqdm
+
+from f5_tts.model.modules import resample
+from f5_tts.model.utils import convert_char_to_pinyin
+from f5_tts.train.datasets.prepare_csv_wavs import MAX_WORKERS, WRITER_BATCH_SIZE
+from f5_tts.train.datasets.vocab_tools import PRETRAINED_VOCAB_PATH, load_vocab, merge_vocabs, save_vocab
+
+
+TARGET_SAMPLE_RATE = 24000
+
+
+def normalize_text(text):
+    text = text.strip().lower()
+    text = text.replace("_", " ")
+    return " ".join(text.split())
+
+
+def load_audio(audio_path):
+    """Mono audio of a file and its sample rate, decoded with soundfile, or torchaudio for formats it can't read."""
+    try:
+        audio, sample_rate = sf.read(audio_path, dtype="float32", always_2d=True)
+        audio = torch.from_numpy(audio.T)
+    except Exception:
+        audio, sample_rate = torchaudio.load(audio_path)
+    return audio.mean(dim=0, keepdim=True), sample_rate
+
+
+def output_wav_name(audio_path, input_dir):
+    # path of the 24 kHz wav in wavs/, that of the source file in input_dir, so that recursive patterns can't have
+    # files of the same stem overwrite each other
+    return Path(audio_path).relative_to(input_dir).with_suffix(".wav")
+
+
+def ingest_file(audio_path, input_dir, wavs_dir, min_duration, max_duration, min_words, polyphone):
+    """
+    Training row of a source audio file and its normalized text, after writing its 24 kHz wav to wavs_dir, or None
+    and the reason it was skipped.
+    """
+    audio_path = Path(audio_path)
+    text_path = audio_path.with_suffix(".txt")
+    if not text_path.exists():
+        return None, "no transcript"
+    with open(text_path, "r", encoding="utf8") as f:
+        text = normalize_text(f.readline())
+    if len(text.split()) < min_words:
+        return None, "too few words"
+
+    try:
+        audio, sample_rate = load_audio(audio_path.as_posix())
+    except Exception as e:
+        print(f"Warning: Failed to decode {audio_path} due to error: {e}. Skipping corrupt file.")
+        return None, "corrupt audio"
+    duration = audio.shape[-1] / sample_rate
+    if duration < min_duration or duration > max_duration:
+        return None, "duration out of range"
+
+    audio = resample(audio, sample_rate, TARGET_SAMPLE_RATE)
+    wav_path = Path(wavs_dir) / output_wav_name(audio_path, input_dir)
+    wav_path.parent.mkdir(exist_ok=True, parents=True)
+    sf.write(wav_path.as_posix(), audio[0].numpy(), TARGET_SAMPLE_RATE, subtype="PCM_16")
+
+    row = dict(
+        audio_path=wav_path.as_posix(),
+        text=convert_char_to_pinyin([text], polyphone=polyphone)[0],
+        duration=audio.shape[-1] / TARGET_SAMPLE_RATE,
+    )
+    return row, text
+
+
+def init_worker():
+    torch.set_num_threads(1)  # one process per core already
+
+
+def ingest_dataset(
+    input_dir,
+    output_dir,
+    pattern="*.wav",
+    is_finetune=True,
+    pretrained_vocab_path=PRETRAINED_VOCAB_PATH,
+    min_duration=1.0,
+    max_duration=30.0,
+    min_words=3,
+    num_workers=None,
+):
+    if is_finetune:
+        assert os.path.exists(pretrained_vocab_path), f"pretrained vocab.txt not found: {pretrained_vocab_path}"
+    output_dir = Path(output_dir)
+    wavs_dir = output_dir / "wavs"
+    wavs_dir.mkdir(exist_ok=True, parents=True)
+
+    audio_paths = sorted(Path(input_dir).glob(pattern))
+    wav_names = {}
+    for audio_path in audio_paths:  # e.g. a.wav and a.flac with a pattern of both
+        wav_name = output_wav_name(audio_path, input_dir)
+        if wav_name in wav_names:
+            raise ValueError(f"{wav_names[wav_name]} and {audio_path} would both be written to wavs/{wav_name}")
+        wav_names[wav_name] = audio_path
+    worker_count = num_workers if num_workers is not None else max(1, min(MAX_WORKERS, len(audio_paths)))
+    print(f"\nIngesting {len(audio_paths)} audio files from {input_dir} using {worker_count} workers...")
+
+    process = partial(
+        ingest_file,
+        input_dir=input_dir,
+        wavs_dir=wavs_dir,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        min_words=min_words,
+        polyphone=True,
+    )
+    durations, vocab_set, skipped, rows = [], set(), {}, []
+
+    start = time.perf_counter()
+    writer = ArrowWriter(path=(output_dir / "raw.arrow").as_posix(), writer_batch_size=WRITER_BATCH_SIZE)
+    metadata = open(output_dir / "metadata.csv", "w", encoding="utf-8")
+    with Pool(worker_count, initializer=init_worker) as pool, writer, metadata:
+        metadata.write("audio_file|text\n")
+        for row, text in tqdm(pool.imap(process, audio_paths, chunksize=16), total=len(audio_paths)):
+            if row is None:
+                skipped[text] = skipped.get(text, 0) + 1
+                continue
+            metadata.write(f"wavs/{Path(row['audio_path']).relative_to(wavs_dir).as_posix()}|{text}\n")
+            durations.append(row["duration"])
+            vocab_set.update(row["text"])
+            rows.append(row)
+            if len(rows) == WRITER_BATCH_SIZE:
+                writer.write_batch({key: [row[key] for row in rows] for key in ("audio_path", "text", "duration")})
+                rows = []
+        if rows:
+            writer.write_batch({key: [row[key] for row in rows] for key in ("audio_path", "text", "duration")})
+        writer.finalize()
+    elapsed = time.perf_counter() - start
+
+    with open(output_dir / "duration.json", "w", encoding="utf-8") as f:
+        json.dump({"duration": durations}, f, ensure_ascii=False)
+
+    dataset_vocab = sorted(vocab_set)
+    save_vocab(output_dir / "vocab_dataset.txt", dataset_vocab)
+    if is_finetune:
+        vocab, missing = merge_vocabs(load_vocab(pretrained_vocab_path), dataset_vocab)
+        save_vocab(output_dir / "vocab_missing.txt", missing)
+        print(f"\n{len(missing)} tokens missing from the pretrained vocab, added to vocab.txt")
+    else:
+        vocab, _ = merge_vocabs([], dataset_vocab)
+    save_vocab(output_dir / "vocab.txt", vocab)
+
+    print(f"\nFor {output_dir.stem}, sample count: {len(durations)}, skipped: {skipped}")
+    print(f"For {output_dir.stem}, vocab size is: {len(dataset_vocab)}")
+    print(f"For {output_dir.stem}, total {sum(durations)/3600:.2f} hours")
+    print(f"{len(audio_paths)} files in {elapsed:.1f} s, {len(audio_paths) / max(elapsed, 1e-9):.1f} files/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a corpus of wavs and transcripts into a training dataset")
+    parser.add_argument("input_dir", type=str, help="Directory of <name>.wav and <name>.txt files")
+    parser.add_argument("output_dir", type=str, help="Training dataset directory, e.g. data/your_training_dataset")
+    parser.add_argument("--pattern", type=str, default="*.wav", help="Audio files to ingest, glob in input_dir")
+    parser.add_argument("--pretrain", action="store_true", help="Enable for new pretrain, otherwise is a fine-tune")
+    parser.add_argument("--pretrained_vocab", type=str, default=PRETRAINED_VOCAB_PATH)
+    parser.add_argument("--min_duration", type=float, default=1.0, help="Seconds")
+    parser.add_argument("--max_duration", type=float, default=30.0, help="Seconds")
+    parser.add_argument("--min_words", type=int, default=3)
+    parser.add_argument("--workers", type=int, help=f"Number of worker processes (default: {MAX_WORKERS})")
+    args = parser.parse_args()
+
+    ingest_dataset(
+        args.input_dir,
+        args.output_dir,
+        pattern=args.pattern,
+        is_finetune=not args.pretrain,
+        pretrained_vocab_path=args.pretrained_vocab,
+        min_duration=args.min_duration,
+        max_duration=args.max_duration,
+        min_words=args.min_words,
+        num_workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
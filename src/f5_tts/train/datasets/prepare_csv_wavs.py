@@ -1,11 +1,9 @@
 import os
 import sys
-import signal
-import subprocess  # For invoking ffprobe
-import shutil
+import time
 import concurrent.futures
 import multiprocessing
-from contextlib import contextmanager
+from itertools import repeat
 
 sys.path.append(os.getcwd())
 
@@ -15,6 +13,7 @@ import json
 from importlib.resources import files
 from pathlib import Path
 
+import soundfile as sf
 import torchaudio
 from tqdm import tqdm
 from datasets.arrow_writer import ArrowWriter
@@ -35,38 +34,16 @@ def is_csv_wavs_format(input_dataset_dir):
 
 
 # Configuration constants
-BATCH_SIZE = 100  # Batch size for text conversion
+BATCH_SIZE = 100  # Batch size for text conversion, per task of the process pool
 MAX_WORKERS = max(1, multiprocessing.cpu_count() - 1)  # Leave one CPU free
-THREAD_NAME_PREFIX = "AudioProcessor"
-CHUNK_SIZE = 100  # Number of files to process per worker batch
+THREAD_NAME_PREFIX = "AudioProbe"
+CHUNK_SIZE = 10000  # Number of files probed and converted between two progress checkpoints
+WRITER_BATCH_SIZE = 10000  # Rows per Arrow record batch
+PROGRESS_FILE = "prepare_progress.jsonl"  # In the output directory, to resume an interrupted run
 
-executor = None  # Global executor for cleanup
 
-
-@contextmanager
-def graceful_exit():
-    """Context manager for graceful shutdown on signals"""
-
-    def signal_handler(signum, frame):
-        print("\nReceived signal to terminate. Cleaning up...")
-        if executor is not None:
-            print("Shutting down executor...")
-            executor.shutdown(wait=False, cancel_futures=True)
-        sys.exit(1)
-
-    # Set up signal handlers
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-
-    try:
-        yield
-    finally:
-        if executor is not None:
-            executor.shutdown(wait=False)
-
-
-def process_audio_file(audio_path, text, polyphone):
-    """Process a single audio file by checking its existence and extracting duration."""
+def process_audio_file(audio_path):
+    """Duration of a single audio file, None if it is missing or corrupt."""
     if not Path(audio_path).exists():
         print(f"audio {audio_path} not found, skipping")
         return None
@@ -74,7 +51,7 @@ def process_audio_file(audio_path, text, polyphone):
         audio_duration = get_audio_duration(audio_path)
         if audio_duration <= 0:
             raise ValueError(f"Duration {audio_duration} is non-positive.")
-        return (audio_path, text, audio_duration)
+        return audio_duration
     except Exception as e:
         print(f"Warning: Failed to process {audio_path} due to error: {e}. Skipping corrupt file.")
         return None
@@ -90,8 +67,48 @@ def batch_convert_texts(texts, polyphone, batch_size=BATCH_SIZE):
     return converted_texts
 
 
-def prepare_csv_wavs_dir(input_dir, num_workers=None):
-    global executor
+class StageTimer:
+    """Files and wall-clock seconds spent in each stage, to report files/sec per stage."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, num_files, start):
+        files_done, seconds = self.stages.get(stage, (0, 0.0))
+        self.stages[stage] = (files_done + num_files, seconds + time.perf_counter() - start)
+
+    def report(self):
+        for stage, (files_done, seconds) in self.stages.items():
+            print(f"{stage:<16}: {files_done} files in {seconds:.1f} s, {files_done / max(seconds, 1e-9):.1f} files/s")
+
+
+def load_progress(progress_path, header):
+    """
+    Chunks completed by a previous run with the same metadata.csv and settings, {chunk index: rows}. Lines after the
+    last complete one (run interrupted while writing) are dropped from the file.
+    """
+    done = {}
+    if progress_path is None or not os.path.exists(progress_path):
+        return done
+    valid_bytes = 0
+    with open(progress_path, "rb") as f:
+        for i, line in enumerate(f):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if i == 0 and record != header:
+                print(f"Progress in {progress_path} is for another metadata.csv or settings, starting over")
+                return done
+            if i > 0:
+                done[record["chunk"]] = record["rows"]
+            valid_bytes += len(line)
+    with open(progress_path, "rb+") as f:
+        f.truncate(valid_bytes)
+    return done
+
+
+def prepare_csv_wavs_dir(input_dir, num_workers=None, progress_path=None):
     assert is_csv_wavs_format(input_dir), f"not csv_wavs format: {input_dir}"
     input_dir = Path(input_dir)
     metadata_path = input_dir / "metadata.csv"
@@ -99,55 +116,77 @@ def prepare_csv_wavs_dir(input_dir, num_workers=None):
 
     polyphone = True
     total_files = len(audio_path_text_pairs)
+    num_chunks = (total_files + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+    # Resume from the chunks checkpointed by an interrupted run
+    metadata_stat = metadata_path.stat()
+    header = dict(
+        metadata=metadata_path.resolve().as_posix(),
+        size=metadata_stat.st_size,
+        mtime=metadata_stat.st_mtime,
+        chunk_size=CHUNK_SIZE,
+        polyphone=polyphone,
+    )
+    done = load_progress(progress_path, header)
+    if done:
+        print(f"Resuming, {len(done)}/{num_chunks} chunks already processed")
 
     # Use provided worker count or calculate optimal number
-    worker_count = num_workers if num_workers is not None else min(MAX_WORKERS, total_files)
+    worker_count = num_workers if num_workers is not None else max(1, min(MAX_WORKERS, total_files))
     print(f"\nProcessing {total_files} audio files using {worker_count} workers...")
 
-    with graceful_exit():
-        # Initialize thread pool with optimized settings
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=worker_count, thread_name_prefix=THREAD_NAME_PREFIX
-        ) as exec:
-            executor = exec
-            results = []
-
-            # Process files in chunks for better efficiency
-            for i in range(0, len(audio_path_text_pairs), CHUNK_SIZE):
-                chunk = audio_path_text_pairs[i : i + CHUNK_SIZE]
-                # Submit futures in order
-                chunk_futures = [executor.submit(process_audio_file, pair[0], pair[1], polyphone) for pair in chunk]
-
-                # Iterate over futures in the original submission order to preserve ordering
-                for future in tqdm(
-                    chunk_futures,
-                    total=len(chunk),
-                    desc=f"Processing chunk {i//CHUNK_SIZE + 1}/{(total_files + CHUNK_SIZE - 1)//CHUNK_SIZE}",
-                ):
-                    try:
-                        result = future.result()
-                        if result is not None:
-                            results.append(result)
-                    except Exception as e:
-                        print(f"Error processing file: {e}")
-
-            executor = None
-
-    # Filter out failed results
-    processed = [res for res in results if res is not None]
+    timer = StageTimer()
+    progress = None
+    if progress_path is not None:
+        progress = open(progress_path, "a" if done else "w", encoding="utf-8")
+        if not done:
+            progress.write(json.dumps(header) + "\n")
+
+    # Durations from file headers in a thread pool (I/O bound), text conversion in a process pool (CPU bound)
+    probe = concurrent.futures.ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix=THREAD_NAME_PREFIX)
+    convert = concurrent.futures.ProcessPoolExecutor(max_workers=worker_count)
+    with probe, convert:
+        for chunk_index in tqdm(range(num_chunks), desc="Processing chunks"):
+            if chunk_index in done:
+                continue
+            chunk = audio_path_text_pairs[chunk_index * CHUNK_SIZE : (chunk_index + 1) * CHUNK_SIZE]
+
+            start = time.perf_counter()
+            durations = list(probe.map(process_audio_file, [audio_path for audio_path, _ in chunk]))
+            timer.add("probe durations", len(chunk), start)
+            kept = [(audio_path, text, d) for (audio_path, text), d in zip(chunk, durations) if d is not None]
+
+            start = time.perf_counter()
+            texts = [text for _, text, _ in kept]
+            text_batches = [texts[i : i + BATCH_SIZE] for i in range(0, len(texts), BATCH_SIZE)]
+            converted_texts = []
+            for converted_batch in convert.map(batch_convert_texts, text_batches, repeat(polyphone)):
+                converted_texts.extend(converted_batch)
+            timer.add("convert texts", len(kept), start)
+
+            done[chunk_index] = [
+                (audio_path, conv_text, duration)
+                for (audio_path, _, duration), conv_text in zip(kept, converted_texts)
+            ]
+            if progress is not None:
+                progress.write(json.dumps({"chunk": chunk_index, "rows": done[chunk_index]}, ensure_ascii=False) + "\n")
+                progress.flush()
+                os.fsync(progress.fileno())
+
+    if progress is not None:
+        progress.close()
+    timer.report()
+
+    processed = [row for chunk_index in range(num_chunks) for row in done[chunk_index]]
     if not processed:
         raise RuntimeError("No valid audio files were processed!")
 
-    # Batch process text conversion
-    raw_texts = [item[1] for item in processed]
-    converted_texts = batch_convert_texts(raw_texts, polyphone, batch_size=BATCH_SIZE)
-
     # Prepare final results
     sub_result = []
     durations = []
     vocab_set = set()
 
-    for (audio_path, _, duration), conv_text in zip(processed, converted_texts):
+    for audio_path, conv_text, duration in processed:
         sub_result.append({"audio_path": audio_path, "text": conv_text, "duration": duration})
         durations.append(duration)
         vocab_set.update(list(conv_text))
@@ -155,36 +194,20 @@ def prepare_csv_wavs_dir(input_dir, num_workers=None):
     return sub_result, durations, vocab_set
 
 
-def get_audio_duration(audio_path, timeout=5):
+def get_audio_duration(audio_path):
     """
-    Get the duration of an audio file in seconds using ffmpeg's ffprobe.
-    Falls back to torchaudio.load() if ffprobe fails.
+    Get the duration of an audio file in seconds from its header, with soundfile.
+    Falls back to decoding it with torchaudio.load() for formats soundfile cannot read.
     """
     try:
-        cmd = [
-            "ffprobe",
-            "-v",
-            "error",
-            "-show_entries",
-            "format=duration",
-            "-of",
-            "default=noprint_wrappers=1:nokey=1",
-            audio_path,
-        ]
-        result = subprocess.run(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True, timeout=timeout
-        )
-        duration_str = result.stdout.strip()
-        if duration_str:
-            return float(duration_str)
-        raise ValueError("Empty duration string from ffprobe.")
-    except (subprocess.TimeoutExpired, subprocess.SubprocessError, ValueError) as e:
-        print(f"Warning: ffprobe failed for {audio_path} with error: {e}. Falling back to torchaudio.")
+        return sf.info(audio_path).duration
+    except Exception as e:
+        print(f"Warning: soundfile failed for {audio_path} with error: {e}. Falling back to torchaudio.")
         try:
             audio, sample_rate = torchaudio.load(audio_path)
             return audio.shape[1] / sample_rate
         except Exception as e:
-            raise RuntimeError(f"Both ffprobe and torchaudio failed for {audio_path}: {e}")
+            raise RuntimeError(f"Both soundfile and torchaudio failed for {audio_path}: {e}")
 
 
 def read_audio_text_pairs(csv_file_path):
@@ -209,11 +232,17 @@ def save_prepped_dataset(out_dir, result, duration_list, text_vocab_set, is_fine
     out_dir.mkdir(exist_ok=True, parents=True)
     print(f"\nSaving to {out_dir} ...")
 
-    # Save dataset with improved batch size for better I/O performance
+    # Save dataset in large record batches
+    timer = StageTimer()
+    start = time.perf_counter()
     raw_arrow_path = out_dir / "raw.arrow"
-    with ArrowWriter(path=raw_arrow_path.as_posix(), writer_batch_size=100) as writer:
-        for line in tqdm(result, desc="Writing to raw.arrow ..."):
-            writer.write(line)
+    with ArrowWriter(path=raw_arrow_path.as_posix(), writer_batch_size=WRITER_BATCH_SIZE) as writer:
+        for i in tqdm(range(0, len(result), WRITER_BATCH_SIZE), desc="Writing to raw.arrow ..."):
+            rows = result[i : i + WRITER_BATCH_SIZE]
+            writer.write_batch({key: [row[key] for row in rows] for key in ("audio_path", "text", "duration")})
+        writer.finalize()
+    timer.add("write raw.arrow", len(result), start)
+    timer.report()
 
     # Save durations to JSON
     dur_json_path = out_dir / "duration.json"
@@ -236,21 +265,22 @@ def save_prepped_dataset(out_dir, result, duration_list, text_vocab_set, is_fine
     print(f"For {dataset_name}, total {sum(duration_list)/3600:.2f} hours")
 
 
-def prepare_and_save_set(inp_dir, out_dir, is_finetune: bool = True, num_workers: int = None):
+def prepare_and_save_set(inp_dir, out_dir, is_finetune: bool = True, num_workers: int = None, resume: bool = True):
     if is_finetune:
         assert PRETRAINED_VOCAB_PATH.exists(), f"pretrained vocab.txt not found: {PRETRAINED_VOCAB_PATH}"
-    sub_result, durations, vocab_set = prepare_csv_wavs_dir(inp_dir, num_workers=num_workers)
+    Path(out_dir).mkdir(exist_ok=True, parents=True)
+    progress_path = (Path(out_dir) / PROGRESS_FILE).as_posix()
+    if not resume and os.path.exists(progress_path):
+        os.remove(progress_path)
+    sub_result, durations, vocab_set = prepare_csv_wavs_dir(
+        inp_dir, num_workers=num_workers, progress_path=progress_path
+    )
     save_prepped_dataset(out_dir, sub_result, durations, vocab_set, is_finetune)
+    os.remove(progress_path)  # done, nothing left to resume
 
 
 def cli():
     try:
-        # Before processing, check if ffprobe is available.
-        if shutil.which("ffprobe") is None:
-            print(
-                "Warning: ffprobe is not available. Duration extraction will rely on torchaudio (which may be slower)."
-            )
-
         # Usage examples in help text
         parser = argparse.ArgumentParser(
             description="Prepare and save dataset.",
@@ -258,25 +288,35 @@ def cli():
 Examples:
     # For fine-tuning (default):
     python prepare_csv_wavs.py /input/dataset/path /output/dataset/path
-    
+
     # For pre-training:
     python prepare_csv_wavs.py /input/dataset/path /output/dataset/path --pretrain
-    
+
     # With custom worker count:
     python prepare_csv_wavs.py /input/dataset/path /output/dataset/path --workers 4
+
+    # Interrupted runs resume from the last checkpointed chunk, unless:
+    python prepare_csv_wavs.py /input/dataset/path /output/dataset/path --restart
             """,
         )
         parser.add_argument("inp_dir", type=str, help="Input directory containing the data.")
         parser.add_argument("out_dir", type=str, help="Output directory to save the prepared data.")
         parser.add_argument("--pretrain", action="store_true", help="Enable for new pretrain, otherwise is a fine-tune")
-        parser.add_argument("--workers", type=int, help=f"Number of worker threads (default: {MAX_WORKERS})")
+        parser.add_argument(
+            "--workers", type=int, help=f"Number of worker threads and processes (default: {MAX_WORKERS})"
+        )
+        parser.add_argument("--restart", action="store_true", help="Ignore the progress of an interrupted run")
         args = parser.parse_args()
 
-        prepare_and_save_set(args.inp_dir, args.out_dir, is_finetune=not args.pretrain, num_workers=args.workers)
+        prepare_and_save_set(
+            args.inp_dir,
+            args.out_dir,
+            is_finetune=not args.pretrain,
+            num_workers=args.workers,
+            resume=not args.restart,
+        )
     except KeyboardInterrupt:
-        print("\nOperation cancelled by user. Cleaning up...")
-        if executor is not None:
-            executor.shutdown(wait=False, cancel_futures=True)
+        print("\nOperation cancelled by user. Processed chunks are kept, run again to resume.")
         sys.exit(1)
 
 
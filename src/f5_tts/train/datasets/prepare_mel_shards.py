@@ -0,0 +1,186 @@
+"""
+Precompute the log mel spectrograms of a prepared dataset (raw.arrow and duration.json, e.g. from
+prepare_csv_wavs.py) into memory-mapped shards, for training with datasets.audio_type "mel" (see load_dataset).
+
+Audio is loaded and resampled by dataloader workers, mels are computed in batches of similar durations on --device
+and stored as fixed-dtype (default float16) d n blocks, appended to shard files of up to --shard_size_mb, in order
+of duration, as frame-wise batching reads them. Written to <dataset_dir>/mel/:
+    mel_00000.bin, ...  raw mel blocks
+    mel_index.npy       int64 (rows, 3), shard, element offset and frames of the mel of each row of raw.arrow
+    mel_info.json       dtype, shard names and the mel settings, checked against the training config
+
+Each audio of a batch is followed by its own reflection, as the stft pads it, so that its mel is the one CustomDataset
+would compute from it alone, up to float rounding.
+
+python src/f5_tts/train/datasets/prepare_mel_shards.py data/your_dataset_pinyin --model F5TTS_v1_Base --device cuda
+"""
+
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+import argparse
+import json
+import time
+from importlib.resources import files
+
+import numpy as np
+import torch
+import torchaudio
+from datasets import Dataset as Dataset_
+from datasets import load_from_disk
+from omegaconf import OmegaConf
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+from f5_tts.model.modules import MelSpec, resample
+
+
+class AudioFiles(Dataset):
+    """Mono audio at target_sample_rate of each file."""
+
+    def __init__(self, audio_paths, target_sample_rate):
+        self.audio_paths = audio_paths
+        self.target_sample_rate = target_sample_rate
+
+    def __len__(self):
+        return len(self.audio_paths)
+
+    def __getitem__(self, index):
+        audio, source_sample_rate = torchaudio.load(self.audio_paths[index])
+        if audio.shape[0] > 1:
+            audio = torch.mean(audio, dim=0, keepdim=True)
+        audio = resample(audio, source_sample_rate, self.target_sample_rate)
+        return index, audio[0]
+
+
+def make_batches(order, durations, batch_frames, hop_length, target_sample_rate):
+    # consecutive rows in order of duration, up to batch_frames padded frames per batch
+    batches, batch = [], []
+    for index in order:
+        frames = durations[index] * target_sample_rate / hop_length
+        if batch and (len(batch) + 1) * frames > batch_frames:
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def as_list(items):
+    return items
+
+
+def stft_padding(n_fft, hop_length, mel_spec_type):
+    # reflection padding of the audio on each side, see get_vocos_mel_spectrogram and get_bigvgan_mel_spectrogram
+    return n_fft // 2 if mel_spec_type == "vocos" else (n_fft - hop_length) // 2
+
+
+def mel_frames(num_samples, n_fft, hop_length, mel_spec_type):
+    return (num_samples + 2 * stft_padding(n_fft, hop_length, mel_spec_type) - n_fft) // hop_length + 1
+
+
+def prepare_mel_shards(
+    dataset_dir,
+    mel_spec_kwargs,
+    device="cpu",
+    dtype="float16",
+    batch_frames=16384,
+    shard_size_mb=1024,
+    num_workers=4,
+):
+    try:
+        dataset = load_from_disk(f"{dataset_dir}/raw")
+    except:  # noqa: E722
+        dataset = Dataset_.from_file(f"{dataset_dir}/raw.arrow")
+    with open(f"{dataset_dir}/duration.json", "r", encoding="utf-8") as f:
+        durations = json.load(f)["duration"]
+
+    mel_spec = MelSpec(**mel_spec_kwargs).to(device)
+    mel_settings = dict(
+        target_sample_rate=mel_spec.target_sample_rate,
+        n_mel_channels=mel_spec.n_mel_channels,
+        hop_length=mel_spec.hop_length,
+        win_length=mel_spec.win_length,
+        n_fft=mel_spec.n_fft,
+        mel_spec_type=mel_spec_kwargs.get("mel_spec_type", "vocos"),
+    )
+    audio_files = AudioFiles(dataset["audio_path"], mel_spec.target_sample_rate)
+    order = sorted(range(len(durations)), key=lambda i: durations[i])
+    batches = make_batches(order, durations, max(batch_frames, 1), mel_spec.hop_length, mel_spec.target_sample_rate)
+    loader = DataLoader(audio_files, batch_sampler=batches, num_workers=num_workers, collate_fn=as_list)
+
+    padding = stft_padding(mel_spec.n_fft, mel_spec.hop_length, mel_settings["mel_spec_type"])
+
+    mel_dir = f"{dataset_dir}/mel"
+    os.makedirs(mel_dir, exist_ok=True)
+    shard_elements = shard_size_mb * 2**20 // np.dtype(dtype).itemsize
+    shards, shard, shard_offset = [], None, 0
+    index = np.zeros((len(audio_files), 3), dtype=np.int64)
+
+    start = time.perf_counter()
+    total_frames = 0
+    with torch.inference_mode():
+        for items in tqdm(loader, desc=f"Computing mels on {device}"):
+            rows, audios = zip(*items)
+            lens = [audio.shape[-1] for audio in audios]
+            waves = torch.zeros(len(audios), max(lens) + padding)
+            for i, audio in enumerate(audios):
+                reflection = audio.flip(0)[1 : padding + 1]
+                waves[i, : lens[i]] = audio
+                waves[i, lens[i] : lens[i] + len(reflection)] = reflection
+            mels = mel_spec(waves.to(device)).to("cpu", torch.float32).numpy().astype(dtype)
+
+            for row, mel, num_samples in zip(rows, mels, lens):
+                frames = mel_frames(num_samples, mel_spec.n_fft, mel_spec.hop_length, mel_settings["mel_spec_type"])
+                mel = np.ascontiguousarray(mel[:, :frames])
+                if shard is None or shard_offset + mel.size > shard_elements:
+                    if shard is not None:
+                        shard.close()
+                    shards.append(f"mel_{len(shards):05d}.bin")
+                    shard, shard_offset = open(f"{mel_dir}/{shards[-1]}", "wb"), 0
+                shard.write(mel.tobytes())
+                index[row] = (len(shards) - 1, shard_offset, mel.shape[-1])
+                shard_offset += mel.size
+                total_frames += mel.shape[-1]
+    if shard is not None:
+        shard.close()
+    elapsed = time.perf_counter() - start
+
+    np.save(f"{mel_dir}/mel_index.npy", index)
+    info = dict(dtype=dtype, shards=shards, **mel_settings)
+    with open(f"{mel_dir}/mel_info.json", "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=4)
+
+    size_mb = total_frames * mel_spec.n_mel_channels * np.dtype(dtype).itemsize / 2**20
+    print(f"\n{len(audio_files)} mels, {total_frames} frames, {size_mb:.0f} MiB in {len(shards)} shards at {mel_dir}")
+    print(f"{elapsed:.1f} s, {len(audio_files) / elapsed:.1f} files/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute log mels of a prepared dataset into memory-mapped shards")
+    parser.add_argument("dataset_dir", type=str, help="Prepared dataset, with raw.arrow and duration.json")
+    parser.add_argument("--model", default="F5TTS_v1_Base", help="Config to take the mel settings from")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--dtype", default="float16", choices=["float16", "float32"], help="Stored mel dtype")
+    parser.add_argument("--batch_frames", type=int, default=16384, help="Padded frames per batch, 0 for one by one")
+    parser.add_argument("--shard_size_mb", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=4, help="Dataloader workers loading and resampling audio")
+    args = parser.parse_args()
+
+    model_cfg = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{args.model}.yaml"))).model
+    prepare_mel_shards(
+        args.dataset_dir,
+        dict(model_cfg.mel_spec),
+        device=args.device,
+        dtype=args.dtype,
+        batch_frames=args.batch_frames,
+        shard_size_mb=args.shard_size_mb,
+        num_workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
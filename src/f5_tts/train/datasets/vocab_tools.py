@@ -0,0 +1,309 @@
+"""
+Vocab management for fine-tuning on a new language: merge a dataset vocab into the pretrained one, expand the text
+embeddings of a pretrained checkpoint to the merged vocab, and report how much of a corpus a vocab covers.
+
+The pretrained vocab keeps its order, as the rows of the text embedding (offset by the filler token 0) follow it, and
+its first token is " ", which get_tokenizer() asserts. New tokens are deduplicated with a set and appended sorted.
+
+Expansion covers every text embedding of the checkpoint: EMA, online model and duration predictor weights, and the
+optimizer moments of these, which start at zero for the new rows. The optimizer state is keyed by parameter index,
+so training checkpoints need the model config to map it to parameter names. A .safetensors checkpoint is rewritten
+in one pass over its bytes, copying every tensor through and appending the new rows of the embeddings, so it is
+never loaded in memory. A .pt checkpoint is memory-mapped.
+
+python src/f5_tts/train/datasets/vocab_tools.py merge data/your_training_dataset/vocab_dataset.txt
+python src/f5_tts/train/datasets/vocab_tools.py expand ckpts/model_1250000.safetensors \
+    ckpts/your_training_dataset/pretrained_model_1250000.safetensors --vocab data/your_training_dataset/vocab.txt
+python src/f5_tts/train/datasets/vocab_tools.py expand ckpts/your_training_dataset/model_last.pt \
+    ckpts/your_training_dataset/model_last_expanded.pt --num_new_tokens 42 --model F5TTS_v1_Base
+python src/f5_tts/train/datasets/vocab_tools.py coverage data/your_training_dataset
+"""
+
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+import argparse
+import json
+import struct
+from collections import Counter
+from importlib.resources import files
+from pathlib import Path
+
+import torch
+from datasets import Dataset as Dataset_
+from omegaconf import OmegaConf
+
+import f5_tts.model
+
+
+PRETRAINED_VOCAB_PATH = "data/Emilia_ZH_EN_pinyin/vocab.txt"
+TEXT_EMBED_SUFFIX = "text_embed.weight"  # DiT, UNetT, MMDiT and the duration predictor
+EMBED_SEED = 666
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+SAFETENSORS_DTYPES = {"F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16}
+
+
+def load_vocab(vocab_path):
+    with open(vocab_path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def save_vocab(vocab_path, vocab):
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        f.writelines(f"{token}\n" for token in vocab)
+
+
+def merge_vocabs(base, *others):
+    """
+    Base vocab followed by the tokens of the other vocabs it lacks, deduplicated and sorted, and the list of these.
+    An empty base starts with " ".
+    """
+    base = list(base) or [" "]
+    if base[0] != " ":
+        raise ValueError(f"Base vocab must start with the space token, got {base[0]!r}")
+    tokens = set(base)
+    if len(tokens) != len(base):
+        raise ValueError(f"Base vocab has {len(base) - len(tokens)} duplicate tokens, its embedding rows are ambiguous")
+    missing = sorted({token for vocab in others for token in vocab if token} - tokens)
+    return base + missing, missing
+
+
+def is_text_embedding(key, tensor_shape):
+    return key.endswith(TEXT_EMBED_SUFFIX) and len(tensor_shape) == 2
+
+
+def new_embedding_rows(num_new_tokens, embed_dim, dtype, seed=EMBED_SEED):
+    # randn(num_new_tokens, embed_dim) after torch.manual_seed(seed), as finetune_gradio.py used to draw them
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn((num_new_tokens, embed_dim), generator=generator).to(dtype)
+
+
+def read_safetensors_header(ckpt_path):
+    with open(ckpt_path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    return header, 8 + header_size
+
+
+def expand_safetensors(ckpt_path, new_ckpt_path, num_new_tokens, seed=EMBED_SEED):
+    header, data_start = read_safetensors_header(ckpt_path)
+    metadata = header.pop("__metadata__", None)
+    keys = sorted(header, key=lambda key: header[key]["data_offsets"][0])
+
+    new_header, expanded, offset, vocab_rows = {}, {}, 0, None
+    for key in keys:
+        info = dict(header[key])
+        begin, end = info["data_offsets"]
+        size = end - begin
+        if is_text_embedding(key, info["shape"]):
+            rows, embed_dim = info["shape"]
+            expanded[key] = new_embedding_rows(num_new_tokens, embed_dim, SAFETENSORS_DTYPES[info["dtype"]], seed)
+            info["shape"] = [rows + num_new_tokens, embed_dim]
+            vocab_rows = vocab_rows or rows + num_new_tokens
+            size += expanded[key].numel() * expanded[key].element_size()
+        info["data_offsets"] = [offset, offset + size]
+        new_header[key] = info
+        offset += size
+    if not expanded:
+        raise KeyError(f"No text embedding (*{TEXT_EMBED_SUFFIX}) found in {ckpt_path}")
+    if metadata is not None:
+        new_header["__metadata__"] = metadata
+
+    header_bytes = json.dumps(new_header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)  # tensors 8-byte aligned, as safetensors writes them
+    with open(ckpt_path, "rb") as src, open(new_ckpt_path, "wb") as dst:
+        dst.write(struct.pack("<Q", len(header_bytes)))
+        dst.write(header_bytes)
+        for key in keys:
+            begin, end = header[key]["data_offsets"]
+            src.seek(data_start + begin)
+            remaining = end - begin
+            while remaining > 0:
+                chunk = src.read(min(remaining, COPY_CHUNK_SIZE))
+                dst.write(chunk)
+                remaining -= len(chunk)
+            if key in expanded:  # row-major, the new rows follow the old ones
+                dst.write(expanded[key].contiguous().view(torch.uint8).numpy().tobytes())
+    return vocab_rows
+
+
+def expand_state_dict(state_dict, num_new_tokens, seed=EMBED_SEED):
+    """Expands the text embeddings of a state dict in place, and returns their shapes before expansion by key."""
+    old_shapes = {}
+    for key, tensor in state_dict.items():
+        if isinstance(tensor, torch.Tensor) and is_text_embedding(key, tensor.shape):
+            new_rows = new_embedding_rows(num_new_tokens, tensor.shape[1], tensor.dtype, seed)
+            state_dict[key] = torch.cat((tensor, new_rows.to(tensor.device)))
+            old_shapes[key] = tensor.shape
+    return old_shapes
+
+
+def model_parameter_names(model_name, text_num_embeds):
+    """
+    Names of the parameters of the CFM model of a config, in the order the trainer's optimizer holds them. Built on
+    the meta device, as the state dict alone doesn't tell the parameters from the buffers.
+    """
+    model_cfg = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{model_name}.yaml"))).model
+    backbone = getattr(f5_tts.model, model_cfg.backbone)
+    with torch.device("meta"):
+        transformer = backbone(
+            **model_cfg.arch, text_num_embeds=text_num_embeds, mel_dim=model_cfg.mel_spec.n_mel_channels
+        )
+    return [f"transformer.{name}" for name, _ in transformer.named_parameters()]  # CFM has no others
+
+
+def expand_optimizer_state(optimizer_state_dict, param_names, old_shapes, num_new_tokens):
+    """
+    Pads with zeros the moments of the optimizer for the text embeddings. param_names are the names of the parameters
+    the optimizer was built with, in order, as its state is keyed by their index.
+    """
+    indices = [index for group in optimizer_state_dict["param_groups"] for index in group["params"]]
+    if len(indices) != len(param_names):
+        raise ValueError(f"Optimizer holds {len(indices)} parameters, the model has {len(param_names)}")
+    state = optimizer_state_dict["state"]
+    for index, name in zip(indices, param_names):
+        if name not in old_shapes or index not in state:
+            continue
+        for key, tensor in state[index].items():
+            if not isinstance(tensor, torch.Tensor) or tensor.ndim == 0:  # step
+                continue
+            if not tensor.is_floating_point() or tensor.shape != old_shapes[name]:
+                raise ValueError(
+                    f"Can't expand optimizer state {key} of {name}, {tensor.dtype} of shape {tuple(tensor.shape)}, "
+                    f"quantized (e.g. bnb_optimizer) or not a moment of the embedding"
+                )
+            state[index][key] = torch.cat((tensor, tensor.new_zeros((num_new_tokens, *tensor.shape[1:]))))
+
+
+def expand_text_embeddings(ckpt_path, new_ckpt_path, num_new_tokens, seed=EMBED_SEED, model_name=None):
+    """
+    Writes the checkpoint with num_new_tokens rows appended to every text embedding, drawn from a normal
+    distribution, the same rows for the EMA and online model, and returns the new number of rows.
+    model_name, the config of the checkpoint, is needed to expand the optimizer state of a training checkpoint.
+    """
+    ckpt_path, new_ckpt_path = str(ckpt_path), str(new_ckpt_path)
+    os.makedirs(os.path.dirname(os.path.abspath(new_ckpt_path)), exist_ok=True)
+    if ckpt_path.endswith(".safetensors"):
+        if not new_ckpt_path.endswith(".safetensors"):
+            raise ValueError(f"A .safetensors checkpoint is written as .safetensors, got {new_ckpt_path}")
+        return expand_safetensors(ckpt_path, new_ckpt_path, num_new_tokens, seed)
+    elif not ckpt_path.endswith(".pt"):
+        raise ValueError(f"Unsupported checkpoint format, expected .safetensors or .pt: {ckpt_path}")
+
+    ckpt = torch.load(ckpt_path, map_location="cpu", weights_only=True, mmap=True)
+    if "optimizer_state_dict" in ckpt and model_name is None:
+        raise ValueError(f"{ckpt_path} holds optimizer state, pass the model config (e.g. F5TTS_v1_Base) to expand it")
+    vocab_rows = None
+    for state_key, optimizer_key in (
+        ("ema_model_state_dict", None),
+        ("model_state_dict", "optimizer_state_dict"),
+        ("duration_predictor_state_dict", "duration_optimizer_state_dict"),
+    ):
+        if state_key not in ckpt:
+            continue
+        old_shapes = expand_state_dict(ckpt[state_key], num_new_tokens, seed)
+        if old_shapes and vocab_rows is None:
+            vocab_rows = next(iter(old_shapes.values()))[0] + num_new_tokens
+        if optimizer_key in ckpt:
+            if state_key == "model_state_dict":
+                param_names = model_parameter_names(model_name, vocab_rows - num_new_tokens - 1)
+                missing = set(param_names) - set(ckpt[state_key])
+                if missing:
+                    raise ValueError(
+                        f"{ckpt_path} doesn't match the {model_name} config, missing {sorted(missing)[:5]}"
+                    )
+            else:  # DurationPredictor has no buffers in its state dict
+                param_names = list(ckpt[state_key])
+            expand_optimizer_state(ckpt[optimizer_key], param_names, old_shapes, num_new_tokens)
+    if vocab_rows is None:
+        raise KeyError(f"No text embedding (*{TEXT_EMBED_SUFFIX}) found in {ckpt_path}")
+    torch.save(ckpt, new_ckpt_path)
+    return vocab_rows
+
+
+def corpus_token_counts(dataset_dir, batch_size=10000):
+    """Occurrences of every token in the texts of raw.arrow, as the tokenizer sees them."""
+    dataset = Dataset_.from_file(f"{dataset_dir}/raw.arrow").select_columns(["text"])
+    counts = Counter()
+    for batch in dataset.iter(batch_size=batch_size):
+        for text in batch["text"]:
+            counts.update(text)
+    return counts
+
+
+def token_coverage(counts, vocab):
+    tokens = set(vocab)
+    missing = Counter({token: count for token, count in counts.items() if token not in tokens})
+    total, distinct = sum(counts.values()), len(counts)
+    return dict(
+        vocab_size=len(vocab),
+        tokens=total,
+        distinct_tokens=distinct,
+        coverage=1 - sum(missing.values()) / max(total, 1),
+        distinct_coverage=1 - len(missing) / max(distinct, 1),
+        unused_vocab_tokens=len(tokens) - (distinct - len(missing)),
+        missing=missing.most_common(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge vocabs, expand checkpoint text embeddings, report coverage")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    merge_parser = subparsers.add_parser("merge", help="Append the tokens of dataset vocabs missing from the base one")
+    merge_parser.add_argument("dataset_vocabs", nargs="+", help="e.g. data/your_training_dataset/vocab_dataset.txt")
+    merge_parser.add_argument("--pretrained_vocab", type=str, default=PRETRAINED_VOCAB_PATH)
+    merge_parser.add_argument("--pretrain", action="store_true", help="Start from an empty vocab, for a new pretrain")
+    merge_parser.add_argument("--output", type=str, help="Merged vocab, vocab.txt next to the first dataset vocab")
+
+    expand_parser = subparsers.add_parser("expand", help="Append rows to the text embeddings of a checkpoint")
+    expand_parser.add_argument("ckpt_path", type=str, help=".safetensors or .pt checkpoint")
+    expand_parser.add_argument("new_ckpt_path", type=str, help="Expanded checkpoint, same format")
+    group = expand_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--num_new_tokens", type=int)
+    group.add_argument("--vocab", type=str, help="Merged vocab, rows added for the tokens beyond the pretrained vocab")
+    expand_parser.add_argument("--pretrained_vocab", type=str, default=PRETRAINED_VOCAB_PATH)
+    expand_parser.add_argument("--seed", type=int, default=EMBED_SEED)
+    expand_parser.add_argument("--model", type=str, help="Config of the checkpoint, needed with optimizer state")
+
+    coverage_parser = subparsers.add_parser("coverage", help="Report the share of corpus tokens in a vocab")
+    coverage_parser.add_argument("dataset_dir", type=str, help="Prepared dataset, with raw.arrow")
+    coverage_parser.add_argument("--vocab", type=str, help="Vocab to check, default vocab.txt of the dataset")
+    coverage_parser.add_argument("--report", type=str, help="JSON report, default vocab_coverage.json of the dataset")
+    coverage_parser.add_argument("--top", type=int, default=20, help="Most frequent missing tokens to print")
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        base = [] if args.pretrain else load_vocab(args.pretrained_vocab)
+        vocab, missing = merge_vocabs(base, *(load_vocab(path) for path in args.dataset_vocabs))
+        output = args.output or Path(args.dataset_vocabs[0]).with_name("vocab.txt")
+        save_vocab(output, vocab)
+        print(f"{len(missing)} tokens added, vocab of {len(vocab)} tokens saved at {output}")
+
+    elif args.command == "expand":
+        num_new_tokens = args.num_new_tokens
+        if num_new_tokens is None:
+            num_new_tokens = len(load_vocab(args.vocab)) - len(load_vocab(args.pretrained_vocab))
+        vocab_rows = expand_text_embeddings(
+            args.ckpt_path, args.new_ckpt_path, num_new_tokens, seed=args.seed, model_name=args.model
+        )
+        print(f"{num_new_tokens} rows added, text embeddings of {vocab_rows} rows saved at {args.new_ckpt_path}")
+
+    elif args.command == "coverage":
+        vocab = load_vocab(args.vocab or f"{args.dataset_dir}/vocab.txt")
+        report = token_coverage(corpus_token_counts(args.dataset_dir), vocab)
+        report_path = args.report or f"{args.dataset_dir}/vocab_coverage.json"
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n{report['tokens']} tokens, {report['distinct_tokens']} distinct, vocab of {report['vocab_size']}")
+        print(f"Coverage {report['coverage']:.4%} of tokens, {report['distinct_coverage']:.4%} of distinct tokens")
+        print(f"{len(report['missing'])} tokens missing, {report['unused_vocab_tokens']} vocab tokens unused")
+        for token, count in report["missing"][: args.top]:
+            print(f"    {token!r}: {count}")
+        print(f"Report saved at {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ from importlib.resources import files
 
 from cached_path import cached_path
 
-from f5_tts.model import CFM, UNetT, DiT, Trainer
+from f5_tts.model import CFM, UNetT, DiT, DurationPredictor, Trainer
 from f5_tts.model.utils import get_tokenizer
 from f5_tts.model.dataset import load_dataset
 
@@ -37,6 +37,16 @@ def parse_args():
         "--batch_size_type", type=str, default="frame", choices=["frame", "sample"], help="Batch size type"
     )
     parser.add_argument("--max_samples", type=int, default=64, help="Max sequences per batch")
+    parser.add_argument(
+        "--pack_length", type=int, default=None, help="Pack sequences into rows of this many frames, DiT only"
+    )
+    parser.add_argument(
+        "--audio_type",
+        type=str,
+        default="raw",
+        choices=["raw", "mel"],
+        help="Compute mels on the fly, or use mels precomputed with prepare_mel_shards.py",
+    )
     parser.add_argument("--grad_accumulation_steps", type=int, default=1, help="Gradient accumulation steps")
     parser.add_argument("--max_grad_norm", type=float, default=1.0, help="Max gradient norm for clipping")
     parser.add_argument("--epochs", type=int, default=1000, help="Number of training epochs")
@@ -71,6 +81,13 @@ def parse_args():
         action="store_true",
         help="Use 8-bit Adam optimizer from bitsandbytes",
     )
+    parser.add_argument(
+        "--duration_predictor",
+        action="store_true",
+        help="Also train a DurationPredictor, saved in the same checkpoints, for inference with --duration_predictor",
+    )
+    parser.add_argument("--duration_predictor_text_dim", type=int, default=256, help="DurationPredictor text dim")
+    parser.add_argument("--duration_predictor_conv_layers", type=int, default=4, help="DurationPredictor conv layers")
 
     return parser.parse_args()
 
@@ -181,6 +198,16 @@ def main():
         vocab_char_map=vocab_char_map,
     )
 
+    # optional duration predictor, trained alongside
+    duration_predictor = None
+    if args.duration_predictor:
+        duration_predictor = DurationPredictor(
+            text_num_embeds=vocab_size,
+            text_dim=args.duration_predictor_text_dim,
+            conv_layers=args.duration_predictor_conv_layers,
+            vocab_char_map=vocab_char_map,
+        )
+
     trainer = Trainer(
         model,
         args.epochs,
@@ -192,8 +219,10 @@ def main():
         batch_size_per_gpu=args.batch_size_per_gpu,
         batch_size_type=args.batch_size_type,
         max_samples=args.max_samples,
+        pack_length=args.pack_length,
         grad_accumulation_steps=args.grad_accumulation_steps,
         max_grad_norm=args.max_grad_norm,
+        duration_predictor=duration_predictor,
         logger=args.logger,
         wandb_project=args.dataset_name,
         wandb_run_name=args.exp_name,
@@ -203,7 +232,9 @@ def main():
         bnb_optimizer=args.bnb_optimizer,
     )
 
-    train_dataset = load_dataset(args.dataset_name, tokenizer, mel_spec_kwargs=mel_spec_kwargs)
+    train_dataset = load_dataset(
+        args.dataset_name, tokenizer, audio_type=args.audio_type, mel_spec_kwargs=mel_spec_kwargs
+    )
 
     trainer.train(
         train_dataset,
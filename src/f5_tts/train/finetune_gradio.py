@@ -26,10 +26,11 @@ import torchaudio
 from cached_path import cached_path
 from datasets import Dataset as Dataset_
 from datasets.arrow_writer import ArrowWriter
-from safetensors.torch import load_file, save_file
+from safetensors.torch import save_file
 
 from f5_tts.api import F5TTS
 from f5_tts.model.utils import convert_char_to_pinyin
+from f5_tts.train.datasets.vocab_tools import expand_text_embeddings, load_vocab, merge_vocabs, save_vocab
 from f5_tts.infer.utils_infer import transcribe
 
 
@@ -981,43 +982,6 @@ def extract_and_save_ema_model(checkpoint_path: str, new_checkpoint_path: str, s
         return f"An error occurred: {e}"
 
 
-def expand_model_embeddings(ckpt_path, new_ckpt_path, num_new_tokens=42):
-    seed = 666
-    random.seed(seed)
-    os.environ["PYTHONHASHSEED"] = str(seed)
-    torch.manual_seed(seed)
-    torch.cuda.manual_seed(seed)
-    torch.cuda.manual_seed_all(seed)
-    torch.backends.cudnn.deterministic = True
-    torch.backends.cudnn.benchmark = False
-
-    if ckpt_path.endswith(".safetensors"):
-        ckpt = load_file(ckpt_path, device="cpu")
-        ckpt = {"ema_model_state_dict": ckpt}
-    elif ckpt_path.endswith(".pt"):
-        ckpt = torch.load(ckpt_path, map_location="cpu")
-
-    ema_sd = ckpt.get("ema_model_state_dict", {})
-    embed_key_ema = "ema_model.transformer.text_embed.text_embed.weight"
-    old_embed_ema = ema_sd[embed_key_ema]
-
-    vocab_old = old_embed_ema.size(0)
-    embed_dim = old_embed_ema.size(1)
-    vocab_new = vocab_old + num_new_tokens
-
-    def expand_embeddings(old_embeddings):
-        new_embeddings = torch.zeros((vocab_new, embed_dim))
-        new_embeddings[:vocab_old] = old_embeddings
-        new_embeddings[vocab_old:] = torch.randn((num_new_tokens, embed_dim))
-        return new_embeddings
-
-    ema_sd[embed_key_ema] = expand_embeddings(ema_sd[embed_key_ema])
-
-    torch.save(ckpt, new_ckpt_path)
-
-    return vocab_new
-
-
 def vocab_count(text):
     return str(len(text.split(",")))
 
@@ -1038,30 +1002,14 @@ def vocab_extend(project_name, symbols, model_type):
     if symbols == []:
         return "Symbols to extend not found."
 
-    with open(file_vocab, "r", encoding="utf-8-sig") as f:
-        data = f.read()
-        vocab = data.split("\n")
-    vocab_check = set(vocab)
-
-    miss_symbols = []
-    for item in symbols:
-        item = item.replace(" ", "")
-        if item in vocab_check:
-            continue
-        miss_symbols.append(item)
+    vocab = load_vocab(file_vocab)
+    vocab_extended, miss_symbols = merge_vocabs(vocab, [item.replace(" ", "") for item in symbols])
 
     if miss_symbols == []:
         return "Symbols are okay no need to extend."
 
     size_vocab = len(vocab)
-    vocab.pop()
-    for item in miss_symbols:
-        vocab.append(item)
-
-    vocab.append("")
-
-    with open(file_vocab_project, "w", encoding="utf-8") as f:
-        f.write("\n".join(vocab))
+    save_vocab(file_vocab_project, vocab_extended)
 
     if model_type == "F5TTS_v1_Base":
         ckpt_path = str(cached_path("hf://SWivid/F5-TTS/F5TTS_v1_Base/model_1250000.safetensors"))
@@ -1079,7 +1027,7 @@ def vocab_extend(project_name, symbols, model_type):
     # Add pretrained_ prefix to model when copying for consistency with finetune_cli.py
     new_ckpt_file = os.path.join(new_ckpt_path, "pretrained_" + os.path.basename(ckpt_path))
 
-    size = expand_model_embeddings(ckpt_path, new_ckpt_file, num_new_tokens=vocab_size_new)
+    size = expand_text_embeddings(ckpt_path, new_ckpt_file, num_new_tokens=vocab_size_new, model_name=model_type)
 
     vocab_new = "\n".join(miss_symbols)
     return f"vocab old size : {size_vocab}\nvocab new size : {size}\nvocab add : {vocab_size_new}\nnew symbols :\n{vocab_new}"
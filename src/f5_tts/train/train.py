@@ -4,10 +4,12 @@ import os
 from importlib.resources import files
 
 import hydra
+import torch
 from omegaconf import OmegaConf
 
-from f5_tts.model import CFM, DiT, UNetT, Trainer  # noqa: F401. used for config
+from f5_tts.model import CFM, DiT, DurationPredictor, UNetT, Trainer  # noqa: F401. used for config
 from f5_tts.model.dataset import load_dataset
+from f5_tts.model.modules import check_attn_backend
 from f5_tts.model.utils import get_tokenizer
 
 os.chdir(str(files("f5_tts").joinpath("../..")))  # change working directory to root of project (local editable)
@@ -31,12 +33,22 @@ def main(cfg):
     vocab_char_map, vocab_size = get_tokenizer(tokenizer_path, tokenizer)
 
     # set model
+    if "attn_backend" in model_arc:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model_arc = {**model_arc, "attn_backend": check_attn_backend(model_arc.attn_backend, device)}
     model = CFM(
         transformer=model_cls(**model_arc, text_num_embeds=vocab_size, mel_dim=cfg.model.mel_spec.n_mel_channels),
         mel_spec_kwargs=cfg.model.mel_spec,
         vocab_char_map=vocab_char_map,
     )
 
+    # optional duration predictor, trained alongside
+    duration_predictor = None
+    if cfg.model.get("duration_predictor") is not None:
+        duration_predictor = DurationPredictor(
+            **cfg.model.duration_predictor, text_num_embeds=vocab_size, vocab_char_map=vocab_char_map
+        )
+
     # init trainer
     trainer = Trainer(
         model,
@@ -49,8 +61,10 @@ def main(cfg):
         batch_size_per_gpu=cfg.datasets.batch_size_per_gpu,
         batch_size_type=cfg.datasets.batch_size_type,
         max_samples=cfg.datasets.max_samples,
+        pack_length=cfg.datasets.get("pack_length"),
         grad_accumulation_steps=cfg.optim.grad_accumulation_steps,
         max_grad_norm=cfg.optim.max_grad_norm,
+        duration_predictor=duration_predictor,
         logger=cfg.ckpts.logger,
         wandb_project="CFM-TTS",
         wandb_run_name=exp_name,
@@ -64,7 +78,12 @@ def main(cfg):
         cfg_dict=OmegaConf.to_container(cfg, resolve=True),
     )
 
-    train_dataset = load_dataset(cfg.datasets.name, tokenizer, mel_spec_kwargs=cfg.model.mel_spec)
+    train_dataset = load_dataset(
+        cfg.datasets.name,
+        tokenizer,
+        audio_type=cfg.datasets.get("audio_type", "raw"),
+        mel_spec_kwargs=cfg.model.mel_spec,
+    )
     trainer.train(
         train_dataset,
         num_workers=cfg.datasets.num_workers,